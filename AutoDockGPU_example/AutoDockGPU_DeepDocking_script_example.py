@@ -2,8 +2,9 @@
 
 import time
 import os
+import sys
 import subprocess
-import pandas as pd
+from functools import partial
 
 # Before running the script:
 # The map.fld (grid) file for the protein has to be created by AutoGrid
@@ -48,7 +49,23 @@ num_it = 3
 ttime = '00-04:00'                                                                   			# Time of set training (in minutes) (default is 00-04:00)
 num_hyp = 12                                                                        			# Number of hyperparameters (default is 12)
 rec_val = 0.9                                                                       			# Recall value (default is 0.9)
-starting_it = 1                                                                     			# In case of an error that stops the workflow, the starting iteration can be set to another number (default is 1)
+starting_it = 1                                                                     			# First iteration of the workflow (default is 1). A stopped workflow does not need it: the completed steps are skipped when the script is run again
+ligand_cache = ''                                                                   			# Folder of the cache of prepared 3D ligands, shared by the iterations and the test/train/valid sets (default is '', no cache)
+ligand_cache_size = 10                                                              			# Maximum size of the ligand cache in GB (default is 10)
+score_store = ''                                                                    			# SQLite file storing the docking scores, molecules docked in an earlier iteration or run are not docked again (default is '', no score store)
+smiles_index = 'no'                                                                    			# Extract the smiles of the sampled molecules with the ID index of the split smiles files (WorkFlow_smiles_index.py)? yes/no (default is no)
+pipeline = 'no'                                                                     			# Dock small batches while the other ligands are being prepared? yes/no (default is no)
+batch_size = 0                                                                      			# Number of ligands in one docking batch, the GPUs take the next batch from a shared queue (default is 0: the sets are divided into sj subjobs, or 100 ligand batches if pipeline is set to yes)
+prep_chunk = 10                                                                     			# Number of ligands in one ligand preparation task, the CPUs take the next task from a shared queue (default is 10)
+cost_batching = 'no'                                                                			# Sort the ligands by their estimated docking cost (heavy atoms and torsions), so the subjobs contain ligands of similar size and the GPUs get equal total cost? yes/no (default is no)
+prefilter = 'no'                                                                    			# Drop the ligands which cannot fit into the grid box in any orientation (CPU check) before the docking? yes/no (default is no)
+parallel_steps = 2                                                                  			# Number of workflow steps run at the same time, e.g. Extracting_morgan and Extracting_smiles (default is 2)
+job_slots = 4                                                                       			# Number of simple_job scripts (model trainings) run at the same time (default is 4)
+job_gpus = ''                                                                       			# Comma separated GPU devices for the simple_job and simple_job_predictions scripts, every running job uses one device (default is '', the jobs are not bound to devices)
+prediction_slots = 4                                                                			# Number of simple_job_predictions scripts (predictions of the library) run at the same time (default is 4)
+prediction_memory = 0                                                               			# Memory of one prediction job in GB, a job only starts if this much memory is available (default is 0, no memory limit)
+trace = 'no'                                                                        			# Write the stage times of every ligand (preparation, docking and parsing) into iteration_{i}/ligand_trace.jsonl? yes/no, summary: python WorkFlow_trace.py -i ligand_trace.jsonl (default is no)
+metrics_folder = ''                                                                 			# Folder of the Prometheus metrics files of the workflow and the docking (uhtvs_{project_name}_workflow.prom and _docking.prom), e.g. the textfile collector folder of the node exporter (default is '', no metrics)
 
 start_time = time.time()
 
@@ -59,17 +76,13 @@ txt2 = "python {}phase_1/sampling.py -pt {} -fp {} -it {} -dd {} -t_pos {} -tr_s
 txt3 = "python {}phase_1/sanity_check.py -pt {} -fp {} -it {}"
 txt4 = "python {}phase_1/Extracting_morgan.py -pt {} -fp {} -it {} -md {} -t_pos {}"
 txt5 = "python {}phase_1/Extracting_smiles.py -pt {} -fp {} -it {} -smd {} -t_pos {}"
-txt6_test = "python {}AutoDockGPU_WorkFlow_smiles2score_main.py -i {}{}/iteration_{}/smile/test_smiles_final_updated.smi -f {} -o {}{}/iteration_{}/testing_labels_pre.txt -map {} -gpudev {} -nc {} -sj {} -prot {} -loc {} -d {} -v {}"
-txt6_train = "python {}AutoDockGPU_WorkFlow_smiles2score_main.py -i {}{}/iteration_{}/smile/train_smiles_final_updated.smi -f {} -o {}{}/iteration_{}/training_labels_pre.txt -map {} -gpudev {} -nc {} -sj {} -prot {} -loc {} -d {} -v {}"
-txt6_valid = "python {}AutoDockGPU_WorkFlow_smiles2score_main.py -i {}{}/iteration_{}/smile/valid_smiles_final_updated.smi -f {} -o {}{}/iteration_{}/validation_labels_pre.txt -map {} -gpudev {} -nc {} -sj {} -prot {} -loc {} -d {} -v {}"
+txt5_index = "python {}WorkFlow_smiles_index.py -pt {} -fp {} -it {} -smd {} -t_pos {}"
+txt6 = "python {}AutoDockGPU_WorkFlow_smiles2score_main.py -i {} -f {} -o {} -l {} -map {} -gpudev {} -nc {} -sj {} -prot {} -loc {} -d {} -v {} -pipe {} -bs {} -pc {} -cost {} -cache '{}' -cs {} -store '{}' -pf {} -trace '{}' -it {} -metrics '{}'"
 txt7 = "python {}phase_2-3/simple_job_models.py -n_it {} -mdd {} -time {} -file_path {}{}/ -nhp {} -titr {} -n_mol {} --percent_first_mols {} -ct {} --percent_last_mols {}"
 txt8 = "python -u {}phase_2-3/hyperparameter_result_evaluation.py -n_it {} --data_path {}{}/ -mdd {}"
 txt9 = "python {}phase_2-3/simple_job_predictions.py --protein {} -file_path {}{} -n_it {} -mdd {}"
 txt10 = "python {}final_phase/final_extraction.py -smile_dir {} -prediction_dir {}{}/iteration_{}/morgan_1024_predictions/ -processors {} -mols_to_dock {}"
 
-# Variable to set from where to continue
-cont = 0
-
 
 print("DeepDocking workflow has been started with a total of {} iterations".format(num_it))
 
@@ -85,179 +98,87 @@ out = subprocess.check_output(copying3.format(dd_loc, cwd), shell=True, universa
 copying4 = "cp {}phase_2-3/Prediction_morgan_1024.py {}/"
 out = subprocess.check_output(copying4.format(dd_loc, cwd), shell=True, universal_newlines=True)
 
-# Starting the iterations
+# The steps of the iterations are run by the step engine (WorkFlow_steps.py): a step starts when the steps producing its inputs are completed, and independent steps run at the same time (at most parallel_steps)
+# The completed steps and their wall times are recorded in workflow_steps.jsonl of the project folder, if the script is run again the completed steps are skipped and the workflow continues where it was stopped
+
+sys.path.insert(0, autodock_workflow_script_loc)
+from WorkFlow_steps import Step, StepRunner
+from WorkFlow_jobs import run_job_scripts
+from WorkFlow_metrics import MetricsFile, step_collector
+
+runner = StepRunner("{}{}/workflow_steps.jsonl".format(project_folder_loc, project_name), parallel_steps)
+
+# The progress of the workflow (completed and running steps, current iteration, ETA) and of the docking (ligands prepared, docked and dropped, GPU busy times, queue depths, ETA) is written into Prometheus text files in metrics_folder
+# The files are updated every 15 seconds, they can be read with python WorkFlow_metrics.py -i {file} or scraped by the textfile collector of the node exporter
+
+metrics = MetricsFile(os.path.join(metrics_folder, "uhtvs_{}_workflow.prom".format(project_name)) if metrics_folder else "", {"project": project_name})
+metrics.collect(step_collector(runner))
+docking_metrics = os.path.join(metrics_folder, "uhtvs_{}_docking.prom".format(project_name)) if metrics_folder else ""
 
 for i in range(starting_it, num_it+1):
-    os.system('clear')
-    print("Now doing the {}. iteration out of a total of {}".format(i, num_it))
+    it = "iteration_{}/".format(i)
+    iteration_folder = "{}{}/iteration_{}/".format(project_folder_loc, project_name, i)
+    sets = [iteration_folder + "{}_set.txt".format(data_set) for data_set in ("train", "valid", "test")]
+    smiles = [iteration_folder + "smile/{}_smiles_final_updated.smi".format(data_set) for data_set in ("test", "train", "valid")]
+    labels = [iteration_folder + "{}_labels.txt".format(data_set) for data_set in ("testing", "training", "validation")]
+    prediction_directory = "{}{}/iteration_{}/morgan_1024_predictions/".format(project_folder_loc, project_name, i)
 
     # Phase 1
-    if cont == 0:
-      if i == 1:  #for first iteration
-          first_it_sampled_num = 3*sampled_num
-          out = subprocess.check_output(txt1.format(dd_loc, project_name, i, morgan_loc, num_cpus, first_it_sampled_num), shell=True, universal_newlines=True)
-          out = subprocess.check_output(txt2.format(dd_loc, project_name, project_folder_loc, i, morgan_loc, num_cpus, sampled_num, sampled_num), shell=True, universal_newlines=True)
-      else:       #for other iterations
-          new_cdd_loc = "{}{}/iteration_{}/morgan_1024_predictions/".format(project_folder_loc, project_name, i-1)
-          out = subprocess.check_output(txt1.format(dd_loc, project_name, i, new_cdd_loc, num_cpus, sampled_num), shell=True, universal_newlines=True)
-          out = subprocess.check_output(txt2.format(dd_loc, project_name, project_folder_loc, i, new_cdd_loc, num_cpus, sampled_num, sampled_num), shell=True, universal_newlines=True)
-      out = subprocess.check_output(txt3.format(dd_loc, project_name, project_folder_loc, i), shell=True, universal_newlines=True)
-      out = subprocess.check_output(txt4.format(dd_loc, project_name, project_folder_loc2, i, morgan_loc, num_cpus), shell=True, universal_newlines=True)
-      out = subprocess.check_output(txt5.format(dd_loc, project_name, project_folder_loc, i, smiles_loc, num_cpus), shell=True, universal_newlines=True)
-  
-      # Changing tab to space in the .smi files
-  
-      with open('{}{}/iteration_{}/smile/test_smiles_final_updated.smi'.format(project_folder_loc, project_name, i), "r") as ofile1:
-          data1 = ofile1.read()
-          data1 = data1.replace('\t',' ')
-      with open('{}{}/iteration_{}/smile/test_smiles_final_updated.smi'.format(project_folder_loc, project_name, i), "w") as ofile1:
-          ofile1.write(data1)
-      ofile1.close()
-  
-      with open('{}{}/iteration_{}/smile/train_smiles_final_updated.smi'.format(project_folder_loc, project_name, i), "r") as ofile2:
-          data2 = ofile2.read()
-          data2 = data2.replace('\t',' ')
-      with open('{}{}/iteration_{}/smile/train_smiles_final_updated.smi'.format(project_folder_loc, project_name, i), "w") as ofile2:
-          ofile2.write(data2)
-      ofile2.close()
-  
-      with open('{}{}/iteration_{}/smile/valid_smiles_final_updated.smi'.format(project_folder_loc, project_name, i), "r") as ofile3:
-          data3 = ofile3.read()
-          data3 = data3.replace('\t',' ')
-      with open('{}{}/iteration_{}/smile/valid_smiles_final_updated.smi'.format(project_folder_loc, project_name, i), "w") as ofile3:
-          ofile3.write(data3)
-      ofile3.close()
-      
-      # Usage of the AutoDockGPU workflow
-
-      out = subprocess.check_output(txt6_test.format(autodock_workflow_script_loc, project_folder_loc, project_name,  i, autodock_workflow_script_loc, project_folder_loc, project_name, i, ad_grid, gpus, cpus, sj, proton, conf, remove, verbosity), shell=True, universal_newlines=True)
-      out = subprocess.check_output(txt6_train.format(autodock_workflow_script_loc, project_folder_loc, project_name, i, autodock_workflow_script_loc, project_folder_loc, project_name, i, ad_grid, gpus, cpus, sj, proton, conf, remove, verbosity), shell=True, universal_newlines=True)
-      out = subprocess.check_output(txt6_valid.format(autodock_workflow_script_loc, project_folder_loc, project_name, i, autodock_workflow_script_loc, project_folder_loc, project_name, i, ad_grid, gpus, cpus, sj, proton, conf, remove, verbosity), shell=True, universal_newlines=True)
-      
-      # Reformatting the label .txt files
-  
-      col1 = []
-      col2 = []
-      a = 0
-
-      rewrite_test = open("{}{}/iteration_{}/testing_labels_pre.txt".format(project_folder_loc, project_name, i),"r")
-      new_label_test = open("{}{}/iteration_{}/testing_labels.txt".format(project_folder_loc, project_name, i),"w")
-  
-      for row in rewrite_test: 
-          if row == "ZINC_ID r_i_docking_score\n":
-              pass
-          else:
-              a += 1
-              rowsplit1 = row.replace("\n", "")
-              rowsplit2 = rowsplit1.split(" ")
-              rowsplit2.reverse()
-              col1.append(float(rowsplit2[0]))
-              col2.append(rowsplit2[1])
-      df = pd.DataFrame({'col1':col1, 'col2':col2})
-      dfsorted = df.sort_values(by='col1')
-      dfsorted = dfsorted.reset_index(drop=True)
-      new_label_test.write("r_i_docking_score,ZINC_ID\n") 
-      for row2 in range(a):
-          row_list = dfsorted.loc[row2, :].values.flatten().tolist()
-          newrow = str(row_list[0]) + "," + str(row_list[1]) + "\n"
-          new_label_test.write(newrow) 
-      col1.clear()
-      col2.clear()
-      a = 0
-  
-      rewrite_test.close()
-      os.remove("{}{}/iteration_{}/testing_labels_pre.txt".format(project_folder_loc, project_name, i))
-      new_label_test.close()
-  
-      rewrite_train = open("{}{}/iteration_{}/training_labels_pre.txt".format(project_folder_loc, project_name, i),"r")
-      new_label_train = open("{}{}/iteration_{}/training_labels.txt".format(project_folder_loc, project_name, i),"w")
-  
-      for row in rewrite_train:
-          if row == "ZINC_ID r_i_docking_score\n":
-              pass
-          else:
-              a += 1
-              rowsplit1 = row.replace("\n", "")
-              rowsplit2 = rowsplit1.split(" ")
-              rowsplit2.reverse()
-              col1.append(float(rowsplit2[0]))
-              col2.append(rowsplit2[1])
-      df = pd.DataFrame({'col1':col1, 'col2':col2})
-      dfsorted = df.sort_values(by='col1')
-      dfsorted = dfsorted.reset_index(drop=True)
-      new_label_train.write("r_i_docking_score,ZINC_ID\n")
-      for row2 in range(a):
-          row_list = dfsorted.loc[row2, :].values.flatten().tolist()
-          newrow = str(row_list[0]) + "," + str(row_list[1]) + "\n"
-          new_label_train.write(newrow)
-      col1.clear()
-      col2.clear()
-      a = 0
-  
-      rewrite_train.close()
-      os.remove("{}{}/iteration_{}/training_labels_pre.txt".format(project_folder_loc, project_name, i))
-      new_label_train.close()
-  
-      rewrite_valid = open("{}{}/iteration_{}/validation_labels_pre.txt".format(project_folder_loc, project_name, i),"r")
-      new_label_valid = open("{}{}/iteration_{}/validation_labels.txt".format(project_folder_loc, project_name, i),"w")
-  
-      for row in rewrite_valid:
-          if row == "ZINC_ID r_i_docking_score\n":
-              pass
-          else:
-              a += 1
-              rowsplit1 = row.replace("\n", "")
-              rowsplit2 = rowsplit1.split(" ")
-              rowsplit2.reverse()
-              col1.append(float(rowsplit2[0]))
-              col2.append(rowsplit2[1])
-      df = pd.DataFrame({'col1':col1, 'col2':col2})
-      dfsorted = df.sort_values(by='col1')
-      dfsorted = dfsorted.reset_index(drop=True)
-      new_label_valid.write("r_i_docking_score,ZINC_ID\n")
-      for row2 in range(a):
-          row_list = dfsorted.loc[row2, :].values.flatten().tolist()
-          newrow = str(row_list[0]) + "," + str(row_list[1]) + "\n"
-          new_label_valid.write(newrow)
-      col1.clear()
-      col2.clear()
-      a = 0
-  
-      rewrite_valid.close()
-      os.remove("{}{}/iteration_{}/validation_labels_pre.txt".format(project_folder_loc, project_name, i))
-      new_label_valid.close()
-      
-      # Phase 2
-      
-      out = subprocess.check_output(txt7.format(dd_loc, i, morgan_loc, ttime, project_folder_loc, project_name, num_hyp, num_it, sampled_num, mol_percent_first, rec_val, mol_percent_last), shell=True, universal_newlines=True)
-      simple_job_directory = "{}{}/iteration_{}/simple_job/".format(project_folder_loc, project_name, i)
-      for j in os.listdir(simple_job_directory):
-          simple_job_filepath = os.path.join(simple_job_directory, j)
-          if os.path.isfile(simple_job_filepath):
-              out = subprocess.check_output("chmod a+x {}".format(simple_job_filepath), shell=True, universal_newlines=True)
-              out = subprocess.check_output(simple_job_filepath, shell=True, universal_newlines=True)
-  
-      # Phase 3
-              
-      out = subprocess.check_output(txt8.format(dd_loc, i, project_folder_loc, project_name, morgan_loc), shell=True, universal_newlines=True)
-      out = subprocess.check_output(txt9.format(dd_loc, project_name, project_folder_loc, project_name, i, morgan_loc), shell=True, universal_newlines=True)
-      simple_job_predictions_directory = "{}{}/iteration_{}/simple_job_predictions/".format(project_folder_loc, project_name, i)
-      for k in os.listdir(simple_job_predictions_directory):
-          simple_job_predictions_filepath = os.path.join(simple_job_predictions_directory, k)
-          if os.path.isfile(simple_job_predictions_filepath):
-              out = subprocess.check_output("chmod a+x {}".format(simple_job_predictions_filepath), shell=True, universal_newlines=True)
-              out = subprocess.check_output(simple_job_predictions_filepath, shell=True, universal_newlines=True)
-  
-      # Last iteration: exporting predicted molecules
-              
-      if i == num_it:
-          #out = subprocess.check_output("mkdir {}{}/predicted_molecules".format(project_folder_loc, project_name), shell=True, universal_newlines=True)
-          #out = subprocess.check_output("cd {}{}/predicted_molecules/".format(project_folder_loc, project_name), shell=True, universal_newlines=True)
-          out = subprocess.check_output(txt10.format(dd_loc, smiles_loc, project_folder_loc, project_name, i, num_cpus, num_mol_exported), shell=True, universal_newlines=True)
-          os.system('clear')
-          print("DeepDocking workflow finished. Output .csv files (id_score.csv and smiles.csv) for {} molecules are found in the current folder .".format(num_mol_exported))
-          print("The id_score.csv file contains the molecule name, and a score from 0-1 corresponding to how good the molecule is according to the machine learning model. Larger number means better molecule.")
-          print("The smiles.csv file contains the SMILES string for these molecules, and their name.")
+    if i == 1:  #for first iteration
+        first_it_sampled_num = 3*sampled_num
+        runner.add(Step(it + "molecular_file_count", txt1.format(dd_loc, project_name, i, morgan_loc, num_cpus, first_it_sampled_num)))
+        runner.add(Step(it + "sampling", txt2.format(dd_loc, project_name, project_folder_loc, i, morgan_loc, num_cpus, sampled_num, sampled_num), outputs=sets, after=[it + "molecular_file_count"]))
+    else:       #for other iterations (the predictions of the previous iteration are needed)
+        new_cdd_loc = "{}{}/iteration_{}/morgan_1024_predictions/".format(project_folder_loc, project_name, i-1)
+        runner.add(Step(it + "molecular_file_count", txt1.format(dd_loc, project_name, i, new_cdd_loc, num_cpus, sampled_num), inputs=[new_cdd_loc]))
+        runner.add(Step(it + "sampling", txt2.format(dd_loc, project_name, project_folder_loc, i, new_cdd_loc, num_cpus, sampled_num, sampled_num), inputs=[new_cdd_loc], outputs=sets, after=[it + "molecular_file_count"]))
+    runner.add(Step(it + "sanity_check", txt3.format(dd_loc, project_name, project_folder_loc, i), inputs=sets))
+
+    # Extracting the morgan fingerprints and the smiles of the sampled molecules at the same time
+    runner.add(Step(it + "Extracting_morgan", txt4.format(dd_loc, project_name, project_folder_loc2, i, morgan_loc, num_cpus), inputs=sets, after=[it + "sanity_check"]))
+    if smiles_index == 'yes':
+        runner.add(Step(it + "Extracting_smiles", txt5_index.format(autodock_workflow_script_loc, project_name, project_folder_loc, i, smiles_loc, num_cpus), inputs=sets, outputs=smiles, after=[it + "sanity_check"]))
+    else:
+        runner.add(Step(it + "Extracting_smiles", txt5.format(dd_loc, project_name, project_folder_loc, i, smiles_loc, num_cpus), inputs=sets, outputs=smiles, after=[it + "sanity_check"]))
+
+    # Usage of the AutoDockGPU workflow, the test, train and validation sets are docked in one run and the sorted label files are written by the main script
+    # The docking does not wait for Extracting_morgan
+
+    inputs = " ".join(smiles)
+    outputs = " ".join(iteration_folder + "{}_labels_pre.txt".format(data_set) for data_set in ("testing", "training", "validation"))
+    runner.add(Step(it + "docking", txt6.format(autodock_workflow_script_loc, inputs, autodock_workflow_script_loc, outputs, " ".join(labels), ad_grid, gpus, cpus, sj, proton, conf, remove, verbosity, pipeline, batch_size, prep_chunk, cost_batching, ligand_cache, ligand_cache_size, score_store, prefilter, iteration_folder + "ligand_trace.jsonl" if trace == 'yes' else '', i, docking_metrics), inputs=smiles, outputs=labels))
+
+    # Phase 2
+
+    simple_job_directory = "{}{}/iteration_{}/simple_job/".format(project_folder_loc, project_name, i)
+    runner.add(Step(it + "simple_job_models", txt7.format(dd_loc, i, morgan_loc, ttime, project_folder_loc, project_name, num_hyp, num_it, sampled_num, mol_percent_first, rec_val, mol_percent_last), inputs=labels, outputs=[simple_job_directory], after=[it + "Extracting_morgan"]))
+
+    # The model training scripts run at the same time in job_slots jobs, their output is written into simple_job/logs/
+    runner.add(Step(it + "simple_jobs", partial(run_job_scripts, simple_job_directory, job_slots, job_gpus), inputs=[simple_job_directory]))
+
+    # Phase 3
+
+    runner.add(Step(it + "hyperparameter_result_evaluation", txt8.format(dd_loc, i, project_folder_loc, project_name, morgan_loc), after=[it + "simple_jobs"]))
+    simple_job_predictions_directory = "{}{}/iteration_{}/simple_job_predictions/".format(project_folder_loc, project_name, i)
+    runner.add(Step(it + "simple_job_predictions", txt9.format(dd_loc, project_name, project_folder_loc, project_name, i, morgan_loc), outputs=[simple_job_predictions_directory], after=[it + "hyperparameter_result_evaluation"]))
+
+    # The prediction scripts run at the same time in prediction_slots jobs, if the available memory is enough for them (prediction_memory)
+    runner.add(Step(it + "predictions", partial(run_job_scripts, simple_job_predictions_directory, prediction_slots, job_gpus, "", prediction_memory), inputs=[simple_job_predictions_directory], outputs=[prediction_directory]))
+
+    # Last iteration: exporting predicted molecules
+
+    if i == num_it:
+        runner.add(Step(it + "final_extraction", txt10.format(dd_loc, smiles_loc, project_folder_loc, project_name, i, num_cpus, num_mol_exported), inputs=[prediction_directory]))
+
+metrics.start()
+try:
+    runner.run()
+finally:
+    metrics.stop()
+print(runner.report())
+print("DeepDocking workflow finished. Output .csv files (id_score.csv and smiles.csv) for {} molecules are found in the current folder .".format(num_mol_exported))
+print("The id_score.csv file contains the molecule name, and a score from 0-1 corresponding to how good the molecule is according to the machine learning model. Larger number means better molecule.")
+print("The smiles.csv file contains the SMILES string for these molecules, and their name.")
           
 print("The DeepDocking workflow has been completed")        
 print("Run time: %.2f seconds" % (time.time() - start_time)) 
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+# Throughput benchmark of the uHTVS toolkit without the docking programs.
+# A synthetic library is generated in the layout of Example_files/Ligands (split_smiles/smile_all_XX.txt and morgan_fingerprints/smile_all_XX.txt), and the stages of the workflow are timed on it.
+# The docking programs are replaced by the stubs of the stubs folder (autodock_gpu_64wi and glide), which print and write the same output as the real programs without docking.
+# The stages (ligands/sec is reported for every stage):
+#   generate           generating the synthetic library
+#   read               building the line index of the split smiles files and reading them in ranges (WorkFlow_line_index.py)
+#   prep               ligand preparation into pdbqt files on n_cpu processes (WorkFlow_ligand_prep.py)
+#   autodock_stub      running the AutoDockGPU stub on a batch file (cost of the stub, not of the toolkit)
+#   parse_autodock     parsing the AutoDockGPU output (WorkFlow_autodock_parser.py)
+#   dropped            collecting the dropped ligands of the batch (dropped_ligands of WorkFlow_autodock_parser.py)
+#   parse_glide        reading the scores of a Glide job from its csv file and writing the score file
+#   labels             writing the sorted label file of the library (WorkFlow_labels.py)
+#   workflow_autodock  AutoDockGPU_WorkFlow_smiles2score_main.py with the stub, from the smiles to the label file (the stub exits with a nonzero code if it drops ligands, as AutoDockGPU)
+#   workflow_glide     Glide_WorkFlow_smiles2score_main.py with the stub, from the smiles to the label file
+#   workflow_glide_single  Glide_WorkFlow_smiles2score_main.py in single job mode (-single yes, one Glide job with -NJOBS subjobs) with the stub,
+#                      the scores split into the score files of the subjobs are checked against the csv files of the Glide job and of its subjobs
+# The results can be saved (-json) and compared with an earlier run (-compare), stages slower by more than the tolerance are reported as regressions.
+#
+# python WorkFlow_benchmark.py -w benchmark_run -n 100000 -prep 200 -dock 20000 -nc 8 -json results.json
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import multiprocessing as mp
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "Workflow_scripts")
+STUB_DIR = os.path.join(BENCHMARK_DIR, "stubs")
+EXAMPLE_MAP = os.path.join(os.path.dirname(BENCHMARK_DIR), "Example_files", "AutoDockGPU", "3HA8_empty_OK.maps.fld")
+sys.path.insert(0, SCRIPT_DIR)
+
+import pandas as pd
+from openbabel import openbabel
+from WorkFlow_line_index import load_line_index, read_lines, split_smiles_line
+from WorkFlow_autodock_parser import AutoDockOutputParser, dropped_ligands
+from WorkFlow_labels import write_labels
+from WorkFlow_ligand_prep import init_worker, prepare_autodock_batch, title_sdf, format_timings
+
+
+STAGES = ("generate", "read", "prep", "autodock_stub", "parse_autodock", "dropped", "parse_glide", "labels", "workflow_autodock", "workflow_glide", "workflow_glide_single")
+
+# Fragments of the synthetic molecules, every fragment closes its own rings, so any sequence of them is a valid smiles
+
+FRAGMENTS = ["c1ccccc1", "c1ccc(F)cc1", "c1ccncc1", "c1ccc2[nH]ccc2c1", "C(=O)N", "C(=O)O", "N1CCNCC1", "N1CCOCC1", "C1CCCCC1",
+             "CC", "CCC", "OC", "NC(=O)", "S(=O)(=O)N", "c1cc(Cl)ccc1", "c1ncc[nH]1", "C(F)(F)F", "C#N", "CN(C)", "c1ccsc1"]
+
+
+# Function to generate the smiles of a synthetic molecule
+
+def random_smiles(rng):
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(2, 5)))
+
+
+# Function to generate a synthetic library of n_ligands molecules in n_files split smiles files and the morgan fingerprint files with the same names (random bits, 30-70 bits per molecule)
+# Mol_ct_file.csv is written in the format of Deep-Docking (number of molecules - 1, file name)
+
+def generate_library(folder, n_ligands, n_files, seed=0):
+    rng = random.Random(seed)
+    smiles_folder = os.path.join(folder, "split_smiles")
+    morgan_folder = os.path.join(folder, "morgan_fingerprints")
+    os.makedirs(smiles_folder, exist_ok=True)
+    os.makedirs(morgan_folder, exist_ok=True)
+    size = -(-int(n_ligands) // int(n_files))
+    counts = []
+    ID = 0
+    for k in range(int(n_files)):
+        name = "smile_all_%02d.txt" % k
+        n = min(size, int(n_ligands) - ID)
+        with open(os.path.join(smiles_folder, name), "w") as smi, open(os.path.join(morgan_folder, name), "w") as fp:
+            for _ in range(n):
+                ID += 1
+                smi.write(random_smiles(rng) + " BM" + str(ID) + "\n")
+                fp.write("BM" + str(ID) + "," + ",".join(str(bit) for bit in sorted(rng.sample(range(1024), rng.randint(30, 70)))) + "\n")
+        counts.append((max(n - 1, 0), name))
+    with open(os.path.join(morgan_folder, "Mol_ct_file.csv"), "w") as f:
+        for count, name in counts:
+            f.write(str(count) + "," + name + "\n")
+    return ID
+
+
+# Function to time a stage, returns the result record (stage, ligands, seconds, ligands/sec)
+
+def timed(stage, ligands, function, *args):
+    print("Running stage " + stage, flush=True)
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    record = {"stage": stage, "ligands": int(ligands), "seconds": round(seconds, 4), "ligands_per_sec": round(ligands / seconds, 2) if seconds > 0 else 0.0}
+    return record, result
+
+
+# Function to read every line of the split smiles files in ranges of range_size lines, with the line index
+
+def read_library(smiles_folder, range_size):
+    count = 0
+    for name in sorted(os.listdir(smiles_folder)):
+        if not name.endswith(".txt"):
+            continue
+        filename = os.path.join(smiles_folder, name)
+        offsets = load_line_index(filename)
+        n_lines = len(offsets)
+        for start in range(0, n_lines, range_size):
+            for line in read_lines(filename, start, min(start + range_size, n_lines), offsets):
+                if split_smiles_line(line):
+                    count += 1
+    return count
+
+
+# Function to prepare the first n ligands of a smiles file into pdbqt files (Batch_py0.txt, Lig_IDs_0.txt) on n_cpu processes
+
+def prepare_ligands(input_name, n, n_cpu):
+    pool = mp.Pool(processes=int(n_cpu), initializer=init_worker)
+    try:
+        timings = prepare_autodock_batch(pool, input_name, 0, EXAMPLE_MAP, 0, n, int(n_cpu))
+    finally:
+        pool.close()
+        pool.join()
+    return timings
+
+
+# Function to write the batch and ID files of n ligands for the docking stages (Batch_py1.txt, Lig_IDs_1.txt), every ligand file is a copy of the same prepared pdbqt block
+
+def write_docking_batch(IDs, block):
+    with open("Batch_py1.txt", "w") as fb, open("Lig_IDs_1.txt", "w") as ids:
+        fb.write(EXAMPLE_MAP)
+        for ID in IDs:
+            with open("tmp" + ID + ".pdbqt", "w") as f:
+                f.write(block)
+            fb.write("\n./tmp" + ID + ".pdbqt\nLigand_" + ID)
+            ids.write(ID + "\n")
+
+
+# Function to convert a prepared pdbqt block into an sdf record for the Glide stages
+
+def pdbqt_to_sdf(block):
+    conversion = openbabel.OBConversion()
+    conversion.SetInAndOutFormats("pdbqt", "sdf")
+    mol = openbabel.OBMol()
+    conversion.ReadString(mol, block)
+    return conversion.WriteString(mol)
+
+
+# Function to run the AutoDockGPU stub on a batch file and save its output
+
+def run_autodock_stub(batch_file, log_file):
+    with open(log_file, "w") as log:
+        subprocess.check_call([os.path.join(STUB_DIR, "autodock_gpu_64wi"), "-B", batch_file, "-devnum", "1"], stdout=log)
+
+
+# Function to parse a saved AutoDockGPU output, returns the number of ligands with a score
+
+def parse_autodock_log(log_file):
+    parser = AutoDockOutputParser()
+    scored = 0
+    with open(log_file, "r") as f:
+        for line in f:
+            for ID, energy in parser.feed(line):
+                scored += energy is not None
+    for ID, energy in parser.close():
+        scored += energy is not None
+    return scored
+
+
+# Function to read the scores of a Glide job (the same columns as Glide_WorkFlow_smiles2score_main.py) and write the score file
+
+def parse_glide_csv(csv_file, score_file):
+    docking_data = pd.read_csv(csv_file, usecols=["title", "r_i_docking_score"])
+    docking_data.to_csv(score_file, sep=" ", header=False, index=False)
+    return len(docking_data)
+
+
+# Function to write a score file of the library with random scores
+
+def write_score_file(smiles_folder, score_file, seed=0):
+    rng = random.Random(seed)
+    n = 0
+    with open(score_file, "w") as out:
+        out.write("ZINC_ID r_i_docking_score\n")
+        for name in sorted(os.listdir(smiles_folder)):
+            if name.endswith(".txt"):
+                with open(os.path.join(smiles_folder, name), "r") as f:
+                    for line in f:
+                        tr = split_smiles_line(line)
+                        if tr:
+                            out.write(tr[-1] + " %.2f\n" % -rng.uniform(3, 12))
+                            n += 1
+    return n
+
+
+# Function to run a main script of the workflow with the stubs
+
+def run_workflow(command, log_file):
+    env = dict(os.environ)
+    env["PATH"] = STUB_DIR + os.pathsep + env.get("PATH", "")
+    env["SCHRODINGER"] = STUB_DIR
+    with open(log_file, "w") as log:
+        subprocess.check_call(command, shell=True, stdout=log, stderr=subprocess.STDOUT, env=env)
+
+
+# Function to check the output of the single job mode of Glide_WorkFlow_smiles2score_main.py: the scores of the output file (merged from the score files of the subjobs)
+# have to be the same as the scores of the csv file of the Glide job and of the csv files of its subjobs ({preface}_1.csv, ...), returns the number of scores
+
+def check_glide_single(output_file, preface, n_subjobs):
+    def scores(frame):
+        return {str(title): round(float(score), 4) for title, score in zip(frame.iloc[:, 0], frame.iloc[:, 1])}
+    output = pd.read_csv(output_file, sep=" ")
+    merged = pd.read_csv(preface + ".csv", usecols=["title", "r_i_docking_score"])
+    subjob_files = [preface + "_" + str(part + 1) + ".csv" for part in range(int(n_subjobs))]
+    missing = [name for name in subjob_files if not os.path.exists(name)]
+    if missing:
+        raise ValueError("The csv files of the Glide subjobs are missing: " + ", ".join(missing))
+    subjobs = pd.concat([pd.read_csv(name, usecols=["title", "r_i_docking_score"]) for name in subjob_files], ignore_index=True)
+    if len(output) != len(merged) or len(subjobs) != len(merged):
+        raise ValueError("Number of scores: %d in %s, %d in %s.csv, %d in the csv files of the subjobs" % (len(output), output_file, len(merged), preface, len(subjobs)))
+    if scores(output) != scores(merged) or scores(subjobs) != scores(merged):
+        raise ValueError("The scores of " + output_file + " are not the same as the scores of the Glide job")
+    return len(output)
+
+
+# Function to print the results, and the changes compared with an earlier run if it is given
+
+def report(results, previous=None, tolerance=0.2):
+    regressions = []
+    print("\n%-22s %12s %12s %16s" % ("stage", "ligands", "seconds", "ligands/sec") + ("   change" if previous else ""))
+    for record in results:
+        line = "%-22s %12d %12.3f %16.1f" % (record["stage"], record["ligands"], record["seconds"], record["ligands_per_sec"])
+        if previous and record["stage"] in previous and previous[record["stage"]]["ligands_per_sec"] > 0:
+            change = record["ligands_per_sec"] / previous[record["stage"]]["ligands_per_sec"] - 1
+            line += "   %+6.1f%%" % (100 * change)
+            if change < -tolerance and record["stage"] != "autodock_stub":
+                line += "  REGRESSION"
+                regressions.append(record["stage"])
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--work_folder',required=False,default='benchmark_run',help='Folder of the synthetic library and of the files of the stages (default: benchmark_run)')
+    parser.add_argument('-n', '--n_ligands',required=False,default=100000,help='Number of molecules in the synthetic library (default: 100000)')
+    parser.add_argument('-nf', '--n_files',required=False,default=10,help='Number of split smiles files (default: 10)')
+    parser.add_argument('-prep', '--n_prep',required=False,default=200,help='Number of ligands prepared in the prep and workflow stages (default: 200)')
+    parser.add_argument('-dock', '--n_dock',required=False,default=20000,help='Number of ligands in the docking output stages (default: 20000)')
+    parser.add_argument('-nc', '--n_cpu',required=False,default=4,help='Number of CPUs of the ligand preparation (default: 4)')
+    parser.add_argument('-drop', '--drop_rate',required=False,default=0.02,help='Fraction of the ligands dropped by the docking stubs (default: 0.02)')
+    parser.add_argument('-stages', '--stages',required=False,default='all',help='Comma separated stages to run (default: all): ' + ",".join(STAGES))
+    parser.add_argument('-json', '--json_file',required=False,default='',help='Save the results into this JSON file')
+    parser.add_argument('-compare', '--compare_file',required=False,default='',help='JSON file of an earlier run, the ligands/sec of the stages are compared with it')
+    parser.add_argument('-tol', '--tolerance',required=False,default=0.2,help='Slowdown reported as a regression (default: 0.2, 20%%)')
+    parser.add_argument('-seed', '--seed',required=False,default=0,help='Random seed of the synthetic library (default: 0)')
+    io_args = parser.parse_args()
+
+    stages = STAGES if io_args.stages == "all" else [stage.strip() for stage in io_args.stages.split(",")]
+    for stage in stages:
+        if stage not in STAGES:
+            sys.exit("ERROR: unknown stage " + str(stage))
+    n_ligands, n_prep, n_dock = int(io_args.n_ligands), int(io_args.n_prep), int(io_args.n_dock)
+    os.environ["STUB_DROP_RATE"] = str(io_args.drop_rate)
+    json_file = os.path.abspath(io_args.json_file) if io_args.json_file else ""
+    compare_file = os.path.abspath(io_args.compare_file) if io_args.compare_file else ""
+    os.makedirs(io_args.work_folder, exist_ok=True)
+    os.chdir(io_args.work_folder)
+    library = os.path.abspath("Ligands")
+    smiles_folder = os.path.join(library, "split_smiles")
+    first_file = os.path.join(smiles_folder, "smile_all_00.txt")
+    results = []
+
+    # The library is generated if it is missing or has another size, even if the generate stage is not selected
+
+    library_key = "%d %d %s" % (n_ligands, int(io_args.n_files), io_args.seed)
+    key_file = os.path.join(library, "library.key")
+    if "generate" in stages or not (os.path.exists(key_file) and open(key_file).read() == library_key):
+        record, count = timed("generate", n_ligands, generate_library, library, n_ligands, int(io_args.n_files), int(io_args.seed))
+        with open(key_file, "w") as f:
+            f.write(library_key)
+        if "generate" in stages:
+            results.append(record)
+
+    if "read" in stages:
+        for name in os.listdir(smiles_folder):
+            if name.endswith(".lidx"):
+                os.remove(os.path.join(smiles_folder, name))	# The index is built in the stage
+        record, count = timed("read", n_ligands, read_library, smiles_folder, 1000)
+        results.append(record)
+
+    # Preparation of n_prep ligands, their pdbqt block is used for the ligand files of the docking stages
+
+    needs_block = any(stage in stages for stage in ("autodock_stub", "parse_autodock", "dropped", "parse_glide"))
+    if "prep" in stages or needs_block:
+        os.makedirs("prep", exist_ok=True)
+        os.chdir("prep")
+        record, timings = timed("prep", n_prep, prepare_ligands, first_file, n_prep, io_args.n_cpu)
+        if "prep" in stages:
+            results.append(record)
+            print(format_timings(timings))
+        with open("Lig_IDs_0.txt", "r") as f:
+            prepared = [line.strip() for line in f if line.strip()]
+        block = open("tmp" + prepared[0] + ".pdbqt").read() if prepared else ""
+        os.chdir("..")
+
+    if any(stage in stages for stage in ("autodock_stub", "parse_autodock", "dropped")):
+        os.makedirs("dock", exist_ok=True)
+        os.chdir("dock")
+        IDs = ["BM" + str(k + 1) for k in range(n_dock)]
+        write_docking_batch(IDs, block)
+        record, result = timed("autodock_stub", n_dock, run_autodock_stub, "Batch_py1.txt", "DockLog1")
+        if "autodock_stub" in stages:
+            results.append(record)
+        if "parse_autodock" in stages:
+            record, scored = timed("parse_autodock", n_dock, parse_autodock_log, "DockLog1")
+            results.append(record)
+        if "dropped" in stages:
+            record, dropped = timed("dropped", n_dock, dropped_ligands, "Lig_IDs_1.txt", False)
+            results.append(record)
+            print(str(len(dropped)) + " of " + str(n_dock) + " ligands have been dropped by the stub")
+        os.chdir("..")
+
+    if "parse_glide" in stages:
+        os.makedirs("glide", exist_ok=True)
+        os.chdir("glide")
+        sdf_block = pdbqt_to_sdf(block)
+        with open("Ligand_file_1.sdf", "w") as sdf:
+            for k in range(n_dock):
+                sdf.write(title_sdf(sdf_block, "BM" + str(k + 1)))
+        with open("Glide_docking_1.in", "w") as f:
+            f.write("GRIDFILE   grid.zip\nLIGANDFILE   Ligand_file_1.sdf\nPRECISION   HTVS")
+        subprocess.check_call([os.path.join(STUB_DIR, "glide"), "Glide_docking_1.in", "-OVERWRITE", "-adjust", "-HOST", "localhost:1", "-TMPLAUNCHDIR", "-WAIT"], stdout=subprocess.DEVNULL)
+        record, count = timed("parse_glide", n_dock, parse_glide_csv, "Glide_docking_1.csv", "Glide_docking_scores_1.txt")
+        results.append(record)
+        os.chdir("..")
+
+    if "labels" in stages:
+        n_scores = write_score_file(smiles_folder, "library_scores.txt")
+        record, result = timed("labels", n_scores, write_labels, "library_scores.txt", "library_labels.txt")
+        results.append(record)
+
+    # The main scripts dock the first n_prep ligands of the library with the stubs
+
+    if any(stage in stages for stage in ("workflow_autodock", "workflow_glide", "workflow_glide_single")):
+        with open(first_file, "r") as f, open("workflow_input.smi", "w") as out:
+            for k, line in enumerate(f):
+                if k == n_prep:
+                    break
+                out.write(line)
+    if "workflow_autodock" in stages:
+        os.makedirs("workflow_autodock", exist_ok=True)
+        os.chdir("workflow_autodock")
+        command = "python " + os.path.join(SCRIPT_DIR, "AutoDockGPU_WorkFlow_smiles2score_main.py") + " -i ../workflow_input.smi -o scores.txt -l labels.txt -map " + EXAMPLE_MAP + " -gpudev 0 -nc " + str(io_args.n_cpu) + " -sj 4 -d yes"
+        os.environ["STUB_EXIT_CODE"] = "1" if float(io_args.drop_rate) > 0 else "0"	# Like AutoDockGPU, the stub exits with a nonzero code if a ligand of a batch fails, the scores of the other ligands have to be kept
+        record, result = timed("workflow_autodock", n_prep, run_workflow, command, "workflow.log")
+        del os.environ["STUB_EXIT_CODE"]
+        results.append(record)
+        with open("labels.txt", "r") as f:
+            scored = sum(1 for line in f) - 1
+        with open("Dropped_ligands.txt", "r") as f:
+            dropped = sum(1 for line in f if line.strip()) - 1
+        if scored <= 0:
+            sys.exit("ERROR: AutoDockGPU workflow: no ligand has been scored")
+        print(str(scored) + " ligands have been scored and " + str(dropped) + " dropped by the AutoDockGPU workflow")
+        os.chdir("..")
+    if "workflow_glide" in stages:
+        os.makedirs("workflow_glide", exist_ok=True)
+        os.chdir("workflow_glide")
+        command = "python " + os.path.join(SCRIPT_DIR, "Glide_WorkFlow_smiles2score_main.py") + " -i ../workflow_input.smi -o scores.txt -l labels.txt -grid grid.zip -nc " + str(io_args.n_cpu) + " -sj 4 -d yes"
+        record, result = timed("workflow_glide", n_prep, run_workflow, command, "workflow.log")
+        results.append(record)
+        os.chdir("..")
+
+    # The files of the Glide job are kept (no -d yes) and the output file is not converted into a label file (no -l), so the split of the scores can be checked
+
+    if "workflow_glide_single" in stages:
+        os.makedirs("workflow_glide_single", exist_ok=True)
+        os.chdir("workflow_glide_single")
+        command = "python " + os.path.join(SCRIPT_DIR, "Glide_WorkFlow_smiles2score_main.py") + " -i ../workflow_input.smi -o scores.txt -grid grid.zip -nc " + str(io_args.n_cpu) + " -sj 4 -single yes"
+        record, result = timed("workflow_glide_single", n_prep, run_workflow, command, "workflow.log")
+        results.append(record)
+        try:
+            checked = check_glide_single("scores.txt", "Glide_docking_all", 4)
+        except ValueError as e:
+            sys.exit("ERROR: single job mode of Glide: " + str(e))
+        print(str(checked) + " scores of the single Glide job are the same in the score files of the 4 subjobs and in the csv files of the Glide subjobs")
+        os.chdir("..")
+
+    previous = None
+    if compare_file:
+        with open(compare_file, "r") as f:
+            previous = {record["stage"]: record for record in json.load(f)["results"]}
+    regressions = report(results, previous, float(io_args.tolerance))
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "n_ligands": n_ligands, "n_prep": n_prep, "n_dock": n_dock, "n_cpu": int(io_args.n_cpu), "results": results}, f, indent=1)
+    if regressions:
+        sys.exit("Regression in the stages: " + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
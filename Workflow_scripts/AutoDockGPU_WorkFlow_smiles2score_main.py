@@ -10,27 +10,57 @@
 import time
 from itertools import (takewhile,repeat)
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 import os
+import sys
 import argparse
 import subprocess
-import re
+import queue
+import threading
 from os import path
+from WorkFlow_line_index import load_line_index
+from WorkFlow_gpu_lease import DeviceLeaseManager
+from WorkFlow_autodock_parser import stream_autodock, dropped_ligands
+from WorkFlow_ligand_cache import LigandCache
+from WorkFlow_score_store import ScoreStore
+from WorkFlow_labels import write_labels
+from WorkFlow_manifest import RunManifest, run_key
+from WorkFlow_shards import merge_shards, remove_shards
+from WorkFlow_trace import process_writer, merge_trace
+from WorkFlow_metrics import MetricsFile, docking_collector
+from WorkFlow_ligand_cost import sort_by_cost, read_costs, cost_ranges, format_costs, COST_SUFFIX
+from WorkFlow_ligand_prep import init_worker, prepare_autodock_batch, prepare_autodock_chunk, format_timings, PREP_CHUNK
 
 
 # Getting the proper inputs
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--input_name',required=True,help='Input smi file, separated by spaces')
-parser.add_argument('-f', '--folder',required=True,help='Folder of the sub script')
-parser.add_argument('-o', '--output_name',required=True,help='Name of output file with scores')
+parser.add_argument('-i', '--input_name',required=True,nargs='+',help='Input smi file(s), separated by spaces or tabs. The ligands of all input files (e.g. the test, train and validation sets) are docked in one run')
+parser.add_argument('-f', '--folder',required=False,default='',help='Folder of the sub script (not used, the ligand preparation is imported from WorkFlow_ligand_prep.py)')
+parser.add_argument('-o', '--output_name',required=True,nargs='+',help='Name of output file with scores, one for each input file')
+parser.add_argument('-l', '--label_name',required=False,nargs='+',default=[],help='Name of the sorted label file for Deep-Docking (r_i_docking_score,ZINC_ID), one for each input file, the output files with scores are deleted after they have been written (default: no label file)')
 parser.add_argument('-map', '--map_name',required=True,help='Name of the maps.fld file for AutoDockGPU')
 parser.add_argument('-gpudev', '--gpudevices',required=True,help='comma separated GPU devices to use')
 parser.add_argument('-nc', '--n_cpu',required=True,help='Number of CPUs to use per subjob')
 parser.add_argument('-sj', '--n_subjobs',required=True,help='Number of subjobs')
 parser.add_argument('-prot', '--protonation',required=False,default='no',choices=['yes', 'no'],help='Find the major protonation form at pH: 7.4 (default: no)')
 parser.add_argument('-loc', '--localopt',required=False,default='no',choices=['yes', 'no'],help='Perform local optimization on generated 3D structure (default: no)')
+parser.add_argument('-cache', '--cache_folder',required=False,default='',help='Folder of the cache of prepared 3D ligands, shared by the Deep-Docking iterations (default: no cache)')
+parser.add_argument('-cs', '--cache_size',required=False,default=10,help='Maximum size of the ligand cache in GB (default: 10)')
+parser.add_argument('-dock', '--docking_program',required=False,default='autodock_gpu_64wi',help='AutoDockGPU executable (default: autodock_gpu_64wi)')
+parser.add_argument('-store', '--score_store',required=False,default='',help='SQLite file storing the docking scores of the earlier runs, molecules found in it are not docked again (default: no score store)')
 parser.add_argument('-d', '--delete',required=False,default='no',choices=['yes', 'no'],help='Delete ligand pdbqt, dlg, xml and Batch files? (default: no)')
 parser.add_argument('-v', '--verbosity',required=False,default='scoresonly',choices=['scoresonly', 'verbose'],help='Set verbose if autodock log file is required (default: scoresonly)')
+parser.add_argument('-pipe', '--pipeline',required=False,default='no',choices=['yes', 'no'],help='Dock small batches as soon as they are prepared, so the ligand preparation and the docking run at the same time (default: no)')
+parser.add_argument('-bs', '--batch_size',required=False,default=0,help='Number of ligands in one docking batch, the input files are cut into batches which the GPUs take one by one from a shared queue (default: 0, the input files are divided into n_subjobs parts, or 100 ligand batches in pipeline mode)')
+parser.add_argument('-pc', '--prep_chunk',required=False,default=PREP_CHUNK,help='Number of ligands in one ligand preparation task, the tasks are taken by the CPUs one by one (default: ' + str(PREP_CHUNK) + ', 0: the ligands of a subjob are divided into n_cpu equal tasks)')
+parser.add_argument('-pf', '--prefilter',required=False,default='no',choices=['yes', 'no'],help='Check the prepared ligands against the grid box on the CPU and drop the ligands which cannot fit into the box in any orientation before the docking (default: no)')
+parser.add_argument('-qs', '--queue_size',required=False,default=0,help='Pipeline mode: number of batches allowed on the scratch disk besides the ones being prepared (one per CPU) and docked (one per GPU), i.e. prepared batches waiting for a GPU (default: 2 per GPU)')
+parser.add_argument('-cost', '--cost_batching',required=False,default='no',choices=['yes', 'no'],help='Sort the ligands by their estimated docking cost (heavy atoms and torsions) and cut the subjobs to equal total cost, so the batches contain ligands of similar size and the GPUs finish at about the same time (default: no)')
+parser.add_argument('-trace', '--trace_file',required=False,default='',help='JSONL file of the per-ligand stage times (preparation stages, docking and parsing), see WorkFlow_trace.py (default: no trace)')
+parser.add_argument('-it', '--iteration',required=False,default='',help='Deep-Docking iteration written into the trace records (default: none)')
+parser.add_argument('-metrics', '--metrics_file',required=False,default='',help='Prometheus text file (.prom) of the progress metrics (ligands prepared, docked and dropped, GPU busy times, queue depths, phase, ETA), updated on an interval, see WorkFlow_metrics.py (default: no metrics file)')
+parser.add_argument('-mi', '--metrics_interval',required=False,default=15,help='Update interval of the metrics file in seconds (default: 15)')
 io_args = parser.parse_args()
 
 # Function to calculate the number of entries in the file (the number of lines)
@@ -40,163 +70,384 @@ def rawincount(filename):
     return sum( buf.count(b'\n') for buf in bufgen )
     f.close()
     
-# Function to divide the 3D confgen and docking into subjobs
-def multiproc(count):        
+# Function to divide the input files into subjobs, every input file is divided into n_subjobs parts
+# The subjobs of all input files are handed out from one queue, so the GPUs do not wait for the last subjob of an input file before the next input file is started
+# The input files sorted by the docking cost (cost-aware batching) are divided into parts of equal estimated cost
+def subjobs():
+    jobs = []
+    for input_name, output_name in zip(io_args.input_name, io_args.output_name):
+       if input_name in costs:
+        ranges = cost_ranges(costs[input_name], int(io_args.n_subjobs))
+        print(format_costs(costs[input_name], ranges))
+        for countline, countline2 in ranges:
+         jobs.append((len(jobs), input_name, output_name, countline, countline2))
+        continue
        
-       # Calculate the block sizes (number of smiles in one particular docking process) and send it to the subscript
-
-       fb_file = "Batch_py" + str(count) + ".txt"       
-       num = rawincount(io_args.input_name)
-       size = num//int(io_args.n_subjobs)
-       countline = count * size
-       
-       # The last job contains the rest of the smiles if the compound number divided by the subjobs is not an integer
+       # Calculate the block sizes (number of smiles in one particular docking process)
        
-       if num % int(io_args.n_subjobs) != 0 and count == (int(io_args.n_subjobs)-1):
-        countline2 = num  
-       else:
-        countline2 = (count + 1) * size
+       num = rawincount(input_name)
+       size = num//int(io_args.n_subjobs)
+       for part in range(int(io_args.n_subjobs)):
+        countline = part * size
+        
+        # The last job contains the rest of the smiles if the compound number divided by the subjobs is not an integer
+        
+        if num % int(io_args.n_subjobs) != 0 and part == (int(io_args.n_subjobs)-1):
+         countline2 = num  
+        else:
+         countline2 = (part + 1) * size
+        if countline2 > countline:
+         jobs.append((len(jobs), input_name, output_name, countline, countline2))
+    return jobs
+
+
+# Function to cut the input files into small batches (batch_size ligands, 100 in pipeline mode by default), in the same format as the subjobs
+# The batches are handed out one by one to the GPUs, so a batch of slow ligands only holds up its own GPU until the end of that batch
+# If the input files are sorted by the docking cost, the most expensive batches are handed out first and the cheapest ones at the end
+def batches():
+    jobs = []
+    batch_size = int(io_args.batch_size) if int(io_args.batch_size) > 0 else 100
+    for input_name, output_name in zip(io_args.input_name, io_args.output_name):
+        num = rawincount(input_name)
+        for start in range(0, num, batch_size):
+            jobs.append((len(jobs), input_name, output_name, start, min(start + batch_size, num)))
+    return jobs
+
+
+# Function to run the 3D confgen and docking of a subjob
+# The steps completed by an earlier run of the same command are skipped (see the run manifest)
+# If the preparation or the docking fails, the subjob is not marked as docked and the other subjobs continue
+def multiproc(job):        
        
-       # Run the ligand preparation python script for ligands between from countline to countline2 - 1
+       count, input_name, output_name, countline, countline2 = job
+       timings = []
        
-       cmdline_pre = "python " + str(io_args.folder) + "AutoDockGPU_WorkFlow_smiles2score_sub.py -i " + str(io_args.input_name) + " -c " + str(count) + " -map " + str(io_args.map_name) + " -start " + str(countline) + " -end " + str(countline2) + " -n " + str(io_args.n_cpu) + " -sj " + str(io_args.n_cpu) + " -prot " + str(io_args.protonation) + " -loc " + str(io_args.localopt)
-       print("\n\n-------------------------\nThe following command is running for ligand preparation #" + str(count) + ":\n" + str(cmdline_pre) + "\n-------------------------\n\n")	# For debugging purposes
-       output_pre = subprocess.check_output(cmdline_pre, shell=True, universal_newlines=True)      
+       # Prepare the ligands between countline and countline2 - 1 on the shared ligand preparation pool (the lines are divided between n_cpu tasks)
        
-       # Docking and docking score extraction
+       if not batch_prepared(count):
+        print("\n\n-------------------------\nLigand preparation #" + str(count) + " is running for lines " + str(countline) + " - " + str(countline2 - 1) + " of " + str(input_name) + "\n-------------------------\n\n")	# For debugging purposes
+        try:
+         timings = prepare_autodock_batch(prep_pool, input_name, count, io_args.map_name, countline, countline2, int(io_args.n_cpu), int(io_args.prep_chunk))
+        except Exception as e:
+         print("Ligand preparation #" + str(count) + " failed: " + str(e))	# The subjob is not marked, it is prepared again by the next run of the same command
+         queue_depth("preparation", -1)
+         return timings
+        manifest.mark(count, "prepared")
+        metrics.inc("ligands_prepared_total", sum(t["ligands"] for t in timings))
+        queue_depth("preparation", -1)
+       queue_depth("docking", 1)
+       if dock_subjob(count):
+        manifest.mark(count, "docked")
+       return timings
+
+
+# Function to check if a subjob has been prepared by an earlier run and its batch and ID files are still there
+def batch_prepared(count):
+       return manifest.done(count, "prepared") and os.path.exists("Batch_py" + str(count) + ".txt") and os.path.exists("Lig_IDs_" + str(count) + ".txt")
+
+
+# Function to dock the ligands of the batch file of a subjob (Batch_py{count}.txt), to collect the docking scores (into Scores_{count}.txt) and the dropped ligands (into Dropped_{count}.txt)
+# Returns False if the docking program failed
+def dock_subjob(count):
+
+       fb_file = "Batch_py" + str(count) + ".txt"
+       success = True
+
+       # Docking and docking score extraction, a free GPU device is leased from the -gpudev list for the time of the docking
+       # The output of AutoDockGPU is parsed line by line and the score of every ligand is written as soon as it is printed
        try:
-         with open (io_args.output_name, "a") as score:
+         with open ("Scores_" + str(count) + ".txt", "w", buffering=1) as score, devices.lease() as device:
 
-            # GPU device selection
-            
-            device = count % devs
-            devnum = device + 1
-            command = "nvidia-smi | grep 'autodock' | awk '{print $2}'"
-            devoutput = subprocess.check_output(command, shell=True, universal_newlines=True)
-            new = devoutput.split("\n")
-            new.pop()
-            #print(devoutput)
-            #print(new)
-            #print(device)
-            try:
-             if str(device) in new:
-              #print("It is used")
-              for i in devlist:
-               if str(i) not in new:
-                #print(str(i) + " should be used")
-                devnum = int(i) + 1
-                break
-             #else:
-              #print("Not used") 
-            except:
-             print("Something's wrong")                 
-            #print(devnum)
+            queue_depth("docking", -1)
+            devnum = int(device) + 1	# AutoDockGPU numbers the devices from 1
+            command = str(io_args.docking_program) + " -B " + fb_file + " -devnum " + str(devnum)
+            print("\n\n-------------------------\nThe following command is running for ligand docking job #" + str(count) + ":\n" + command + "\n-------------------------\n\n")	# For debugging purposes
             
-            # Scores only extraction
+            # The complete output is written into DockLog{count} in verbose mode
             
-            if io_args.verbosity == "scoresonly":
-             cmdline = "autodock_gpu_64wi -B " + fb_file + " -devnum " + str(devnum) + " | grep 'samples,\|Ligand file\|evaluations. Best' | grep -v '('"
-             print("\n\n-------------------------\nThe following command is running for ligand docking job #" + str(count) + ":\n" + "autodock_gpu_64wi -B " + fb_file + " -devnum " + str(devnum) + "\n-------------------------\n\n")	# For debugging purposes
-             output = subprocess.check_output(cmdline, shell=True, universal_newlines=True) 
-             
-             # Reformatting the output lines
-             
-             output = re.sub(r"pdbqt\s*[0-9]* samples, best energy\s*", " ", output)
-             output = re.sub(r"pdbqt\s*[0-9]* evaluations. Best energy\s*", " ", output)
-             output = re.sub(r"[ ]+Ligand file: \./tmp", "", output)
-             output = re.sub(" kcal/mol.", "", output)
-             output = re.sub("\. ", " ", output)
-
-            # Verbose extraction
-                                         
-            elif io_args.verbosity == "verbose":
-             #devnum = devlist[count % devs]
-             cmdline = "autodock_gpu_64wi -B " + fb_file + " -devnum " + str(devnum) + " > DockLog" + str(count)
-             print("\n\n-------------------------\nThe following command is running for ligand docking job #" + str(count) + ":\n" + "autodock_gpu_64wi -B " + fb_file + " -devnum " + str(devnum) + "\n-------------------------\n\n")	# For debugging purposes
-             output = subprocess.check_output(cmdline, shell=True, universal_newlines=True) 
-             
-             # Reformatting the output lines
-             
-             cmdline = "grep 'samples,\|Ligand file\|evaluations. Best' DockLog" + str(count) + "| grep -v '('"
-             output = subprocess.check_output(cmdline, shell=True, universal_newlines=True) 
-             output = re.sub(r"pdbqt\s*[0-9]* samples, best energy\s*", " ", output)
-             output = re.sub(r"pdbqt\s*[0-9]* evaluations. Best energy\s*", " ", output)
-             output = re.sub(r"[ ]+Ligand file: \./tmp", "", output)
-             output = re.sub(" kcal/mol.", "", output)
-             output = re.sub("\. ", " ", output)                     
-
-            score.write(str(output))
+            log_name = "DockLog" + str(count) if io_args.verbosity == "verbose" else None
+            for ID, energy, dock_time, parse_time in stream_autodock(command, log_name, timed=True):
+             if trace is not None:
+              record = {"stage": "dock", "ID": str(ID), "subjob": count, "dock": round(dock_time, 6), "parse": round(parse_time, 6)}
+              if energy is None:
+               record["error"] = True
+              trace.write(record)
+             if energy is None:
+              print("Ligand " + str(ID) + " has no docking score")
+             else:
+              score.write(str(ID) + " " + str(energy) + "\n")
+              metrics.inc("ligands_docked_total")
        
        except:
-        print("Job number # " + str(count) + " resulted in zero poses") 
+        print("Job number # " + str(count) + " resulted in zero poses")	# The docking program could not be started or it failed before docking any ligand of the batch
+        success = False
 
 
-       # File deletion after the docking process is completed (if it is required)
+       # The batch, ID and ligand files of a failed docking are kept, the subjob is docked again by the next run of the same command
+       
+       if not success:
+        if trace is not None:
+         trace.flush()
+        return False
+
+       # Collecting the dropped ligands (without an xml file), the ligand pdbqt, xml and dlg files and the Batch files are deleted if it is required
        
-       dropped = ""
        ID_file = "Lig_IDs_" + str(count) + ".txt"
+       dropped = dropped_ligands(ID_file, str(io_args.delete) == "yes")
        if str(io_args.delete) == "yes":
-        with open(ID_file, "r") as file:
-         file_list = file.readlines()
-         for ID in file_list:
-             ID=str(ID).replace('\n','')
-          
-
-             try:
-              name = "tmp"+str(ID)+".pdbqt"
-              xml = "Ligand_"+str(ID)+".xml"
-              dlg = "Ligand_"+str(ID)+".dlg"
-              os.remove(name)
-              os.remove(xml)
-              os.remove(dlg)
-             except:
-              #print("Ligand "+str(ID)+" has not been docked")
-              dropped += "\n" + str(ID) 	# Collecting dropped ligands in case of file deletion is requested
         os.remove("Batch_py" + str(count) + ".txt")
         os.remove(ID_file)
-       
-       # Collecting dropped ligands if file deletion is not requested
-       
-       else:
-        #dropped += "\n"
-        with open(ID_file, "r") as file:
-         file_list = file.readlines()
-        for ID in file_list:
-         name = "Ligand_"+str(ID)+".xml"
-         if path.exists(name) == False:
-          #print("Ligand "+str(ID)+" has not been docked")
-          dropped += '\n' + str(ID)
-
-       with open ("Dropped_ligands.txt", "a") as drop:
-        dropped=str(dropped).replace('\n\n','\n')       
-        drop.write(dropped)
 
+       with open ("Dropped_" + str(count) + ".txt", "w") as drop:
+        drop.write("".join("\n" + str(ID) for ID in dropped))
+       metrics.inc("ligands_dropped_total", len(dropped))
+
+       if trace is not None:
+        trace.flush()
        print("Job #" + str(count) + " is completed")
+       return success
+    
+
+# Function to run the ligand preparation and the docking as a pipeline
+# The input files are cut into small batches, the batches are prepared on the CPU pool and every GPU docks the next ready batch as soon as it is free
+# The number of batches on the scratch disk (being prepared, waiting for a GPU or being docked) is limited, the preparation waits if the GPUs fall behind
+def pipeline(jobs):
+
+    queue_size = int(io_args.queue_size) if int(io_args.queue_size) > 0 else 2 * gpus
+    slots = threading.Semaphore(cpus + queue_size + gpus)	# Backpressure on the preparation
+    ready = queue.Queue()	# Prepared batches waiting for a GPU
+    timings = []
+
+    def prepared(count, result):
+        timings.append(result)
+        manifest.mark(count, "prepared")
+        metrics.inc("ligands_prepared_total", result["ligands"])
+        queue_depth("preparation", -1)
+        queue_depth("docking", 1)
+        ready.put(count)
+
+    def failed(count, error):
+        print("Ligand preparation of batch #" + str(count) + " failed: " + str(error))
+        queue_depth("preparation", -1)
+        slots.release()	# The batch is not docked (it is not marked as prepared or docked), it is prepared again by the next run of the same command
+
+    # One consumer thread per GPU, each docking job leases a free device
+    # The slot of a batch is released even if its docking fails, so the feeding and the final wait do not block
+    
+    def consumer():
+        while True:
+            count = ready.get()
+            if count is None:
+                break
+            try:
+                if dock_subjob(count):
+                    manifest.mark(count, "docked")
+            except Exception as e:
+                print("Docking of batch #" + str(count) + " failed: " + str(e))
+            finally:
+                slots.release()
+
+    consumers = [threading.Thread(target=consumer) for dev in devlist]
+    for thread in consumers:
+        thread.start()
+
+    # Feeding the preparation pool with the batches
     
+    for count, input_name, output_name, start, end in jobs:
+        if manifest.done(count, "docked"):
+            continue
+        slots.acquire()
+        if batch_prepared(count):
+            queue_depth("docking", 1)
+            ready.put(count)	# Prepared by an earlier run
+            continue
+        queue_depth("preparation", 1)
+        print("\n\n-------------------------\nLigand preparation #" + str(count) + " is running for lines " + str(start) + " - " + str(end - 1) + " of " + str(input_name) + "\n-------------------------\n\n")	# For debugging purposes
+        prep_pool.apply_async(prepare_autodock_chunk, (input_name, count, io_args.map_name, start, end),
+                              callback=lambda result, count=count: prepared(count, result),
+                              error_callback=lambda error, count=count: failed(count, error))
+
+    # Waiting until every batch is docked, then stopping the consumers
+    
+    for _ in range(cpus + queue_size + gpus):
+        slots.acquire()
+    for thread in consumers:
+        ready.put(None)
+    for thread in consumers:
+        thread.join()
+    return timings
+
+
 def main():        
  if __name__ == '__main__':
     
     print("Docking workflow has been started.")
+    metrics.start()
+    
+    # The run manifest records the completed subjobs, a rerun of the same command (e.g. after a crash) continues the earlier run
     
-    # Creates a new output file which will store the docking results and a tyt file containing the dropped ligands
-    with open (io_args.output_name, "w") as scores: 
-      scores.write("ZINC_ID r_i_docking_score\n")
-    with open ("Dropped_ligands.txt", "w") as drop:
-        drop.write("ID")
+    global manifest
+    settings = {"output": io_args.output_name, "map": io_args.map_name, "program": io_args.docking_program, "subjobs": io_args.n_subjobs, "protonation": io_args.protonation, "localopt": io_args.localopt,
+                "pipeline": io_args.pipeline, "batch_size": io_args.batch_size, "store": io_args.score_store, "prefilter": io_args.prefilter, "cost_batching": io_args.cost_batching}
+    manifest = RunManifest(os.path.splitext(io_args.output_name[0])[0] + ".manifest", run_key(io_args.input_name, settings))
+    if manifest.resumed:
+      print("Continuing the earlier run of the same command, the completed subjobs are skipped")
     
-    counter = range(int(io_args.n_subjobs))
-    pool_size = gpus
-    pool = mp.Pool(processes=pool_size,)
-    collectedResults = pool.map(multiproc, counter)
-    pool.close()
+    # Taking the scores of the molecules docked earlier from the score store (into {output}_stored.txt), only the rest of the molecules are docked
+    # A continued run uses the files of the earlier run, so the subjobs contain the same molecules
+    
+    todock_names = []
+    stored_names = []
+    if store is not None:
+     metrics.phase("score_store")
+     for k, output_name in enumerate(io_args.output_name):
+      todock_name = os.path.splitext(output_name)[0] + "_to_dock.smi"
+      stored_name = os.path.splitext(output_name)[0] + "_stored.txt"
+      if not (manifest.resumed and os.path.exists(todock_name) and os.path.exists(stored_name)):
+       open(stored_name, "w").close()
+       stored, missing = store.split_input(io_args.input_name[k], stored_name, todock_name)
+       print(str(stored) + " molecules of " + str(io_args.input_name[k]) + " have been found in the score store, " + str(missing) + " molecules have to be docked")
+      io_args.input_name[k] = todock_name
+      todock_names.append(todock_name)
+      stored_names.append(stored_name)
+
+    # Cost-aware batching: the ligands to dock are sorted by their estimated docking cost (into {output}_by_cost.smi), a continued run uses the sorted files and costs of the earlier run
+    
+    sorted_names = []
+    if io_args.cost_batching == "yes" and not manifest.done("output", "merged"):
+     for k, output_name in enumerate(io_args.output_name):
+      sorted_name = os.path.splitext(output_name)[0] + "_by_cost.smi"
+      costs[sorted_name] = read_costs(sorted_name) if manifest.resumed else None
+      if costs[sorted_name] is None:
+       print("Estimating the docking cost of the ligands of " + str(io_args.input_name[k]))
+       costs[sorted_name] = sort_by_cost(io_args.input_name[k], sorted_name, cpus)
+      io_args.input_name[k] = sorted_name
+      sorted_names.append(sorted_name)
+
+    # Docking the subjobs which have not been docked yet and merging the scores into the output files
+    
+    jobs = batches() if io_args.pipeline == "yes" or int(io_args.batch_size) > 0 else subjobs()
+    if not manifest.done("output", "merged"):
+      if any(not manifest.done(job[0], "docked") for job in jobs):
+        metrics.phase("docking")
+        run_docking(jobs)
+      failed = [job[0] for job in jobs if not manifest.done(job[0], "docked")]
+      if failed:
+        sys.exit("ERROR: " + str(len(failed)) + " subjobs have not been docked, run the same command again to dock them")
+      metrics.phase("merging")
+      merge_outputs(jobs, stored_names)
+      manifest.mark("output", "merged")
+      remove_shards(["Scores_" + str(job[0]) + ".txt" for job in jobs] + ["Dropped_" + str(job[0]) + ".txt" for job in jobs])
+      remove_shards([name + suffix for name in sorted_names for suffix in ("", COST_SUFFIX, ".lidx")])
+
+    # Adding the new scores to the score store
+    
+    if store is not None:
+     for output_name, todock_name, stored_name in zip(io_args.output_name, todock_names, stored_names):
+      if os.path.exists(output_name):
+        store.add_output_file(output_name)
+      for name in (todock_name, todock_name + ".lidx", stored_name):
+        if os.path.exists(name):
+          os.remove(name)
+
+    # Writing the sorted label files of Deep-Docking
+    
+    metrics.phase("labels")
+    for output_name, label_name in zip(io_args.output_name, io_args.label_name):
+      if os.path.exists(output_name):
+        write_labels(output_name, label_name)
+        os.remove(output_name)
+    manifest.remove()
+    metrics.phase("completed")
+    
+
+# Function to update the queue depth gauges of the metrics file: subjobs (or pipeline batches) waiting for the ligand preparation and prepared ones waiting for a GPU
+def queue_depth(queue_name, change):
+    metrics.inc("queue_depth", change, {"queue": queue_name}, help="Subjobs (or pipeline batches) waiting for the ligand preparation or for a GPU", kind="gauge")
+
+
+# Function to write the output files (the header, the scores taken from the score store and the scores of the subjobs of the input file) and the txt file containing the dropped ligands
+# The score and dropped ligand files of the subjobs are merged into temporary files which are renamed at the end (see WorkFlow_shards.py)
+def merge_outputs(jobs, stored_names):
+    for k, output_name in enumerate(io_args.output_name):
+      parts = [stored_names[k]] if stored_names else []
+      parts += ["Scores_" + str(job[0]) + ".txt" for job in jobs if job[2] == output_name]
+      merge_shards(output_name, parts, header="ZINC_ID r_i_docking_score\n")
+    merge_shards("Dropped_ligands.txt", ["Dropped_" + str(job[0]) + ".txt" for job in jobs], header="ID")
+
+
+# Function to prepare and dock the molecules of the input files
+def run_docking(jobs):
+
+    # Building the line index of the input files once, the ligand preparation subjobs seek directly to their first line with it
+    for input_name in io_args.input_name:
+     load_line_index(input_name)
+
+    # One process pool prepares the ligands of every subjob with all CPUs, while one thread per GPU hands the subjobs to it and runs the docking
+    
+    # The processes of the pool read the box of the prefilter from the maps.fld file
+    
+    prefilter_map = io_args.map_name if io_args.prefilter == "yes" else ""
+    
+    # The per-ligand stage times are written into one trace shard per process (the docking records by this process), the shards are appended to the trace file at the end
+    
+    # The ETA of the metrics file is calculated from the docked and dropped ligands since the start of the docking
+    
+    metrics.set("ligands_total", sum(job[4] - job[3] for job in jobs if not manifest.done(job[0], "docked")), help="Number of the ligands docked in this run")
+    metrics.set("docking_start_seconds", round(time.time(), 3), help="Start time of the docking (unix time)")
+    
+    global prep_pool, trace
+    if io_args.trace_file:
+     trace = process_writer(io_args.trace_file, {"iteration": io_args.iteration})
+    prep_pool = mp.Pool(processes=cpus, initializer=init_worker, initargs=(io_args.protonation, io_args.localopt, io_args.cache_folder, io_args.cache_size, prefilter_map, io_args.trace_file, io_args.iteration))
+    if io_args.pipeline == "yes":
+     timings = pipeline(jobs)
+    else:
+     jobs = [job for job in jobs if not manifest.done(job[0], "docked")]
+     queue_depth("preparation", sum(1 for job in jobs if not batch_prepared(job[0])))
+     pool_size = gpus
+     pool = ThreadPool(processes=pool_size)
+     collectedResults = list(pool.imap_unordered(multiproc, jobs))	# The subjobs (or batches) of all input files are handed out one by one from the shared queue of the pool, in the order in which the threads become free
+     pool.close()
+     timings = [t for subjob_timings in collectedResults for t in subjob_timings]
+    prep_pool.close()
+    prep_pool.join()
+    if trace is not None:
+     trace.close()
+     merge_trace(io_args.trace_file)
+     print("Per-ligand stage times have been written into " + str(io_args.trace_file))
+    print(format_timings(timings))
+
+    # Deleting the least recently used ligands if the ligand cache is larger than its size limit
+    
+    if io_args.cache_folder:
+      deleted = LigandCache(io_args.cache_folder, io_args.cache_size).evict()
+      print(str(deleted) + " ligands have been deleted from the ligand cache")
+    print(devices.report())
     
 
 ### Script starts here ### 
 
 # Preliminary calculations
 
+store = None
+trace = None
+costs = {}	# Estimated docking cost of the lines of the input files sorted by the cost
+if io_args.score_store:
+ store = ScoreStore(io_args.score_store, io_args.map_name, "AutoDockGPU|" + os.path.basename(str(io_args.docking_program)) + "|prot=" + str(io_args.protonation) + "|loc=" + str(io_args.localopt))	# The scores are only reused for the same grid and settings
+
 devlist = str(io_args.gpudevices).split(",")	# For GPU device selection
 devs = len(devlist)
+devices = DeviceLeaseManager(devlist)
+
+# Progress metrics, written into the metrics file on an interval (if it is given)
+
+metrics = MetricsFile(io_args.metrics_file, {"program": "AutoDockGPU"}, io_args.metrics_interval)
+if str(io_args.iteration).isdigit():
+ metrics.set("iteration", int(io_args.iteration), help="Deep-Docking iteration")
+for name in ("ligands_prepared_total", "ligands_docked_total", "ligands_dropped_total"):
+ metrics.inc(name, 0, help="Ligands " + name.split("_")[1] + " in this run")
+metrics.collect(docking_collector(devices))
   
 start_time = time.time()
 cpus = int(io_args.n_cpu) * int(devs)
@@ -205,8 +456,13 @@ if int(devs) > int(io_args.n_subjobs):
  print("ERROR: Number of subjobs is smaller than the number of GPUs to use")
 elif int(devs) < 1:
  print("ERROR: invalid number of GPUs")
+elif len(io_args.output_name) != len(io_args.input_name) or len(io_args.label_name) not in (0, len(io_args.input_name)):
+ print("ERROR: the number of output (and label) files has to be the same as the number of input files")
 else:
- main() 
+ try:
+  main() 
+ finally:
+  metrics.stop()
 
 # Write out timing results
 
@@ -1,29 +1,24 @@
 #!/usr/bin/env python3
 
-# Simple script to convert smiles strings to 3D sdf structures using RDkit. To use the script activate the rdkit (my-rdkit-env) environment with conda.
-# Please note that the order of compounds in the sdf file won't be the same as in the .smi file.
-# Dropped ligands will be collected at Dropped_ligands.txt
+# Simple script to convert smiles strings to 3D pdbqt structures using OpenBabel. To use the script activate the rdkit (my-rdkit-env) environment with conda.
+# Please note that the order of compounds in the batch file won't be the same as in the .smi file.
+# The preparation itself is found in WorkFlow_ligand_prep.py, AutoDockGPU_WorkFlow_smiles2score_main.py imports it directly. This script is the command line interface of the same functions.
 # To install openbabel: conda install -c conda-forge openbabel
 # To install dimorphite_dl: python3 pip install dimorphite_dl and copy it to the proper place e.g. anaconda3/envs/my-rdkit-env/lib/python3.9/site-packages/
 # To install multiprocessing: python3 pip install multiprocessing
 
 import time
-from itertools import (takewhile,repeat)
 import multiprocessing as mp
-import os
 import argparse
-import subprocess
-from openbabel import openbabel, pybel
-import re
-from dimorphite_dl import DimorphiteDL
-from os import path
+from WorkFlow_trace import merge_trace
+from WorkFlow_ligand_prep import init_worker, prepare_autodock_batch, format_timings, PREP_CHUNK
 
 
 # Getting the proper inputs
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--input_name',required=True,help='Input smi file, separated by space.')
-parser.add_argument('-c', '--count',required=True,help='Input smi file, separated by space.')
+parser.add_argument('-i', '--input_name',required=True,help='Input smi file, separated by space or tab.')
+parser.add_argument('-c', '--count',required=True,help='Serial number of the subjob (used in the name of the batch and ID files)')
 parser.add_argument('-map', '--map_name',required=True,help='Name of the maps.fld file for AutoDockGPU')
 parser.add_argument('-start', '--start',required=True,help='Start #')
 parser.add_argument('-end', '--end',required=True,help='End #')
@@ -31,114 +26,33 @@ parser.add_argument('-n', '--n_cpu',required=True,help='Number of CPUs to use')
 parser.add_argument('-sj', '--n_subjobs',required=True,help='Number of subjobs')
 parser.add_argument('-prot', '--protonation',required=False,default='no',choices=['yes', 'no'],help='Find the major protonation form at pH: 7.4 (default: no)')
 parser.add_argument('-loc', '--localopt',required=False,default='no',choices=['yes', 'no'],help='Perform local optimization on generated 3D structure (default: no)')
+parser.add_argument('-cache', '--cache_folder',required=False,default='',help='Folder of the cache of prepared 3D ligands, shared by the Deep-Docking iterations (default: no cache)')
+parser.add_argument('-cs', '--cache_size',required=False,default=10,help='Maximum size of the ligand cache in GB (default: 10)')
+parser.add_argument('-pc', '--prep_chunk',required=False,default=PREP_CHUNK,help='Number of ligands in one ligand preparation task, the tasks are taken by the CPUs one by one (default: ' + str(PREP_CHUNK) + ', 0: the lines are divided into n_subjobs equal tasks)')
+parser.add_argument('-trace', '--trace_file',required=False,default='',help='JSONL file of the per-ligand preparation stage times, see WorkFlow_trace.py (default: no trace)')
+parser.add_argument('-it', '--iteration',required=False,default='',help='Deep-Docking iteration written into the trace records (default: none)')
 io_args = parser.parse_args()
 
 
-
-# Function to return the nth line from the smile
-def get_lines(fp, line_numbers):
-    return (x for i, x in enumerate(fp) if i in line_numbers)
-
-
-# Function to divide the 3D confgen and docking into subjobs
-def multiproc(count):  
-
-       # Calculating the starting and ending positions
-       
-       start = int(io_args.start) + subchunk_size * count	# The line number to start with is extracted from the other script
-       if int(chunk_size) % int(io_args.n_subjobs) != 0 and count == (int(io_args.n_subjobs)-1):
-        end = int(io_args.start) + int(chunk_size)	# The last line is based on the number of subjobs
-       else:
-        end = int(io_args.start) + subchunk_size * (count + 1)	# The last line is based on the number of subjobs
-       fb = open(fb_file, 'a')
-       IDfile = open(ID_file, 'a')              
-              
-       # Extracting smiles stings based on the line number in the .smi input file
-              
-       for ite in range(start, end): 	# Iterating through the line numbers between the limits calculated based on the total number of entries and the number of subjobs
-        fp = open(io_args.input_name, 'r')
-        lines = get_lines(fp, [ite])
-        for line in lines:
-         print(line)
-         tr = line.strip().split(" ")
-         if len(tr) != 2:
-           print("Invalid number of columns for line: " + str(line))
-         else:           
-           smiles = tr[0]
-           ID = tr[1]
-           
-           # Finding the correct protonation state of ligand with dimorphite_dl
-           
-           if str(io_args.protonation) == "yes":
-            dimorphite_dl = DimorphiteDL(
-              min_ph=7.4,
-              max_ph=7.4,
-              max_variants=10,
-              label_states=False,
-              pka_precision=1.0
-            )             
-            psmiles=dimorphite_dl.protonate(smiles)
-            smiles = psmiles[0]
-           
-           # Converting the ligands into pdbqt and writing the batch files' entries
-                
-           try:
-            name = "tmp"+str(ID)+".pdbqt"            
-            fb.write("\n" + "./"+ name)
-            fb.write("\n" + "Ligand_"+str(ID))
-            IDfile.write(str(ID) + "\n")
-            
-            # Smiles conversion from smi to 3D pdbqt
-            
-            obConversion = openbabel.OBConversion()
-            obConversion.SetInAndOutFormats("smi", "sdf")     
-            mol = openbabel.OBMol()
-            obConversion.ReadString(mol, smiles)
-            pybelmol = pybel.Molecule(mol)                                    
-            pybelmol.addh()	# Adding hydrogens
-            pybelmol.make3D()	# Making 3D structure
-            
-            # Perform local optimization if required
-            
-            if str(io_args.localopt) == "yes":
-             pybelmol.localopt()
-            pybelmol.write("pdbqt", name, overwrite=True)
-                         
-           except:
-            print("Error during conversion of ligand: "+str(ID))
-            
-        fp.close()	# Closes the input file                              
-       fb.close()	# Closes the batch file
-       IDfile.close()	# Closes the ID file
-       
-
 def main():        
  if __name__ == '__main__':
        
-    # Run the multiple processes
+    # Run the multiple processes, the ligand preparation engine is created once in each process
     
-    counter = range(int(io_args.n_subjobs))
     pool_size = cpus
-    pool = mp.Pool(processes=pool_size,)
-    collectedResults = pool.map(multiproc, counter)
+    pool = mp.Pool(processes=pool_size, initializer=init_worker, initargs=(io_args.protonation, io_args.localopt, io_args.cache_folder, io_args.cache_size, "", io_args.trace_file, io_args.iteration))
+    collectedResults = prepare_autodock_batch(pool, io_args.input_name, io_args.count, io_args.map_name, io_args.start, io_args.end, io_args.n_subjobs, int(io_args.prep_chunk))
     pool.close()
+    pool.join()
+    if io_args.trace_file:
+     merge_trace(io_args.trace_file)
+    print(format_timings(collectedResults))
     
  
 ### Script starts here ### 
-  
-# Creating autodock batch file and a list file to delete ligand files later (numbered with the corresponding count number)   
-    
-fb_file = "Batch_py" + str(io_args.count) + ".txt"
-ID_file = "Lig_IDs_" + str(io_args.count) + ".txt" 
-with open (fb_file, "w") as batch:
- batch.write(io_args.map_name)
-with open (ID_file, "w") as IDs:
- IDs.write("")
 
 # Preliminary calculations
 
-chunk_size = int(io_args.end) - int(io_args.start)	# Calculate how many ligands must be converted in this subjob
-subchunk_size = int(chunk_size) // int(io_args.n_subjobs)	# Calculate how many ligands must be converted in one process
 start_time = time.time()
 cpus = int(io_args.n_cpu)
  
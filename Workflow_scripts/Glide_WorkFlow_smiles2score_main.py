@@ -10,27 +10,50 @@
 import time
 from itertools import (takewhile,repeat)
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 import os
+import sys
 import argparse
 import subprocess
 import re
 from os import path
+from glob import glob
+from WorkFlow_line_index import load_line_index, read_lines, split_smiles_line
+from WorkFlow_ligand_cache import LigandCache
+from WorkFlow_score_store import ScoreStore
+from WorkFlow_labels import write_labels
+from WorkFlow_manifest import RunManifest, run_key
+from WorkFlow_shards import merge_shards, remove_shards
+from WorkFlow_ligand_prep import init_worker, prepare_glide_batch, format_timings, PREP_CHUNK
+from WorkFlow_trace import process_writer, merge_trace
+from WorkFlow_metrics import MetricsFile, docking_collector
 import pandas as pd
 
 
 # Getting the proper inputs
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--input_name',required=True,help='Input smi file, separated by space.')
-parser.add_argument('-f', '--folder',required=True,help='Folder of the sub script, / is required at the end')
-parser.add_argument('-o', '--output_name',required=True,help='Name of output file with scores')
+parser.add_argument('-i', '--input_name',required=True,nargs='+',help='Input smi file(s), separated by space or tab. The ligands of all input files (e.g. the test, train and validation sets) are docked in one run')
+parser.add_argument('-f', '--folder',required=False,default='',help='Folder of the sub script (not used, the ligand preparation is imported from WorkFlow_ligand_prep.py)')
+parser.add_argument('-o', '--output_name',required=True,nargs='+',help='Name of output file with scores, one for each input file')
+parser.add_argument('-l', '--label_name',required=False,nargs='+',default=[],help='Name of the sorted label file for Deep-Docking (r_i_docking_score,ZINC_ID), one for each input file, the output files with scores are deleted after they have been written (default: no label file)')
 parser.add_argument('-grid', '--grid_name',required=True,help='Name of the grid file (filename.zip) for Glide')
 parser.add_argument('-nc', '--n_cpu',required=True,help='Number of CPUs to use per subjob')
 parser.add_argument('-sj', '--n_subjobs',required=True,help='Number of subjobs')
 parser.add_argument('-prot', '--protonation',required=False,default='no',choices=['yes', 'no'],help='Find the major protonation form at pH: 7.4 (default: no)')
 parser.add_argument('-loc', '--localopt',required=False,default='no',choices=['yes', 'no'],help='Perform local optimization on generated 3D structure (default: no)')
+parser.add_argument('-cache', '--cache_folder',required=False,default='',help='Folder of the cache of prepared 3D ligands, shared by the Deep-Docking iterations (default: no cache)')
+parser.add_argument('-cs', '--cache_size',required=False,default=10,help='Maximum size of the ligand cache in GB (default: 10)')
+parser.add_argument('-store', '--score_store',required=False,default='',help='SQLite file storing the docking scores of the earlier runs, molecules found in it are not docked again (default: no score store)')
+parser.add_argument('-single', '--single_job',required=False,default='no',choices=['yes', 'no'],help='Prepare the ligands of every subjob with all CPUs first, then dock all of them in one Glide job divided into n_subjobs parts (-NJOBS) running on n_cpu cores (default: no)')
+parser.add_argument('-bs', '--batch_size',required=False,default=0,help='Number of ligands in one Glide job, the input files are cut into batches which are handed out one by one from a shared queue (default: 0, the input files are divided into n_subjobs parts)')
+parser.add_argument('-pc', '--prep_chunk',required=False,default=PREP_CHUNK,help='Number of ligands in one ligand preparation task, the tasks are taken by the CPUs one by one (default: ' + str(PREP_CHUNK) + ', 0: the ligands of a subjob are prepared in one task, or divided into n_cpu equal tasks in single job mode)')
 parser.add_argument('-d', '--delete',required=False,default='no',choices=['yes', 'no'],help='Delete ligand pdbqt, dlg, xml and Batch files? (default: no)')
 #parser.add_argument('-v', '--verbosity',required=False,default='scoresonly',choices=['scoresonly', 'verbose'],help='Set verbose if autodock log file is required (default: scoresonly)')
+parser.add_argument('-trace', '--trace_file',required=False,default='',help='JSONL file of the per-ligand preparation stage times and the times of the Glide jobs, see WorkFlow_trace.py (default: no trace)')
+parser.add_argument('-it', '--iteration',required=False,default='',help='Deep-Docking iteration written into the trace records (default: none)')
+parser.add_argument('-metrics', '--metrics_file',required=False,default='',help='Prometheus text file (.prom) of the progress metrics (ligands prepared, docked and dropped, queue depth, phase, ETA), updated on an interval, see WorkFlow_metrics.py (default: no metrics file)')
+parser.add_argument('-mi', '--metrics_interval',required=False,default=15,help='Update interval of the metrics file in seconds (default: 15)')
 io_args = parser.parse_args()
 
 # Function to calculate the number of entries in the file (the number of lines)
@@ -40,29 +63,62 @@ def rawincount(filename):
     return sum( buf.count(b'\n') for buf in bufgen )
     f.close()
     
-# Function to divide the 3D confgen and docking into subjobs
-def multiproc(count):        
+# Function to divide the input files into subjobs, every input file is divided into n_subjobs parts
+# The subjobs of all input files are handed out from one queue, so the CPUs do not wait for the last subjob of an input file before the next input file is started
+def subjobs():
+    jobs = []
+    for input_name, output_name in zip(io_args.input_name, io_args.output_name):
        
-       # Calculate the block sizes (number of smiles in one particular docking process) and send it to the subscript
-
-       fb_file = "Ligand_file_" + str(count) + ".sdf"       
-       num = rawincount(io_args.input_name)
-       size = num//int(io_args.n_subjobs)
-       countline = count * size
-       
-       # The last job contains the rest of the smiles if the compound number divided by the subjobs is not an integer
+       # Calculate the block sizes (number of smiles in one particular docking process)
        
-       if num % int(io_args.n_subjobs) != 0 and count == (int(io_args.n_subjobs)-1):
-        countline2 = num  
-       else:
-        countline2 = (count + 1) * size
+       num = rawincount(input_name)
+       size = num//int(io_args.n_subjobs)
+       for part in range(int(io_args.n_subjobs)):
+        countline = part * size
+        
+        # The last job contains the rest of the smiles if the compound number divided by the subjobs is not an integer
+        
+        if num % int(io_args.n_subjobs) != 0 and part == (int(io_args.n_subjobs)-1):
+         countline2 = num  
+        else:
+         countline2 = (part + 1) * size
+        if countline2 > countline:
+         jobs.append((len(jobs), input_name, output_name, countline, countline2))
+    return jobs
+
+
+# Function to cut the input files into small batches of batch_size ligands, in the same format as the subjobs
+# The batches are handed out one by one to the threads, so a batch of slow ligands only holds up its own thread until the end of that batch
+def batches():
+    jobs = []
+    batch_size = int(io_args.batch_size)
+    for input_name, output_name in zip(io_args.input_name, io_args.output_name):
+        num = rawincount(input_name)
+        for start in range(0, num, batch_size):
+            jobs.append((len(jobs), input_name, output_name, start, min(start + batch_size, num)))
+    return jobs
+
+
+# Function to run the 3D confgen and docking of a subjob
+# The steps completed by an earlier run of the same command are skipped (see the run manifest)
+# If the preparation or the Glide job fails, the subjob is not marked as docked and the files of the subjob are kept for the next run of the same command
+def multiproc(job):        
        
-       # Run the ligand preparation python script for ligands between from countline to countline2 - 1
+       count, input_name, output_name, countline, countline2 = job
+       fb_file = "Ligand_file_" + str(count) + ".sdf"       
+       timings = []
        
-       cmdline_pre = "python " + str(io_args.folder) + "Glide_WorkFlow_smiles2score_sub.py -i " + str(io_args.input_name) + " -c " + str(count) + " -start " + str(countline) + " -end " + str(countline2) + " -n 1 -sj 1 -prot " + str(io_args.protonation) + " -loc " + str(io_args.localopt)	# Here the number of CPUs and the number of subjobs are set to 1, as Glide can handle ligand structures in a single sdf file. The subscripts are run in parallel in n copies defined by the number of CPUs in the main script. 
+       # Prepare the ligands between countline and countline2 - 1 on the shared ligand preparation pool into a single sdf file, as Glide can handle ligand structures in a single sdf file
        
-       print("\n\n-------------------------\nThe following command is running for ligand preparation #" + str(count) + ":\n" + str(cmdline_pre) + "\n-------------------------\n\n")	# For debugging purposes
-       output_pre = subprocess.check_output(cmdline_pre, shell=True, universal_newlines=True)      
+       if not manifest.done(count, "prepared"):
+        print("\n\n-------------------------\nLigand preparation #" + str(count) + " is running for lines " + str(countline) + " - " + str(countline2 - 1) + " of " + str(input_name) + "\n-------------------------\n\n")	# For debugging purposes
+        try:
+         timings = prepare_glide_batch(prep_pool, input_name, count, countline, countline2, 1, int(io_args.prep_chunk))
+        except Exception as e:
+         print("Ligand preparation #" + str(count) + " failed: " + str(e))
+         return timings
+        manifest.mark(count, "prepared")
+        prepared(timings)
 
        # Preparing the input file of the docking
        
@@ -80,82 +136,283 @@ def multiproc(count):
        
        cmdline_glide = "\"${SCHRODINGER}/glide\" " + str(glideinput) + " -OVERWRITE -adjust -HOST localhost:1 -TMPLAUNCHDIR -WAIT"       
        print("\n\n-------------------------\nThe following command is running for Glide docking #" + str(count) + ":\n" + str(cmdline_glide) + "\n-------------------------\n\n")	# For debugging purposes
-       out = subprocess.check_output(cmdline_glide, shell=True, universal_newlines=True)
+       dock_start = time.perf_counter()
+       try:
+        out = subprocess.check_output(cmdline_glide, shell=True, universal_newlines=True)
+        dock_time = time.perf_counter() - dock_start
        
-       # Extracting docking scores to readable format
+        # Extracting docking scores to readable format
        
-       usecols = ["title", "r_i_docking_score"]
-       docking_data = pd.read_csv(glideoutput, usecols=usecols)
+        docking_data = glide_scores("Glide_docking_" + str(count))
+       except Exception as e:
+        print("Glide docking #" + str(count) + " failed: " + str(e))
+        return timings
        score_file = "Glide_docking_scores_" + str(count) + ".txt"       
        docking_data.to_csv(score_file, sep=" ", header=False, index=False) 
+       record_batch(count, countline2 - countline, len(docking_data), dock_time, time.perf_counter() - dock_start - dock_time)
        
        # File deletion if rquired
        
        if io_args.delete == "yes":
          ligandfilesdf = "Ligand_file_" + str(count) + ".sdf"
-         preface = "Glide_docking_" + str(count)
-         inputfile = str(preface) + ".in"         
-         subjoblogfile = str(preface) + "_subjobs.log"
-         posefile = str(preface) + "_subjob_poses.zip"
-         tarfile = str(preface) + "_subjobs.tar.gz"
-         skipfile = str(preface) + "_skip.csv"
-         logfile = str(preface) + ".log"
-         pvfile = str(preface) + "_pv.maegz"
-         csvfile = str(preface) + ".csv" 
          if os.path.exists(ligandfilesdf):
           os.remove(ligandfilesdf) 
-         if os.path.exists(inputfile):
-          os.remove(inputfile) 
-         if os.path.exists(subjoblogfile):
-          os.remove(subjoblogfile)                         
-         if os.path.exists(posefile):
-          os.remove(posefile) 
-         if os.path.exists(tarfile):
-          os.remove(tarfile)        
-         if os.path.exists(skipfile):
-          os.remove(skipfile) 
-         if os.path.exists(logfile):
-          os.remove(logfile) 
-         if os.path.exists(pvfile):
-          os.remove(pvfile) 
-         if os.path.exists(csvfile):
-          os.remove(csvfile) 
+         remove_glide_files("Glide_docking_" + str(count))
           
+       manifest.mark(count, "docked")
        print("Job #" + str(count) + " is completed")       
+       return timings
 
     
+# Function to read the docking scores (title, r_i_docking_score) of a Glide job
+# The csv file merged by Glide is used, if it is missing the csv files of the Glide subjobs ({preface}_1.csv, {preface}_2.csv, ...) are collected
+def glide_scores(preface):
+       usecols = ["title", "r_i_docking_score"]
+       if os.path.exists(preface + ".csv"):
+        return pd.read_csv(preface + ".csv", usecols=usecols)
+       subjob_files = sorted(name for name in glob(preface + "_*.csv") if not name.endswith("_skip.csv"))
+       return pd.concat([pd.read_csv(name, usecols=usecols) for name in subjob_files], ignore_index=True)
+
+
+# Function to count the prepared ligands of a subjob in the metrics
+def prepared(timings):
+       metrics.inc("ligands_prepared_total", sum(t["ligands"] for t in timings))
+       metrics.inc("queue_depth", -1, {"queue": "preparation"}, kind="gauge")
+
+
+# Function to count the docked and dropped ligands of a Glide job in the metrics and to write its record into the trace (the number of ligands, the scored ligands, the time of the Glide job and of the reading of its scores)
+def record_batch(subjob, ligands, scored, dock_time, parse_time):
+       metrics.inc("ligands_docked_total", scored)
+       metrics.inc("ligands_dropped_total", max(0, ligands - scored))
+       if trace is not None:
+        trace.write({"stage": "dock_batch", "subjob": subjob, "ligands": ligands, "scored": scored, "dock": round(dock_time, 6), "parse": round(parse_time, 6)})
+        trace.flush()
+
+
+# Function to delete the files of a Glide job
+def remove_glide_files(preface):
+       for suffix in (".in", "_subjobs.log", "_subjob_poses.zip", "_subjobs.tar.gz", "_skip.csv", ".log", "_pv.maegz", ".csv"):
+        if os.path.exists(str(preface) + suffix):
+         os.remove(str(preface) + suffix)
+       for name in glob(str(preface) + "_*.csv"):	# csv files of the Glide subjobs
+        os.remove(name)
+
+
+# Function to dock the prepared ligands of all subjobs in one Glide job (single job mode)
+# The ligand files of the subjobs are merged into Ligand_file_all.sdf, Glide divides them into n_subjobs parts (-NJOBS) docked on n_cpu cores (-HOST localhost:n_cpu), so Glide is started and the grid is loaded only once
+# The scores are written into the score files of the subjobs by the IDs of their ligands
+# If the Glide job fails, none of the subjobs is marked as docked
+def single_glide_job(jobs):
+
+       jobs = [job for job in jobs if not manifest.done(job[0], "docked")]
+       if not jobs:
+        return
+       preface = "Glide_docking_all"
+       fb_file = "Ligand_file_all.sdf"
+       merge_shards(fb_file, ["Ligand_file_" + str(job[0]) + ".sdf" for job in jobs])
+
+       # Preparing the input file of the docking
+       
+       with open(preface + ".in", "w") as gl_in:
+        gl_in.write("GRIDFILE   " + str(io_args.grid_name) + "\nLIGANDFILE   " + fb_file + "\nPRECISION   HTVS")
+
+       # Performing the docking
+       
+       cmdline_glide = "\"${SCHRODINGER}/glide\" " + preface + ".in -OVERWRITE -adjust -NJOBS " + str(io_args.n_subjobs) + " -HOST localhost:" + str(cpus) + " -TMPLAUNCHDIR -WAIT"
+       print("\n\n-------------------------\nThe following command is running for the Glide docking of " + str(len(jobs)) + " subjobs:\n" + str(cmdline_glide) + "\n-------------------------\n\n")	# For debugging purposes
+       dock_start = time.perf_counter()
+       try:
+        out = subprocess.check_output(cmdline_glide, shell=True, universal_newlines=True)
+        dock_time = time.perf_counter() - dock_start
+        docking_data = glide_scores(preface)
+       except Exception as e:
+        print("The Glide job of " + str(len(jobs)) + " subjobs failed: " + str(e))
+        return
+       
+       # Sorting the docking scores into the score files of the subjobs
+       
+       titles = docking_data["title"].astype(str)
+       for count, input_name, output_name, countline, countline2 in jobs:
+        IDs = set(split_smiles_line(line)[-1] for line in read_lines(input_name, countline, countline2, load_line_index(input_name)) if line.strip())
+        docking_data[titles.isin(IDs)].to_csv("Glide_docking_scores_" + str(count) + ".txt", sep=" ", header=False, index=False)
+       record_batch("all", sum(job[4] - job[3] for job in jobs), len(docking_data), dock_time, time.perf_counter() - dock_start - dock_time)
+       
+       # File deletion if rquired
+       
+       if io_args.delete == "yes":
+         remove_shards([fb_file] + ["Ligand_file_" + str(job[0]) + ".sdf" for job in jobs])
+         remove_glide_files(preface)
+       for job in jobs:
+        manifest.mark(job[0], "docked")
+       print("The Glide job of " + str(len(jobs)) + " subjobs is completed")       
+
+
 def main():        
  if __name__ == '__main__':
     
     print("Docking workflow has been started.")
+    metrics.start()
+    
+    # The run manifest records the completed subjobs, a rerun of the same command (e.g. after a crash) continues the earlier run
     
-    # Creates a new output file which will store the docking results and a txt file containing the dropped ligands
-    with open (io_args.output_name, "w") as scores: 
-      scores.write("ZINC_ID r_i_docking_score\n")
+    global manifest
+    settings = {"output": io_args.output_name, "grid": io_args.grid_name, "subjobs": io_args.n_subjobs, "protonation": io_args.protonation, "localopt": io_args.localopt, "store": io_args.score_store, "single_job": io_args.single_job, "batch_size": io_args.batch_size}
+    manifest = RunManifest(os.path.splitext(io_args.output_name[0])[0] + ".manifest", run_key(io_args.input_name, settings))
+    if manifest.resumed:
+      print("Continuing the earlier run of the same command, the completed subjobs are skipped")
    
-    counter = range(int(io_args.n_subjobs))
-    pool_size = cpus
-    pool = mp.Pool(processes=pool_size,)
-    collectedResults = pool.map(multiproc, counter)
-    pool.close()
+    # Taking the scores of the molecules docked earlier from the score store (into {output}_stored.txt), only the rest of the molecules are docked
+    # A continued run uses the files of the earlier run, so the subjobs contain the same molecules
+    
+    todock_names = []
+    stored_names = []
+    if store is not None:
+     metrics.phase("score_store")
+     for k, output_name in enumerate(io_args.output_name):
+      todock_name = os.path.splitext(output_name)[0] + "_to_dock.smi"
+      stored_name = os.path.splitext(output_name)[0] + "_stored.txt"
+      if not (manifest.resumed and os.path.exists(todock_name) and os.path.exists(stored_name)):
+       open(stored_name, "w").close()
+       stored, missing = store.split_input(io_args.input_name[k], stored_name, todock_name)
+       print(str(stored) + " molecules of " + str(io_args.input_name[k]) + " have been found in the score store, " + str(missing) + " molecules have to be docked")
+      io_args.input_name[k] = todock_name
+      todock_names.append(todock_name)
+      stored_names.append(stored_name)
+
+    # Docking the subjobs which have not been docked yet and merging the scores into the output files
+    
+    jobs = batches() if int(io_args.batch_size) > 0 else subjobs()
+    if not manifest.done("output", "merged"):
+      if any(not manifest.done(job[0], "docked") for job in jobs):
+        metrics.phase("docking")
+        run_docking(jobs)
+      failed = [job[0] for job in jobs if not manifest.done(job[0], "docked")]
+      if failed:
+        sys.exit("ERROR: " + str(len(failed)) + " subjobs have not been docked, run the same command again to dock them")
+      metrics.phase("merging")
+      merge_outputs(jobs, stored_names)
+      manifest.mark("output", "merged")
+      remove_shards(["Glide_docking_scores_" + str(job[0]) + ".txt" for job in jobs])
+
+    # Adding the new scores to the score store
+    
+    if store is not None:
+     for output_name, todock_name, stored_name in zip(io_args.output_name, todock_names, stored_names):
+      if os.path.exists(output_name):
+        store.add_output_file(output_name)
+      for name in (todock_name, todock_name + ".lidx", stored_name):
+        if os.path.exists(name):
+          os.remove(name)
+
+    # Writing the sorted label files of Deep-Docking
+    
+    metrics.phase("labels")
+    for output_name, label_name in zip(io_args.output_name, io_args.label_name):
+      if os.path.exists(output_name):
+        write_labels(output_name, label_name)
+        os.remove(output_name)
+    manifest.remove()
+    metrics.phase("completed")
+    
+
+# Function to write the output files: the header, the scores taken from the score store and the scores of the subjobs of the input file
+# The score files of the subjobs are merged into a temporary file which is renamed at the end (see WorkFlow_shards.py)
+def merge_outputs(jobs, stored_names):
+    for k, output_name in enumerate(io_args.output_name):
+      parts = [stored_names[k]] if stored_names else []
+      parts += ["Glide_docking_scores_" + str(job[0]) + ".txt" for job in jobs if job[2] == output_name]
+      merge_shards(output_name, parts, header="ZINC_ID r_i_docking_score\n")
+
+
+# Function to prepare and dock the molecules of the input files
+def run_docking(jobs):
+
+    # Building the line index of the input files once, the ligand preparation subjobs seek directly to their first line with it
+    for input_name in io_args.input_name:
+     load_line_index(input_name)
+
+    # One process pool prepares the ligands of every subjob, while the threads hand the subjobs to it and run the Glide jobs
+    # If a subjob fails, the other subjobs are still docked and recorded in the run manifest, the failed subjobs are docked by the next run of the same command
+    
+    # The per-ligand stage times are written into one trace shard per process (the Glide job records by this process), the shards are appended to the trace file at the end
+    
+    global prep_pool, trace
+    if io_args.trace_file:
+     trace = process_writer(io_args.trace_file, {"iteration": io_args.iteration})
+    prep_pool = mp.Pool(processes=cpus, initializer=init_worker, initargs=(io_args.protonation, io_args.localopt, io_args.cache_folder, io_args.cache_size, "", io_args.trace_file, io_args.iteration))
+    jobs = [job for job in jobs if not manifest.done(job[0], "docked")]
+    
+    # The ETA of the metrics file is calculated from the docked and dropped ligands since the start of the docking
+    
+    metrics.set("ligands_total", sum(job[4] - job[3] for job in jobs), help="Number of the ligands docked in this run")
+    metrics.set("docking_start_seconds", round(time.time(), 3), help="Start time of the docking (unix time)")
+    metrics.set("queue_depth", sum(1 for job in jobs if not manifest.done(job[0], "prepared")), {"queue": "preparation"}, help="Subjobs waiting for the ligand preparation")
+    if io_args.single_job == "yes":
 
-    # Extracting the docking scores into one file and cleaning up
+     # Single job mode: the ligands of every subjob are prepared with all CPUs, then all of them are docked in one Glide job
+     
+     timings = []
+     for count, input_name, output_name, countline, countline2 in jobs:
+      if not manifest.done(count, "prepared"):
+       print("\n\n-------------------------\nLigand preparation #" + str(count) + " is running for lines " + str(countline) + " - " + str(countline2 - 1) + " of " + str(input_name) + "\n-------------------------\n\n")	# For debugging purposes
+       try:
+        subjob_timings = prepare_glide_batch(prep_pool, input_name, count, countline, countline2, cpus, int(io_args.prep_chunk))
+       except Exception as e:
+        print("Ligand preparation #" + str(count) + " failed: " + str(e))
+        continue
+       manifest.mark(count, "prepared")
+       prepared(subjob_timings)
+       timings += subjob_timings
+     prep_pool.close()
+     single_glide_job([job for job in jobs if manifest.done(job[0], "prepared")])
+    else:
+     pool_size = cpus
+     pool = ThreadPool(processes=pool_size)
+     collectedResults = list(pool.imap_unordered(multiproc, jobs))	# The subjobs (or batches) of all input files are handed out one by one from the shared queue of the pool, in the order in which the threads become free
+     pool.close()
+     prep_pool.close()
+     timings = [t for subjob_timings in collectedResults for t in subjob_timings]
+    prep_pool.join()
+    if trace is not None:
+     trace.close()
+     merge_trace(io_args.trace_file)
+     print("Per-ligand stage times have been written into " + str(io_args.trace_file))
+    print(format_timings(timings))
 
-    for i in range(int(io_args.n_subjobs)):
-     score_file = "Glide_docking_scores_" + str(i) + ".txt"
-     commandline = "cat " + str(score_file) + " >> " + str(io_args.output_name)
-     #print(commandline)
-     out = subprocess.check_output(commandline, shell=True, universal_newlines=True)
-     os.remove(score_file)
+    # Deleting the least recently used ligands if the ligand cache is larger than its size limit
+    
+    if io_args.cache_folder:
+      deleted = LigandCache(io_args.cache_folder, io_args.cache_size).evict()
+      print(str(deleted) + " ligands have been deleted from the ligand cache")
     
 
 ### Script starts here ### 
 
 # Preliminary calculations
  
+store = None
+trace = None
+if io_args.score_store:
+ store = ScoreStore(io_args.score_store, io_args.grid_name, "GlideHTVS|prot=" + str(io_args.protonation) + "|loc=" + str(io_args.localopt))	# The scores are only reused for the same grid and settings
 start_time = time.time()
 cpus = int(io_args.n_cpu)
-main() 
+
+# Progress metrics, written into the metrics file on an interval (if it is given)
+
+metrics = MetricsFile(io_args.metrics_file, {"program": "Glide"}, io_args.metrics_interval)
+if str(io_args.iteration).isdigit():
+ metrics.set("iteration", int(io_args.iteration), help="Deep-Docking iteration")
+for name in ("ligands_prepared_total", "ligands_docked_total", "ligands_dropped_total"):
+ metrics.inc(name, 0, help="Ligands " + name.split("_")[1] + " in this run")
+metrics.collect(docking_collector())
+
+if len(io_args.output_name) != len(io_args.input_name) or len(io_args.label_name) not in (0, len(io_args.input_name)):
+ print("ERROR: the number of output (and label) files has to be the same as the number of input files")
+else:
+ try:
+  main() 
+ finally:
+  metrics.stop()
 
 # Write out timing results
 
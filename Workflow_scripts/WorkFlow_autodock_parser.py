@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Streaming parser of the AutoDockGPU batch (-B) output.
+# The output of the docking process is read line by line and an (ID, best energy) record is emitted as soon as the best energy of a ligand is printed, so the scores are available before the batch has finished and the output is never kept in memory.
+# Ligands without a best energy (e.g. failed docking) are emitted as (ID, None).
+# The ligands of a subjob without a result file are collected by dropped_ligands.
+
+import os
+import re
+import time
+import shlex
+import subprocess
+
+
+LIGAND_LINE = re.compile(r"Ligand file:\s*(\S+)")
+ENERGY_LINE = re.compile(r"(?:samples, best energy|evaluations\. Best energy)\s*(-?[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?)")
+
+
+# Function to return the ligand ID from the name of the ligand file (./tmp{ID}.pdbqt)
+
+def ligand_ID(ligand_file):
+    name = os.path.basename(ligand_file)
+    if name.endswith(".pdbqt"):
+        name = name[:-len(".pdbqt")]
+    if name.startswith("tmp"):
+        name = name[len("tmp"):]
+    return name
+
+
+class AutoDockOutputParser:
+
+    def __init__(self):
+        self.current = None	# ID of the ligand that is being docked and has no best energy yet
+
+    # Processes one line of the output and returns the finished records
+
+    def feed(self, line):
+        if "(" in line:	# Progress and thread messages
+            return []
+        records = []
+        match = LIGAND_LINE.search(line)
+        if match:
+            if self.current is not None:
+                records.append((self.current, None))
+            self.current = ligand_ID(match.group(1))
+            return records
+        match = ENERGY_LINE.search(line)
+        if match and self.current is not None:
+            records.append((self.current, match.group(1)))
+            self.current = None
+        return records
+
+    # Returns the record of the last ligand if the output ended before its best energy
+
+    def close(self):
+        records = []
+        if self.current is not None:
+            records.append((self.current, None))
+            self.current = None
+        return records
+
+
+# Function to run AutoDockGPU and yield the (ID, best energy) records while it is running
+# If log_name is given, the complete output is also written into that file (verbose mode)
+# If timed is True, (ID, best energy, docking seconds, parsing seconds) records are yielded: the docking time of a ligand is the time since the record of the previous ligand (or the start of the batch), the parsing time is the time spent in the parser since then
+# AutoDockGPU exits with a nonzero code if a ligand of the batch fails (e.g. an atom type without a map), the records of the other ligands are still yielded and the failed ligands are collected by dropped_ligands
+# subprocess.CalledProcessError is raised at the end only if the docking program failed without docking any ligand (no ligand of the batch has been started)
+
+def stream_autodock(command, log_name=None, timed=False):
+    if isinstance(command, str):
+        command = shlex.split(command)
+    parser = AutoDockOutputParser()
+    log = open(log_name, "w") if log_name else None
+    last = time.perf_counter()
+    parse = 0.0
+    ligands = 0
+    try:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1) as process:
+            for line in process.stdout:
+                if log is not None:
+                    log.write(line)
+                start = time.perf_counter()
+                records = parser.feed(line)
+                parse += time.perf_counter() - start
+                ligands += len(records)
+                for ID, energy in records:
+                    if timed:
+                        now = time.perf_counter()
+                        yield ID, energy, now - last - parse, parse
+                        last, parse = now, 0.0
+                    else:
+                        yield ID, energy
+            records = parser.close()
+            ligands += len(records)
+            for ID, energy in records:
+                if timed:
+                    now = time.perf_counter()
+                    yield ID, energy, now - last - parse, parse
+                    last, parse = now, 0.0
+                else:
+                    yield ID, energy
+            returncode = process.wait()
+    finally:
+        if log is not None:
+            log.close()
+    if returncode != 0:
+        if ligands == 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        print("The docking program exited with code " + str(returncode) + " after " + str(ligands) + " ligands, the ligands without a result are collected as dropped ligands")
+
+
+# Function to collect the IDs of an ID file (Lig_IDs_{count}.txt) whose ligands have not been docked (Ligand_{ID}.xml is missing)
+# If delete is True, the pdbqt, xml and dlg files of the ligands are deleted and a ligand is dropped if one of its files is missing
+
+def dropped_ligands(ID_file, delete=False):
+    dropped = []
+    if not os.path.exists(ID_file):
+        return dropped	# No ligands have been prepared (e.g. the preparation of the subjob failed)
+    with open(ID_file, "r") as file:
+        for line in file:
+            ID = line.strip()
+            if not ID:
+                continue
+            if delete:
+                try:
+                    os.remove("tmp" + ID + ".pdbqt")
+                    os.remove("Ligand_" + ID + ".xml")
+                    os.remove("Ligand_" + ID + ".dlg")
+                except OSError:
+                    dropped.append(ID)
+            elif not os.path.exists("Ligand_" + ID + ".xml"):
+                dropped.append(ID)
+    return dropped
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# Bit-packed Morgan fingerprint store of the ligand library.
+# The text fingerprint files of Deep-Docking (morgan_fingerprints/*.txt, lines of ID,bit,bit,... with the indices of the set bits) are converted once into shards of packed uint8 rows (128 bytes for 1024 bits), which are read through numpy memory maps without parsing.
+# Every shard has four files in the store folder:
+#   {shard}.fp        the packed fingerprints, one 128 byte row per molecule
+#   {shard}.ids       the IDs of the rows, one per line
+#   {shard}.hash.npy  the sorted 64 bit hashes of the IDs
+#   {shard}.row.npy   the rows of the sorted hashes
+# shards.txt lists the shards in order. An ID is found by a binary search in the hashes of the shards, and the ID of the found row is checked in the .ids file.
+#
+# Converting the fingerprints:  python WorkFlow_fingerprints.py -mode convert -i morgan_fingerprints/ -o morgan_store/
+# Exporting the text fingerprints of a list of IDs (one ID per line):  python WorkFlow_fingerprints.py -mode export -i morgan_store/ -ids train_set.txt -o train_morgan.txt
+
+import os
+import glob
+import hashlib
+import argparse
+import numpy as np
+from WorkFlow_line_index import load_line_index
+
+
+FP_BITS = 1024
+ROW_BYTES = FP_BITS // 8
+SHARD_LIST = "shards.txt"
+
+
+# Function to calculate the 64 bit hashes of IDs
+
+def id_hashes(IDs):
+    return np.array([int.from_bytes(hashlib.blake2b(str(ID).encode(), digest_size=8).digest(), "little") for ID in IDs], dtype=np.uint64)
+
+
+# Function to pack lists of set bit indices into fingerprint rows, the IDs of the rows are used in the error message of invalid bit indices (outside 0 - 1023)
+
+def pack_bits(bit_lists, IDs=None):
+    dense = np.zeros((len(bit_lists), FP_BITS), dtype=np.uint8)
+    for row, bits in enumerate(bit_lists):
+        invalid = [bit for bit in bits if bit < 0 or bit >= FP_BITS]
+        if invalid:
+            raise ValueError("Invalid bit indices of the fingerprint of " + str(IDs[row] if IDs is not None else "row " + str(row)) + " (0 - " + str(FP_BITS - 1) + "): " + ", ".join(str(bit) for bit in invalid[:10]))
+        dense[row, bits] = 1
+    return np.packbits(dense, axis=1)
+
+
+# Function to convert one text fingerprint file into a shard of the store, the files are written into temporary files and renamed at the end
+# Returns the number of molecules
+
+def convert_file(text_file, store_folder, chunk_rows=100000):
+    shard = os.path.splitext(os.path.basename(text_file))[0]
+    base = os.path.join(store_folder, shard)
+    IDs = []
+    with open(text_file, "r") as f, open(base + ".fp.tmp", "wb") as fp, open(base + ".ids.tmp", "w") as ids:
+        chunk_IDs = []
+        chunk_bits = []
+        for line in f:
+            tr = line.rstrip().split(",")
+            if not tr[0]:
+                continue
+            try:
+                bits = [int(bit) for bit in tr[1:] if bit != ""]
+            except ValueError:
+                continue	# Header line
+            chunk_IDs.append(tr[0])
+            chunk_bits.append(bits)
+            if len(chunk_IDs) == chunk_rows:
+                fp.write(pack_bits(chunk_bits, chunk_IDs).tobytes())
+                ids.write("\n".join(chunk_IDs) + "\n")
+                IDs += chunk_IDs
+                chunk_IDs, chunk_bits = [], []
+        if chunk_IDs:
+            fp.write(pack_bits(chunk_bits, chunk_IDs).tobytes())
+            ids.write("\n".join(chunk_IDs) + "\n")
+            IDs += chunk_IDs
+    hashes = id_hashes(IDs)
+    order = np.argsort(hashes, kind="stable")
+    np.save(base + ".hash.tmp.npy", hashes[order])
+    np.save(base + ".row.tmp.npy", order.astype(np.int64))
+    for tmp_suffix, suffix in ((".fp.tmp", ".fp"), (".ids.tmp", ".ids"), (".hash.tmp.npy", ".hash.npy"), (".row.tmp.npy", ".row.npy")):
+        os.replace(base + tmp_suffix, base + suffix)
+    return len(IDs)
+
+
+# Function to convert every text fingerprint file (*.txt) of a folder into the store
+
+def convert_folder(text_folder, store_folder, pattern="*.txt"):
+    os.makedirs(store_folder, exist_ok=True)
+    shards = []
+    total = 0
+    for text_file in sorted(glob.glob(os.path.join(text_folder, pattern))):
+        count = convert_file(text_file, store_folder)
+        print(str(text_file) + ": " + str(count) + " fingerprints")
+        shards.append(os.path.splitext(os.path.basename(text_file))[0])
+        total += count
+    with open(os.path.join(store_folder, SHARD_LIST + ".tmp"), "w") as f:
+        f.write("\n".join(shards) + "\n")
+    os.replace(os.path.join(store_folder, SHARD_LIST + ".tmp"), os.path.join(store_folder, SHARD_LIST))
+    return total
+
+
+class FingerprintStore:
+
+    def __init__(self, store_folder):
+        self.folder = str(store_folder)
+        with open(os.path.join(self.folder, SHARD_LIST), "r") as f:
+            self.shards = [line.strip() for line in f if line.strip()]
+        self._fps = {}
+        self._index = {}
+
+    def _base(self, shard):
+        return os.path.join(self.folder, self.shards[shard])
+
+    # Returns the packed fingerprints of a shard as a read-only memory map of shape (molecules, 128)
+
+    def fingerprints(self, shard):
+        if shard not in self._fps:
+            name = self._base(shard) + ".fp"
+            rows = os.path.getsize(name) // ROW_BYTES
+            self._fps[shard] = np.memmap(name, dtype=np.uint8, mode="r", shape=(rows, ROW_BYTES)) if rows else np.zeros((0, ROW_BYTES), dtype=np.uint8)
+        return self._fps[shard]
+
+    def _hash_index(self, shard):
+        if shard not in self._index:
+            base = self._base(shard)
+            self._index[shard] = (np.load(base + ".hash.npy", mmap_mode="r"), np.load(base + ".row.npy", mmap_mode="r"))
+        return self._index[shard]
+
+    def __len__(self):
+        return sum(len(self.fingerprints(shard)) for shard in range(len(self.shards)))
+
+    # Returns the (shard, row) of every ID, None if the ID is not in the store
+
+    def locate(self, IDs):
+        IDs = [str(ID) for ID in IDs]
+        hashes = id_hashes(IDs)
+        found = [None] * len(IDs)
+        candidates = []	# (shard, row, position of the ID)
+        for shard in range(len(self.shards)):
+            shard_hashes, shard_rows = self._hash_index(shard)
+            if len(shard_hashes) == 0:
+                continue
+            left = np.searchsorted(shard_hashes, hashes, side="left")
+            right = np.searchsorted(shard_hashes, hashes, side="right")
+            for pos in np.nonzero(right > left)[0]:
+                for k in range(left[pos], right[pos]):
+                    candidates.append((shard, int(shard_rows[k]), int(pos)))
+
+        # Checking the IDs of the candidate rows (a hash can belong to more than one ID), the rows are read in sorted order
+        # The ID file of a shard is opened once and the rows are read at their offsets in the line index
+
+        candidates.sort()
+        files = {}
+        try:
+            for shard, row, pos in candidates:
+                if found[pos] is not None:
+                    continue
+                if shard not in files:
+                    ids_file = self._base(shard) + ".ids"
+                    files[shard] = (open(ids_file, "rb"), load_line_index(ids_file))
+                f, offsets = files[shard]
+                f.seek(int(offsets[row]))
+                if f.readline().decode().strip() == IDs[pos]:
+                    found[pos] = (shard, row)
+        finally:
+            for f, offsets in files.values():
+                f.close()
+        return found
+
+    # Returns the packed fingerprints of the IDs (shape (IDs, 128)) and a boolean array which is False for the IDs that are not in the store (their rows are zero)
+
+    def packed(self, IDs):
+        locations = self.locate(IDs)
+        result = np.zeros((len(locations), ROW_BYTES), dtype=np.uint8)
+        mask = np.zeros(len(locations), dtype=bool)
+        by_shard = {}
+        for pos, location in enumerate(locations):
+            if location is not None:
+                by_shard.setdefault(location[0], []).append((location[1], pos))
+        for shard, pairs in by_shard.items():
+            pairs.sort()
+            rows = np.array([row for row, pos in pairs])
+            positions = np.array([pos for row, pos in pairs])
+            result[positions] = self.fingerprints(shard)[rows]
+            mask[positions] = True
+        return result, mask
+
+    # Returns the unpacked fingerprints of the IDs (shape (IDs, 1024), values 0 or 1) and the mask of the found IDs
+
+    def bits(self, IDs):
+        result, mask = self.packed(IDs)
+        return np.unpackbits(result, axis=1), mask
+
+    # Full scan of the store, yields (shard, IDs, packed fingerprints) blocks of at most block_rows molecules
+
+    def scan(self, block_rows=100000):
+        for shard in range(len(self.shards)):
+            fps = self.fingerprints(shard)
+            with open(self._base(shard) + ".ids", "r") as ids:
+                for start in range(0, len(fps), block_rows):
+                    block = fps[start:start + block_rows]
+                    yield shard, [ids.readline().rstrip("\n") for _ in range(len(block))], block
+
+    # Writes the fingerprints of the IDs in the text format of Deep-Docking (ID,bit,bit,...), returns the number of written fingerprints
+
+    def export(self, IDs, out_file):
+        IDs = [str(ID) for ID in IDs]
+        dense, mask = self.bits(IDs)
+        written = 0
+        with open(out_file, "w") as out:
+            for ID, row, found in zip(IDs, dense, mask):
+                if found:
+                    out.write(ID + "," + ",".join(str(bit) for bit in np.flatnonzero(row)) + "\n")
+                    written += 1
+        return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-mode', '--mode',required=True,choices=['convert', 'export'],help='convert: convert the text fingerprint files of a folder into the store, export: write the text fingerprints of a list of IDs')
+    parser.add_argument('-i', '--input',required=True,help='Folder of the text fingerprint files (convert) or of the store (export)')
+    parser.add_argument('-o', '--output',required=True,help='Folder of the store (convert) or the text fingerprint file (export)')
+    parser.add_argument('-ids', '--id_file',required=False,default='',help='File of the IDs to export, one ID per line (export)')
+    io_args = parser.parse_args()
+    if io_args.mode == "convert":
+        print(str(convert_folder(io_args.input, io_args.output)) + " fingerprints have been converted")
+    else:
+        with open(io_args.id_file, "r") as f:
+            IDs = [line.split(",")[0].strip() for line in f if line.strip()]
+        print(str(FingerprintStore(io_args.input).export(IDs, io_args.output)) + " fingerprints have been exported")
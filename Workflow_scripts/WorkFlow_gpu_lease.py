@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# GPU device lease manager of the AutoDockGPU workflow.
+# The docking threads check out a free device from the -gpudev list, dock, and return it. A device is never given to two docking jobs at the same time, and a thread waits if every device is busy.
+# The manager also measures how long each device has been busy.
+
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+
+class DeviceLeaseManager:
+
+    def __init__(self, devices):
+        self.devices = [str(dev).strip() for dev in devices]
+        self.free = queue.Queue()
+        for dev in self.devices:
+            self.free.put(dev)
+        self.lock = threading.Lock()
+        self.busy_seconds = dict.fromkeys(self.devices, 0.0)
+        self.jobs = dict.fromkeys(self.devices, 0)
+        self.leased = dict.fromkeys(self.devices, None)	# Start time of the current lease, None if the device is free
+
+    # Checks out a free device (waits until one becomes free) and returns it at the end of the with block
+
+    @contextmanager
+    def lease(self):
+        dev = self.free.get()
+        start = time.time()
+        with self.lock:
+            self.leased[dev] = start
+        try:
+            yield dev
+        finally:
+            with self.lock:
+                self.leased[dev] = None
+                self.busy_seconds[dev] += time.time() - start
+                self.jobs[dev] += 1
+            self.free.put(dev)
+
+    # Returns the busy time of the devices in seconds, including the current leases
+
+    def usage(self):
+        now = time.time()
+        with self.lock:
+            return {dev: self.busy_seconds[dev] + (now - self.leased[dev] if self.leased[dev] is not None else 0.0) for dev in self.devices}
+
+    def report(self):
+        usage = self.usage()
+        text = "GPU device usage:"
+        for dev in self.devices:
+            text += "\n  device %s: %d docking jobs, busy for %.2f seconds" % (dev, self.jobs[dev], usage[dev])
+        return text
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Grid box prefilter of the AutoDockGPU workflow.
+# The box of the grid (center, number of grid points and spacing) is read from the header of the maps.fld file, the map files are not read.
+# The prefilter checks a prepared ligand on the CPU before it is sent to AutoDockGPU, it drops only the ligands which cannot be placed into the box at all:
+# the ligand is longer than the diagonal of the box, or its atoms are not all inside the box in any orientation (principal axes, long axis along the diagonals of the box and random orientations of the prepared conformer).
+# The affinities are not used for dropping, a bad score of a rigid random placement does not mean that the ligand cannot be docked.
+# Ligands with non-finite coordinates (failed 3D structure generation) are dropped as well.
+
+import os
+import numpy as np
+
+
+# Function to read the grid parameters and the map files of a maps.fld file
+
+def read_fld(fld_file):
+    folder = os.path.dirname(str(fld_file))
+    grid = {"labels": [], "maps": []}
+    with open(fld_file, "r") as fld:
+        for line in fld:
+            tr = line.split()
+            if not tr:
+                continue
+            if tr[0] == "#SPACING":
+                grid["spacing"] = float(tr[1])
+            elif tr[0] == "#NELEMENTS":
+                grid["nelements"] = [int(n) for n in tr[1:4]]
+            elif tr[0] == "#CENTER":
+                grid["center"] = [float(c) for c in tr[1:4]]
+            elif tr[0].startswith("label="):
+                grid["labels"].append(tr[0][len("label="):])
+            elif tr[0] == "variable" and "file=" in line:
+                skip = int(line.split("skip=")[1].split()[0]) if "skip=" in line else 6
+                grid["maps"].append((os.path.join(folder, line.split("file=")[1].split()[0]), skip))
+    return grid
+
+
+# Function to read the coordinates of the atoms of a pdbqt block, a coordinate which cannot be read (e.g. -nan) is returned as NaN
+
+def coordinate(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def ligand_coords(pdbqt_block):
+    coords = []
+    for line in pdbqt_block.splitlines():
+        if line.startswith("ATOM") or line.startswith("HETATM"):
+            coords.append([coordinate(line[30:38]), coordinate(line[38:46]), coordinate(line[46:54])])
+    return np.array(coords, dtype=float).reshape(-1, 3)
+
+
+# Function to generate n random rotation matrices (uniform random quaternions)
+
+def random_rotations(n, rng):
+    u1, u2, u3 = rng.random((3, n))
+    q = np.stack([np.sqrt(1 - u1) * np.sin(2 * np.pi * u2), np.sqrt(1 - u1) * np.cos(2 * np.pi * u2), np.sqrt(u1) * np.sin(2 * np.pi * u3), np.sqrt(u1) * np.cos(2 * np.pi * u3)], axis=1)
+    x, y, z, w = q.T
+    return np.stack([np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=1),
+                     np.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=1),
+                     np.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=1)], axis=1)
+
+
+# Function to generate n rotation matrices which turn the vector axis into the direction and then around the direction by 360 / n degree steps
+
+def axis_rotations(axis, direction, n):
+    axis = axis / np.linalg.norm(axis)
+    direction = direction / np.linalg.norm(direction)
+    cross = np.cross(axis, direction)
+    cos = float(np.dot(axis, direction))
+    skew = np.array([[0, -cross[2], cross[1]], [cross[2], 0, -cross[0]], [-cross[1], cross[0], 0]])
+    if cos < -1 + 1e-9:
+        normal = np.cross(direction, [1.0, 0.0, 0.0] if abs(direction[0]) < 0.9 else [0.0, 1.0, 0.0])
+        normal = normal / np.linalg.norm(normal)
+        align = 2 * np.outer(normal, normal) - np.eye(3)	# Opposite vectors: half turn around a perpendicular axis
+    else:
+        align = np.eye(3) + skew + skew @ skew / (1 + cos)
+    skew = np.array([[0, -direction[2], direction[1]], [direction[2], 0, -direction[0]], [-direction[1], direction[0], 0]])
+    return np.array([(np.eye(3) + np.sin(angle) * skew + (1 - np.cos(angle)) * skew @ skew) @ align for angle in np.linspace(0, 2 * np.pi, int(n), endpoint=False)])
+
+
+class GridPrefilter:
+
+    def __init__(self, fld_file, n_poses=1000, seed=0):
+        grid = read_fld(fld_file)
+        self.n_poses = int(n_poses)
+        self.rng = np.random.default_rng(int(seed))
+        self.size = np.array(grid["nelements"]) * grid["spacing"]	# Edges of the box along x, y and z (NELEMENTS is the number of grid points - 1)
+        self.diagonal = float(np.linalg.norm(self.size))
+
+    # Checks a prepared ligand (pdbqt block), returns (True, None) if it can be docked or (False, reason) if it cannot be placed into the box
+    # Only the geometry is checked: the conformer fits if all of its atoms can be inside the box in at least one orientation (the position can be chosen freely)
+
+    def check(self, pdbqt_block):
+        coords = ligand_coords(pdbqt_block)
+        if not np.all(np.isfinite(coords)):
+            return False, "non-finite coordinates (failed 3D structure generation)"
+        if len(coords) < 2:
+            return True, None
+        coords = coords - coords.mean(axis=0)
+        if np.max(np.linalg.norm(coords[:, None, :] - coords[None, :, :], axis=-1)) > self.diagonal:
+            return False, "larger than the box"
+
+        # Principal axes of the ligand: its extents along the axes can be matched to the edges of the box in any order
+
+        axes = np.linalg.eigh(np.cov(coords.T))[1]
+        projected = coords @ axes
+        if np.all(np.sort(projected.max(axis=0) - projected.min(axis=0)) <= np.sort(self.size)):
+            return True, None
+
+        # Long axis of the ligand along the diagonals of the box (turned around the diagonal) and random orientations, the ligand fits if its extents along x, y and z are within the edges of the box in one of them
+
+        rotations = [axis_rotations(axes[:, -1], self.size * np.array(signs), 36) for signs in ((1, 1, 1), (-1, 1, 1), (1, -1, 1), (1, 1, -1))]
+        rotations = np.concatenate(rotations + [random_rotations(self.n_poses, self.rng)])
+        placed = np.einsum("pij,aj->pai", rotations, coords)
+        extents = placed.max(axis=1) - placed.min(axis=1)
+        if np.any(np.all(extents <= self.size, axis=1)):
+            return True, None
+        return False, "does not fit into the box in any orientation"
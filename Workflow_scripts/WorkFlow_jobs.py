@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Local job runner of the *_DeepDocking_script.py files.
+# The scripts written by Deep-Docking into the simple_job folder of an iteration (one model training per script) are run at the same time, in at most slots jobs.
+# If GPU devices are given, every job leases a free device (WorkFlow_gpu_lease.py) and only sees that device (CUDA_VISIBLE_DEVICES), so a device runs one job at a time.
+# The output of every job is written into its own log file ({folder}/logs/{script}.log). A failed job does not stop the other jobs, the failed jobs are listed at the end.
+# A completed job leaves a {script}.done file next to its log (with its wall time), and it is skipped if the folder is run again (e.g. after a failed job) and the script has not been changed since.
+# If the memory of one job is given (job_memory in GB, e.g. for the simple_job_predictions scripts, which load a model and a slice of the library), a job only starts if the available memory (MemAvailable of /proc/meminfo) is enough for it.
+# The memory of the jobs started in the last ramp seconds is reserved, because they have not allocated it yet. A job is always started if no other job is running.
+# The wall time of every job is measured and the timings are printed when all jobs have finished.
+
+import os
+import sys
+import argparse
+import time
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+from WorkFlow_gpu_lease import DeviceLeaseManager
+
+
+# Function to return the job scripts of a folder in sorted order
+
+def job_scripts(folder):
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if os.path.isfile(os.path.join(folder, name)) and not name.startswith(".")]
+
+
+# Function to return the log and done files of a job script
+
+def job_files(script, log_folder):
+    base = os.path.join(log_folder, os.path.basename(script))
+    return base + ".log", base + ".done"
+
+
+# Function to return the available memory in GB (MemAvailable of /proc/meminfo), None if it is not known
+
+def available_memory():
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.0 / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+# Function to run one job script, its output is written into the log file, returns the exit code
+
+def run_job(script, log_file, device=None):
+    env = dict(os.environ)
+    if device is not None:
+        env["CUDA_VISIBLE_DEVICES"] = str(device)
+    os.chmod(script, os.stat(script).st_mode | 0o111)
+    with open(log_file, "w") as log:
+        return subprocess.call(os.path.abspath(script), shell=True, stdout=log, stderr=subprocess.STDOUT, env=env)
+
+
+class JobRunner:
+
+    def __init__(self, slots=1, gpus="", log_folder="", job_memory=0.0, ramp=60.0, poll=5.0):
+        self.slots = max(1, int(slots))
+        self.devices = DeviceLeaseManager(str(gpus).split(",")) if str(gpus).strip() else None
+        self.log_folder = log_folder
+        self.job_memory = float(job_memory)
+        self.ramp = float(ramp)
+        self.poll = float(poll)
+        self.memory = threading.Condition()
+        self.running = 0
+        self.started = []	# Start times of the running jobs, the memory of the jobs started in the last ramp seconds is reserved
+        self.print_lock = threading.Lock()
+
+    def log(self, text):
+        with self.print_lock:
+            print(text, flush=True)
+
+    # Waits until the available memory is enough for a new job (if job_memory is given) and registers the job as running, returns the start time
+
+    def _acquire(self):
+        with self.memory:
+            while self.job_memory > 0 and self.running > 0:
+                now = time.time()
+                reserved = self.job_memory * sum(1 for start in self.started if now - start < self.ramp)
+                free = available_memory()
+                if free is None or free - reserved >= self.job_memory:
+                    break
+                self.memory.wait(self.poll)
+            start = time.time()
+            self.running += 1
+            self.started.append(start)
+            return start
+
+    def _release(self, start):
+        with self.memory:
+            self.running -= 1
+            self.started.remove(start)
+            self.memory.notify_all()
+
+    # Runs one job (on a leased GPU device if devices are given), returns (script, exit code, wall time in seconds, skipped)
+
+    def _run(self, job):
+        script, log_folder = job
+        log_file, done_file = job_files(script, log_folder)
+        if os.path.exists(done_file) and os.path.getmtime(done_file) >= os.path.getmtime(script):
+            self.log("Job " + script + " has already been completed, skipping it")
+            return script, 0, 0.0, True
+        if os.path.exists(done_file):
+            os.remove(done_file)
+        if self.devices is None:
+            start = self._acquire()
+            try:
+                self.log("Job " + script + " has been started, log: " + log_file)
+                code = run_job(script, log_file)
+            finally:
+                self._release(start)
+        else:
+            with self.devices.lease() as device:
+                start = self._acquire()
+                try:
+                    self.log("Job " + script + " has been started on GPU " + device + ", log: " + log_file)
+                    code = run_job(script, log_file, device)
+                finally:
+                    self._release(start)
+        seconds = time.time() - start
+        if code == 0:
+            with open(done_file, "w") as f:
+                f.write("%.2f\n" % seconds)
+            self.log("Job %s is completed (%.2f seconds)" % (script, seconds))
+        else:
+            self.log("Job %s has failed with exit code %d after %.2f seconds, see %s" % (script, code, seconds, log_file))
+        return script, code, seconds, False
+
+    # Runs the job scripts of a folder, raises RuntimeError after all jobs have finished if any of them has failed
+
+    def run_folder(self, folder):
+        log_folder = self.log_folder or os.path.join(folder, "logs")
+        os.makedirs(log_folder, exist_ok=True)
+        jobs = [(script, log_folder) for script in job_scripts(folder)]
+        if not jobs:
+            return []
+        slots = min(self.slots, len(jobs))
+        if self.devices is not None:
+            slots = min(slots, len(self.devices.devices))
+        start = time.time()
+        pool = ThreadPool(processes=slots)
+        results = pool.map(self._run, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+        print(format_job_timings(results, time.time() - start))
+        failed = [script for script, code, seconds, skipped in results if code != 0]
+        if failed:
+            raise RuntimeError(str(len(failed)) + " of " + str(len(jobs)) + " jobs have failed (logs in " + log_folder + "): " + ", ".join(os.path.basename(script) for script in failed))
+        return results
+
+
+# Function to format the wall times of the jobs (the results of JobRunner.run_folder) for printing
+
+def format_job_timings(results, wall_time):
+    ran = [result for result in results if not result[3]]
+    job_time = sum(result[2] for result in ran)
+    text = "Job timings (%d jobs, %d skipped):" % (len(results), len(results) - len(ran))
+    for script, code, seconds, skipped in results:
+        text += "\n  %-40s %s" % (os.path.basename(script), "skipped" if skipped else "%10.2f s%s" % (seconds, "" if code == 0 else "  (failed)"))
+    if ran and wall_time > 0:
+        text += "\n  Sum of the job times: %.2f s, wall time: %.2f s (%.2f jobs running on average)" % (job_time, wall_time, job_time / wall_time)
+    return text
+
+
+# Function to run every job script of a folder (the simple_job and simple_job_predictions folders of Deep-Docking) in at most slots jobs at the same time
+
+def run_job_scripts(folder, slots=1, gpus="", log_folder="", job_memory=0.0):
+    return JobRunner(slots, gpus, log_folder, job_memory).run_folder(folder)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--folder',required=True,help='Folder of the job scripts (e.g. iteration_1/simple_job/)')
+    parser.add_argument('-slots', '--slots',required=False,default=1,help='Number of jobs run at the same time (default: 1)')
+    parser.add_argument('-gpus', '--gpus',required=False,default='',help='Comma separated GPU devices, every running job uses one of them (default: the jobs are not bound to devices)')
+    parser.add_argument('-log', '--log_folder',required=False,default='',help='Folder of the log files (default: logs in the folder of the jobs)')
+    parser.add_argument('-mem', '--job_memory',required=False,default=0,help='Memory of one job in GB, a job only starts if this much memory is available (default: 0, no memory limit)')
+    io_args = parser.parse_args()
+    try:
+        run_job_scripts(io_args.folder, io_args.slots, io_args.gpus, io_args.log_folder, io_args.job_memory)
+    except RuntimeError as e:
+        sys.exit("ERROR: " + str(e))
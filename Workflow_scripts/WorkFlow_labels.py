@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Writer of the Deep-Docking label files (testing_labels.txt, training_labels.txt, validation_labels.txt).
+# The score file of the smiles2score main scripts (ZINC_ID r_i_docking_score lines) is converted into the sorted r_i_docking_score,ZINC_ID format of Deep-Docking.
+# Small label sets are sorted in memory with pandas. Label sets larger than chunk_rows are sorted in chunks, the sorted chunks are written into temporary files and merged (external sort).
+
+import os
+import heapq
+import tempfile
+from itertools import chain
+import pandas as pd
+
+
+HEADER = "r_i_docking_score,ZINC_ID\n"
+
+
+# Function to read the score file in chunks of chunk_rows rows, the rows without a valid score are dropped
+
+def read_scores(score_file, chunk_rows):
+    reader = pd.read_csv(score_file, sep=r"\s+", header=None, names=["ZINC_ID", "r_i_docking_score"], usecols=[0, 1], dtype=str, chunksize=chunk_rows)
+    for chunk in reader:
+        chunk["r_i_docking_score"] = pd.to_numeric(chunk["r_i_docking_score"], errors="coerce")	# The header line and incomplete lines are dropped
+        yield chunk.dropna()
+
+
+# Function to write the sorted label file of Deep-Docking from a score file of the smiles2score main scripts
+
+def write_labels(score_file, label_file, chunk_rows=5000000):
+    chunks = read_scores(score_file, chunk_rows)
+    first = next(chunks, None)
+    second = next(chunks, None)
+
+    # The whole label set fits into one chunk: sorting in memory
+
+    if second is None:
+        data = first if first is not None else pd.DataFrame({"ZINC_ID": [], "r_i_docking_score": []})
+        data = data.sort_values(by="r_i_docking_score", kind="mergesort")
+        with open(label_file, "w") as labels:
+            labels.write(HEADER)
+            data.to_csv(labels, columns=["r_i_docking_score", "ZINC_ID"], header=False, index=False)
+        return len(data)
+
+    # External sort: every chunk is sorted and written into a temporary run file, then the runs are merged
+
+    folder = os.path.dirname(os.path.abspath(label_file))
+    runs = []
+    rows = 0
+    try:
+        for chunk in chain([first, second], chunks):
+            chunk = chunk.sort_values(by="r_i_docking_score", kind="mergesort")
+            run = tempfile.NamedTemporaryFile("w", dir=folder, prefix=".labels_run_", suffix=".csv", delete=False)
+            chunk.to_csv(run, columns=["r_i_docking_score", "ZINC_ID"], header=False, index=False)
+            run.close()
+            runs.append(run.name)
+            rows += len(chunk)
+        files = [open(name, "r") for name in runs]
+        try:
+            with open(label_file, "w") as labels:
+                labels.write(HEADER)
+                labels.writelines(heapq.merge(*files, key=lambda line: float(line.split(",", 1)[0])))
+        finally:
+            for f in files:
+                f.close()
+    finally:
+        for name in runs:
+            os.remove(name)
+    return rows
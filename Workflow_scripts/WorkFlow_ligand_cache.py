@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Disk cache of prepared 3D ligands, shared by the Deep-Docking iterations and by the test, train and validation sets.
+# The prepared pdbqt (AutoDockGPU) or sdf (Glide) block of a molecule is stored under a key made of the canonical smiles, the protonation and local optimization settings and the file format.
+# Each block is a separate file (cache_folder/ab/abcdef....pdbqt), so the processes of the pool can read and write the cache at the same time.
+# The cache is limited by its size, the least recently used blocks are deleted first (see evict).
+
+import os
+import hashlib
+
+
+class LigandCache:
+
+    def __init__(self, folder, max_size_gb=10):
+        self.folder = str(folder)
+        self.max_size = int(float(max_size_gb) * 1024**3)
+        os.makedirs(self.folder, exist_ok=True)
+
+    # Returns the key of a molecule, the same molecule prepared with other settings gets another key
+
+    def key(self, canonical_smiles, protonation, localopt, fmt):
+        text = "%s|prot=%s|loc=%s|fmt=%s" % (canonical_smiles, protonation, localopt, fmt)
+        return hashlib.sha1(text.encode()).hexdigest() + "." + str(fmt)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    # Returns the cached block or None, the modification time of the block is updated for the eviction
+
+    def get(self, key):
+        name = self._path(key)
+        try:
+            with open(name, "r") as f:
+                block = f.read()
+            os.utime(name)
+            return block
+        except OSError:
+            return None
+
+    # Stores a block, it is written into a temporary file first, so other processes never read a half written block
+
+    def put(self, key, block):
+        name = self._path(key)
+        if os.path.exists(name):
+            return
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        tmp_name = name + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp_name, "w") as f:
+                f.write(block)
+            os.replace(tmp_name, name)
+        except OSError:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+    # Deletes the least recently used blocks until the size of the cache is below the limit, returns the number of deleted blocks
+
+    def evict(self):
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        deleted = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError:
+                pass
+            total -= size
+        return deleted
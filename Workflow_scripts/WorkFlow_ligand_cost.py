@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Docking cost estimate of the ligands for the cost-aware batching of AutoDockGPU.
+# The run time of AutoDockGPU grows with the size of the ligand and with the number of its torsions (the length of the genotype searched by the Lamarckian GA), so the cost of a ligand is estimated from its heavy atoms and rotatable bonds.
+# The descriptors are calculated once from the smiles (OpenBabel, without a 3D structure), and the input file is rewritten sorted by the cost, the most expensive ligands first.
+# The cost of every line of the sorted file is saved next to it ({sorted}.cost: ID, heavy atoms, torsions, cost), so a continued run does not calculate it again.
+# The docking subjobs cut from the sorted file contain ligands of similar size, and cost_ranges cuts it into parts of equal total cost, so the GPUs finish at about the same time.
+# With small batches (-bs) the batches are handed out from a shared queue in the order of the file (the most expensive first), so the last batches are the cheapest ones.
+# To install openbabel: conda install -c conda-forge openbabel
+
+import os
+import argparse
+import multiprocessing as mp
+import numpy as np
+from openbabel import openbabel
+from WorkFlow_line_index import split_smiles_line
+from WorkFlow_shards import merge_shards
+
+
+TORSION_WEIGHT = 0.25	# Relative cost of a torsion per heavy atom
+COST_SUFFIX = ".cost"
+conversion = None
+
+
+# Function to return the heavy atoms and the rotatable bonds of a smiles, (0, 0) if it cannot be read
+
+def ligand_descriptors(smiles):
+    global conversion
+    if conversion is None:
+        openbabel.obErrorLog.SetOutputLevel(0)
+        conversion = openbabel.OBConversion()
+        conversion.SetInFormat("smi")
+    mol = openbabel.OBMol()
+    if not conversion.ReadString(mol, str(smiles)):
+        return 0, 0
+    return mol.NumHvyAtoms(), mol.NumRotors()
+
+
+# Function to return the estimated docking cost of a ligand from its descriptors
+
+def ligand_cost(heavy_atoms, torsions):
+    return heavy_atoms * (1.0 + TORSION_WEIGHT * torsions)
+
+
+# Function to calculate the descriptors and the cost of one line of a smi file, returns (line, ID, heavy atoms, torsions, cost)
+
+def line_cost(line):
+    tr = split_smiles_line(line)
+    if len(tr) != 2:
+        return line, "", 0, 0, 0.0	# Invalid lines are kept, they are reported by the ligand preparation
+    heavy_atoms, torsions = ligand_descriptors(tr[0])
+    return line, tr[1], heavy_atoms, torsions, ligand_cost(heavy_atoms, torsions)
+
+
+# Function to read the costs saved next to a sorted file, None if they are missing or do not belong to the file
+
+def read_costs(sorted_name):
+    cost_name = sorted_name + COST_SUFFIX
+    if not (os.path.exists(sorted_name) and os.path.exists(cost_name)) or os.path.getmtime(cost_name) < os.path.getmtime(sorted_name):
+        return None
+    with open(cost_name, "r") as f:
+        costs = [float(line.split()[-1]) for line in f if line.strip()]
+    with open(sorted_name, "r") as f:
+        lines = sum(1 for line in f)
+    return costs if len(costs) == lines else None
+
+
+# Function to write the lines of a smi file sorted by the estimated cost (the most expensive first) and their costs ({sorted}.cost), returns the costs in the order of the sorted file
+# The descriptors are calculated on processes processes, the sorted file and the cost file are written into temporary files which are renamed at the end (see WorkFlow_shards.py)
+
+def sort_by_cost(input_name, sorted_name, processes=1):
+    with open(input_name, "r") as f:
+        lines = [line if line.endswith("\n") else line + "\n" for line in f if line.strip()]
+    if int(processes) > 1 and len(lines) > 1000:
+        with mp.Pool(processes=int(processes)) as pool:
+            records = pool.map(line_cost, lines, chunksize=1000)
+    else:
+        records = [line_cost(line) for line in lines]
+    records.sort(key=lambda record: -record[4])	# Stable, the ligands of the same cost keep the order of the input file
+    tmp_name = sorted_name + ".tmp"
+    with open(tmp_name, "w") as f:
+        f.writelines(record[0] for record in records)
+    with open(tmp_name + COST_SUFFIX, "w") as f:
+        f.writelines("%s %d %d %.2f\n" % (record[1] or "-", record[2], record[3], record[4]) for record in records)
+    merge_shards(sorted_name, [tmp_name], remove=True)
+    merge_shards(sorted_name + COST_SUFFIX, [tmp_name + COST_SUFFIX], remove=True)
+    return [record[4] for record in records]
+
+
+# Function to cut the lines of a sorted file into n_parts ranges of about the same total cost, returns (start, end) line ranges
+# The ranges contain at least one line (if there are enough lines), so the expensive ranges at the beginning of the file are shorter
+
+def cost_ranges(costs, n_parts):
+    n_parts = min(int(n_parts), len(costs))
+    if n_parts <= 0:
+        return []
+    cumulative = np.cumsum(np.asarray(costs, dtype=float))
+    total = cumulative[-1]
+    ends = []
+    for part in range(1, n_parts):
+        end = int(np.searchsorted(cumulative, total * part / n_parts, side="left")) + 1
+        end = max(end, (ends[-1] if ends else 0) + 1)	# At least one line in every range
+        end = min(end, len(costs) - (n_parts - part))	# At least one line left for each of the next ranges
+        ends.append(end)
+    ends.append(len(costs))
+    return list(zip([0] + ends[:-1], ends))
+
+
+# Function to format the estimated cost of the ranges for printing
+
+def format_costs(costs, ranges):
+    total = float(sum(costs)) or 1.0
+    text = "Estimated docking cost of the subjobs (heavy atoms x (1 + %.2f x torsions)):" % TORSION_WEIGHT
+    for part, (start, end) in enumerate(ranges):
+        cost = float(sum(costs[start:end]))
+        text += "\n  subjob %d: %d ligands, cost %.0f (%.1f%%)" % (part, end - start, cost, 100.0 * cost / total)
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input_name',required=True,help='Input smi file')
+    parser.add_argument('-o', '--output_name',required=True,help='Sorted smi file (the costs are written into {output}.cost)')
+    parser.add_argument('-sj', '--n_subjobs',required=False,default=1,help='Number of subjobs of equal cost printed (default: 1)')
+    parser.add_argument('-n', '--n_cpu',required=False,default=1,help='Number of CPUs to use (default: 1)')
+    io_args = parser.parse_args()
+    costs = sort_by_cost(io_args.input_name, io_args.output_name, io_args.n_cpu)
+    print(format_costs(costs, cost_ranges(costs, io_args.n_subjobs)))
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Ligand preparation library of the smiles2score scripts.
+# The main scripts import it and run the preparation on their own process pool, the smiles2score_sub scripts are command line wrappers around the same functions.
+# The protonator (DimorphiteDL), the OpenBabel converters, the 3D builder and the force field are created once in every process of the pool (see init_worker) and the molecules are streamed through them.
+# The engine measures the time spent in the preparation stages, so the cost of the setup and of the individual steps can be compared.
+# If a cache folder is given, the prepared molecules are looked up in the ligand cache (WorkFlow_ligand_cache.py) before the 3D structure is generated.
+# If a trace file is given, the stage times of every ligand are written into the trace shard of the process (WorkFlow_trace.py).
+# The lines of a subjob are cut into small chunks (chunk_size lines, PREP_CHUNK by default) which the processes of the pool take one by one (imap_unordered), so a chunk of slow ligands (e.g. macrocycles) only holds up its own process and the other processes continue with the next chunks.
+# If a maps.fld file is given for the prefilter, the prepared AutoDockGPU ligands are checked against the grid box (WorkFlow_grid_maps.py) and the ligands that cannot fit into the box are not sent to docking.
+# To install openbabel: conda install -c conda-forge openbabel
+# To install dimorphite_dl: python3 pip install dimorphite_dl and copy it to the proper place e.g. anaconda3/envs/my-rdkit-env/lib/python3.9/site-packages/
+
+import os
+import math
+import time
+from contextlib import contextmanager
+from openbabel import openbabel
+from dimorphite_dl import DimorphiteDL
+from WorkFlow_line_index import load_line_index, read_lines, split_smiles_line
+from WorkFlow_ligand_cache import LigandCache
+from WorkFlow_grid_maps import GridPrefilter
+from WorkFlow_trace import process_writer
+from WorkFlow_shards import shard_name, merge_shards, remove_shards
+
+
+STAGES = ("setup", "read", "cache", "protonation", "embedding", "localopt", "prefilter", "write")
+PREP_CHUNK = 10	# Default number of lines of one preparation task
+
+
+# Class to sum up the time spent in each stage of the ligand preparation
+
+class StageTimer:
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.ligands = 0
+        self.cache_hits = 0
+        self.filtered = 0
+        self.ligand = {}	# Stage times of the current ligand
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] += seconds
+            self.ligand[name] = self.ligand.get(name, 0.0) + seconds
+
+    # Returns the stage times of the current ligand and starts the next ligand
+
+    def take_ligand(self):
+        ligand = self.ligand
+        self.ligand = {}
+        return ligand
+
+    # Returns the collected timings and starts a new measurement
+
+    def pop(self):
+        result = {"ligands": self.ligands, "cache_hits": self.cache_hits, "filtered": self.filtered, "seconds": dict(self.seconds)}
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.ligands = 0
+        self.cache_hits = 0
+        self.filtered = 0
+        return result
+
+
+# Function to sum up the timings returned by the processes (StageTimer.pop) and format them for printing
+
+def format_timings(timings):
+    ligands = sum(t["ligands"] for t in timings)
+    cache_hits = sum(t.get("cache_hits", 0) for t in timings)
+    filtered = sum(t.get("filtered", 0) for t in timings)
+    seconds = dict.fromkeys(STAGES, 0.0)
+    for t in timings:
+        for name, value in t["seconds"].items():
+            seconds[name] += value
+    text = "Ligand preparation stage timings (summed over the processes, %d ligands):" % ligands
+    for name in STAGES:
+        per_ligand = 1000 * seconds[name] / ligands if ligands else 0.0
+        text += "\n  %-12s %10.2f s  %8.2f ms/ligand" % (name, seconds[name], per_ligand)
+    if cache_hits:
+        text += "\n  %d ligands were taken from the ligand cache" % cache_hits
+    if filtered:
+        text += "\n  %d ligands were dropped by the grid prefilter" % filtered
+    return text
+
+
+# Class holding the reusable objects of the ligand preparation
+
+class LigandPrepEngine:
+
+    def __init__(self, protonation="no", localopt="no", cache_folder="", cache_size=10, prefilter_map="", trace_file="", iteration=""):
+        self.timer = StageTimer()
+        with self.timer.stage("setup"):
+            self.settings = (str(protonation), str(localopt))
+            self.localopt = str(localopt) == "yes"
+            self.protonator = None
+            if str(protonation) == "yes":
+                self.protonator = DimorphiteDL(
+                  min_ph=7.4,
+                  max_ph=7.4,
+                  max_variants=10,
+                  label_states=False,
+                  pka_precision=1.0
+                )
+            self.reader = openbabel.OBConversion()
+            self.reader.SetInFormat("smi")
+            self.cache = None
+            if cache_folder:
+                self.cache = LigandCache(cache_folder, cache_size)
+                self.canonicalizer = openbabel.OBConversion()
+                self.canonicalizer.SetInAndOutFormats("smi", "can")
+            self.writers = {}
+            self.builder = openbabel.OBBuilder()
+            self.forcefield = openbabel.OBForceField.FindForceField("mmff94")
+            self.prefilter = None
+            if prefilter_map:
+                self.prefilter = GridPrefilter(prefilter_map)	# Only the box of the maps.fld header is read
+            self.trace = process_writer(trace_file, {"iteration": iteration}) if trace_file else None
+        self.timer.take_ligand()	# The setup is not the time of the first ligand
+
+    # Iterating through the lines of the input file, the time of reading is measured
+
+    def read(self, lines):
+        lines = iter(lines)
+        while True:
+            with self.timer.stage("read"):
+                line = next(lines, None)
+            if line is None:
+                return
+            yield line
+
+    # Finding the correct protonation state of ligand with dimorphite_dl (the smiles is returned unchanged if protonation is not required)
+
+    def protonate(self, smiles):
+        if self.protonator is None:
+            return smiles
+        with self.timer.stage("protonation"):
+            return self.protonator.protonate(smiles)[0]
+
+    # Smiles conversion to a 3D OpenBabel molecule, the same steps as pybel's addh(), make3D() and localopt() with the shared builder and force field
+
+    def make3D(self, smiles):
+        with self.timer.stage("embedding"):
+            mol = openbabel.OBMol()
+            if not self.reader.ReadString(mol, smiles):
+                raise ValueError("Invalid smiles: " + str(smiles))
+            mol.AddHydrogens()	# Adding hydrogens
+            self.builder.Build(mol)	# Making 3D structure
+            mol.AddHydrogens()
+            self._optimize(mol, 50)
+
+        # Perform local optimization if required
+
+        if self.localopt:
+            with self.timer.stage("localopt"):
+                self._optimize(mol, 500)
+        return mol
+
+    # Returns the prepared molecule in the given format (pdbqt or sdf) as text: protonation, 3D structure generation and local optimization, or the block found in the ligand cache
+
+    def prepare(self, smiles, fmt):
+        self.timer.ligands += 1
+        key = None
+        if self.cache is not None:
+            with self.timer.stage("cache"):
+                mol = openbabel.OBMol()
+                if self.canonicalizer.ReadString(mol, smiles):
+                    key = self.cache.key(self.canonicalizer.WriteString(mol).split()[0], self.settings[0], self.settings[1], fmt)
+                    block = self.cache.get(key)
+                    if block is not None:
+                        self.timer.cache_hits += 1
+                        return block
+        mol = self.make3D(self.protonate(smiles))
+        with self.timer.stage("write"):
+            block = self._writer(fmt).WriteString(mol)
+        if key is not None and finite_coordinates(mol):	# A failed embedding (NaN coordinates) is not cached, the next run can generate the 3D structure again
+            with self.timer.stage("cache"):
+                self.cache.put(key, block)
+        return block
+
+    # Checks a prepared pdbqt block with the grid prefilter, returns (True, None) if the ligand is docked or (False, reason) if it is dropped
+
+    def check(self, block):
+        if self.prefilter is None:
+            return True, None
+        with self.timer.stage("prefilter"):
+            ok, result = self.prefilter.check(block)
+        if not ok:
+            self.timer.filtered += 1
+        return ok, result
+
+    # Writes the stage times of the current ligand into the trace (if there is one), the times of the next ligand start from zero
+
+    def trace_ligand(self, ID, subjob=None, error=False):
+        ligand = self.timer.take_ligand()
+        if self.trace is None:
+            return
+        record = {"stage": "prep", "ID": str(ID), "subjob": subjob}
+        record.update({name: round(seconds, 6) for name, seconds in ligand.items()})
+        record["total"] = round(sum(ligand.values()), 6)
+        if error:
+            record["error"] = True
+        self.trace.write(record)
+
+    # Writes the buffered trace records into the shard of the process (at the end of every task)
+
+    def flush_trace(self):
+        if self.trace is not None:
+            self.trace.flush()
+
+    def _optimize(self, mol, steps):
+        if self.forcefield is None or not self.forcefield.Setup(mol):
+            return
+        self.forcefield.SteepestDescent(steps)
+        self.forcefield.GetCoordinates(mol)
+
+    def _writer(self, fmt):
+        if fmt not in self.writers:
+            writer = openbabel.OBConversion()
+            if not writer.SetOutFormat(fmt):
+                raise ValueError(str(fmt) + " is not a recognised Open Babel format")
+            self.writers[fmt] = writer
+        return self.writers[fmt]
+
+    # Writing a prepared molecule (see prepare) into a file
+
+    def write_file(self, block, filename):
+        with self.timer.stage("write"):
+            with open(filename, "w") as f:
+                f.write(block)
+
+
+# Function to check if all coordinates of a molecule are finite (OpenBabel can return NaN coordinates if the 3D structure generation fails)
+
+def finite_coordinates(mol):
+    for atom in openbabel.OBMolAtomIter(mol):
+        if not (math.isfinite(atom.GetX()) and math.isfinite(atom.GetY()) and math.isfinite(atom.GetZ())):
+            return False
+    return True
+
+
+# The engine of the current process, created by init_worker
+
+engine = None
+
+
+# Function to create the engine once per process, use it as the initializer of the multiprocessing pool
+
+def init_worker(protonation="no", localopt="no", cache_folder="", cache_size=10, prefilter_map="", trace_file="", iteration=""):
+    global engine
+    engine = LigandPrepEngine(protonation, localopt, cache_folder, cache_size, prefilter_map, trace_file, iteration)
+
+
+# Function to return the engine of the current process
+
+def get_engine():
+    if engine is None:
+        raise RuntimeError("The ligand preparation engine has not been initialized, call init_worker first")
+    return engine
+
+
+# Function to cut the lines between start and end - 1 into ranges of chunk_size lines, or into n_parts equal ranges if chunk_size is 0
+
+def chunk_ranges(start, end, n_parts, chunk_size=PREP_CHUNK):
+    if int(chunk_size) <= 0:
+        return split_range(start, end, n_parts)
+    return [(part_start, min(part_start + int(chunk_size), int(end))) for part_start in range(int(start), int(end), int(chunk_size))]
+
+
+# Function to run a preparation task of the pool: (function, arguments...)
+
+def run_task(task):
+    return task[0](*task[1:])
+
+
+# Function to run the preparation tasks on the pool, the tasks are taken by the processes one by one in the order in which they become free, returns the timings of the tasks
+
+def run_tasks(pool, tasks):
+    return list(pool.imap_unordered(run_task, tasks, chunksize=1))
+
+
+# Function to divide the lines between start and end - 1 into n_parts ranges, the last range contains the rest of the lines if the number of lines divided by n_parts is not an integer
+
+def split_range(start, end, n_parts):
+    size = (int(end) - int(start)) // int(n_parts)
+    ranges = []
+    for count in range(int(n_parts)):
+        part_start = int(start) + size * count
+        if count == int(n_parts) - 1:
+            part_end = int(end)
+        else:
+            part_end = int(start) + size * (count + 1)
+        ranges.append((part_start, part_end))
+    return ranges
+
+
+# Function to convert the ligands between start and end - 1 into pdbqt files and write the entries of the AutoDockGPU batch file (runs in the processes of the pool)
+# Every task writes its own shard of the batch and ID files (see WorkFlow_shards.py)
+# The ligands dropped by the grid prefilter are written only into the ID file, so they are reported as dropped ligands after the docking
+
+def prepare_autodock_range(input_name, start, end, fb_file, ID_file, subjob=None):
+    engine = get_engine()
+    fb = open(fb_file, 'w')
+    IDfile = open(ID_file, 'w')
+
+    # Extracting smiles stings based on the line number in the .smi input file
+
+    lines = read_lines(input_name, start, end, load_line_index(input_name))
+    for line in engine.read(lines):
+        print(line)
+        tr = split_smiles_line(line)
+        if len(tr) != 2:
+            print("Invalid number of columns for line: " + str(line))
+            continue
+        smiles = tr[0]
+        ID = tr[1]
+
+        # Converting the ligands into pdbqt and writing the batch files' entries
+
+        error = False
+        try:
+            name = "tmp"+str(ID)+".pdbqt"
+            IDfile.write(str(ID) + "\n")
+
+            # Smiles conversion from smi to 3D pdbqt (or reading it from the ligand cache), protonation and local optimization are performed by the engine if required
+
+            block = engine.prepare(smiles, "pdbqt")
+            ok, result = engine.check(block)
+            if not ok:
+                print("Ligand " + str(ID) + " has been dropped by the grid prefilter: " + str(result))
+                continue
+            engine.write_file(block, name)
+            fb.write("\n" + "./"+ name)
+            fb.write("\n" + "Ligand_"+str(ID))
+        except:
+            print("Error during conversion of ligand: "+str(ID))
+            error = True
+        finally:
+            engine.trace_ligand(ID, subjob, error)
+
+    fb.close()	# Closes the batch file
+    IDfile.close()	# Closes the ID file
+    engine.flush_trace()
+    return engine.timer.pop()	# Stage timings of this range
+
+
+# Function to set the header of an sdf record in memory: the title line is the ID of the ligand, followed by the program and the comment lines expected by Glide
+
+def title_sdf(block, ID):
+    lines = block.split("\n", 3)
+    header = [str(ID), "                    3D", " Created by OpenBabel"]
+    for k in range(min(3, len(lines))):
+        lines[k] = header[k]
+    return "\n".join(lines)
+
+
+# Function to convert the ligands between start and end - 1 into 3D structures and write them into a shard of the sdf ligand file of Glide (runs in the processes of the pool)
+# The titled sdf records are generated in memory and streamed into the file through one buffered writer
+
+def prepare_glide_range(input_name, start, end, fb_file, subjob=None):
+    engine = get_engine()
+    fb = open(fb_file, 'w', buffering=1024*1024)
+
+    # Extracting smiles stings based on the line number in the .smi input file
+
+    lines = read_lines(input_name, start, end, load_line_index(input_name))
+    for line in engine.read(lines):
+        print(line)
+        tr = split_smiles_line(line)
+        if len(tr) != 2:
+            print("Invalid number of columns for line: " + str(line))
+            continue
+        smiles = tr[0]
+        ID = tr[1]
+
+        error = False
+        try:
+
+            # Smiles conversion from smi to 3D sdf (or reading it from the ligand cache), protonation and local optimization are performed by the engine if required
+
+            block = engine.prepare(smiles, "sdf")
+            with engine.timer.stage("write"):
+                fb.write(title_sdf(block, ID))
+        except:
+            print("Error during conversion of ligand: "+str(ID))
+            error = True
+        engine.trace_ligand(ID, subjob, error)
+
+    fb.close()	# Closes the ligand file
+    engine.flush_trace()
+    return engine.timer.pop()	# Stage timings of this range
+
+
+# Function to return the names of the batch file (Batch_py{count}.txt) and the ID file (Lig_IDs_{count}.txt) of an AutoDockGPU docking subjob
+
+def autodock_batch_names(count):
+    return "Batch_py" + str(count) + ".txt", "Lig_IDs_" + str(count) + ".txt"
+
+
+# Function to prepare the ligands of one AutoDockGPU docking subjob on the pool
+# The lines are cut into tasks of chunk_size lines (or n_parts equal tasks if chunk_size is 0), the shards of the tasks are merged in the order of the lines into the batch file (Batch_py{count}.txt) and the ID file (Lig_IDs_{count}.txt) at the end
+
+def prepare_autodock_batch(pool, input_name, count, map_name, start, end, n_parts, chunk_size=PREP_CHUNK):
+    fb_file, ID_file = autodock_batch_names(count)
+    load_line_index(input_name)	# Building the line index before the tasks start
+    ranges = chunk_ranges(start, end, n_parts, chunk_size)
+    tasks = [(prepare_autodock_range, input_name, part_start, part_end, shard_name(fb_file, part), shard_name(ID_file, part), count) for part, (part_start, part_end) in enumerate(ranges)]
+    try:
+        timings = run_tasks(pool, tasks)
+        merge_shards(fb_file, [task[4] for task in tasks], header=map_name)
+        merge_shards(ID_file, [task[5] for task in tasks])
+    finally:
+        remove_shards([task[4] for task in tasks] + [task[5] for task in tasks])
+    return timings
+
+
+# Function to prepare a small AutoDockGPU batch in one task of the pool, the task writes the batch and ID files itself (used by the pipeline mode of the main script)
+
+def prepare_autodock_chunk(input_name, count, map_name, start, end):
+    fb_file, ID_file = autodock_batch_names(count)
+    try:
+        timings = prepare_autodock_range(input_name, start, end, shard_name(fb_file, 0), shard_name(ID_file, 0), count)
+        merge_shards(fb_file, [shard_name(fb_file, 0)], header=map_name)
+        merge_shards(ID_file, [shard_name(ID_file, 0)])
+    finally:
+        remove_shards([shard_name(fb_file, 0), shard_name(ID_file, 0)])
+    return timings
+
+
+# Function to prepare the ligands of one Glide docking subjob on the pool into a single sdf file (Ligand_file_{count}.sdf)
+# The lines are cut into tasks of chunk_size lines (or n_parts equal tasks if chunk_size is 0), the shards of the tasks are merged in the order of the lines into the sdf file at the end
+
+def prepare_glide_batch(pool, input_name, count, start, end, n_parts, chunk_size=PREP_CHUNK):
+    fb_file = "Ligand_file_" + str(count) + ".sdf"
+    load_line_index(input_name)	# Building the line index before the tasks start
+    ranges = chunk_ranges(start, end, n_parts, chunk_size)
+    tasks = [(prepare_glide_range, input_name, part_start, part_end, shard_name(fb_file, part), count) for part, (part_start, part_end) in enumerate(ranges)]
+    try:
+        timings = run_tasks(pool, tasks)
+        merge_shards(fb_file, [task[4] for task in tasks])
+    finally:
+        remove_shards([task[4] for task in tasks])
+    return timings
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Line-offset index for the .smi input files of the smiles2score scripts.
+# The index stores the byte offset of the beginning of every line, so a worker can seek straight to the first line of its start/end slice instead of rescanning the file from the top for every line.
+# The index is saved next to the input file (e.g. test_smiles_final_updated.smi.lidx) and it is rebuilt automatically if the input file has changed.
+# Lines can be separated either by spaces or by tabs (smiles ID).
+
+import os
+from array import array
+
+
+INDEX_SUFFIX = ".lidx"
+_loaded = {}	# Indexes already loaded by this process, keyed by file name
+
+
+# Function to collect the byte offsets of the line starts in one sequential pass
+
+def build_line_index(filename):
+    offsets = array('q')
+    pos = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            offsets.append(pos)
+            pos += len(line)
+    return offsets
+
+
+# Function to return the line index of a file, the saved index is used if it belongs to the current version of the file
+
+def load_line_index(filename):
+    index_file = str(filename) + INDEX_SUFFIX
+    stat = os.stat(filename)
+    key = (stat.st_size, stat.st_mtime_ns)
+    if filename in _loaded and _loaded[filename][0] == key:
+        return _loaded[filename][1]
+    offsets = _read_index_file(index_file, key)
+    if offsets is None:
+        offsets = _write_index_file(filename, index_file, key)
+    _loaded[filename] = (key, offsets)
+    return offsets
+
+
+# Function to read a saved index, None is returned if it is missing or it belongs to another version of the file
+
+def _read_index_file(index_file, key):
+    header = array('q')
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'rb') as f:
+                header.fromfile(f, 2)
+                if tuple(header) == key:
+                    offsets = array('q')
+                    offsets.frombytes(f.read())
+                    return offsets
+        except (EOFError, OSError, ValueError):
+            pass
+    return None
+
+
+# Function to build a new index and save it with the size and modification time of the input file
+# The index is written into a temporary file first, so parallel processes never read a half written index
+
+def _write_index_file(filename, index_file, key):
+    offsets = build_line_index(filename)
+    tmp_file = index_file + ".tmp" + str(os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            array('q', key).tofile(f)
+            offsets.tofile(f)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return offsets
+
+
+# Function to return the lines between start and end - 1 (line numbers start from 0)
+
+def read_lines(filename, start, end, offsets=None):
+    if offsets is None:
+        offsets = load_line_index(filename)
+    end = min(int(end), len(offsets))
+    start = int(start)
+    if start >= end:
+        return
+    with open(filename, 'rb') as f:
+        f.seek(offsets[start])
+        for _ in range(start, end):
+            yield f.readline().decode()
+
+
+# Function to split a line of the .smi file into columns (smiles and ID), separated by spaces or tabs
+
+def split_smiles_line(line):
+    return line.strip().split()
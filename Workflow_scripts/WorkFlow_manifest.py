@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Checkpoint manifest of the smiles2score main scripts.
+# The manifest file records which subjobs (ligand chunks) have been prepared and docked and whether the scores have been merged into the output files.
+# A rerun of the same command with the same input files finds the manifest and continues the run: docked chunks are skipped and prepared chunks are only docked.
+# The first line of the manifest is the key of the run (hash of the input files and the settings), a manifest of another run is not used.
+
+import os
+import json
+import hashlib
+import threading
+
+
+# Function to calculate the key of a run from the content of the input files and the settings (the same chunks are only reused for the same run)
+
+def run_key(files, settings):
+    sha = hashlib.sha1()
+    for name in files:
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                sha.update(block)
+        sha.update(b"\0")
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+class RunManifest:
+
+    def __init__(self, manifest_file, key):
+        self.manifest_file = str(manifest_file)
+        self.key = key
+        self.states = {}
+        self.lock = threading.Lock()
+        self.resumed = self._load()
+        if not self.resumed:
+            with open(self.manifest_file, "w") as f:
+                f.write(json.dumps({"run": self.key}) + "\n")
+
+    # Reads the states of the chunks from an earlier manifest of the same run, returns False if there is no such manifest
+
+    def _load(self):
+        if not os.path.exists(self.manifest_file):
+            return False
+        with open(self.manifest_file, "r") as f:
+            lines = f.readlines()
+        try:
+            if json.loads(lines[0]).get("run") != self.key:
+                return False
+        except (IndexError, ValueError):
+            return False
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue	# Incomplete last line of a crashed run
+            self.states.setdefault(record["chunk"], set()).add(record["state"])
+        return True
+
+    # Returns True if the chunk has reached the state ("prepared", "docked" or "merged")
+
+    def done(self, chunk, state):
+        with self.lock:
+            return state in self.states.get(chunk, ())
+
+    # Records the new state of a chunk, the line is flushed to the disk at once so it survives a crash of the node
+
+    def mark(self, chunk, state):
+        with self.lock:
+            self.states.setdefault(chunk, set()).add(state)
+            with open(self.manifest_file, "a") as f:
+                f.write(json.dumps({"chunk": chunk, "state": state}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # Deletes the manifest at the end of a completed run
+
+    def remove(self):
+        if os.path.exists(self.manifest_file):
+            os.remove(self.manifest_file)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Live progress metrics of the workflow in the Prometheus text format.
+# The *_DeepDocking_script.py files and the smiles2score main scripts keep their counters and gauges in a MetricsFile, which is written into a .prom file on an interval by a background thread (and at the end of the run).
+# Without a file name the metrics are kept but not written, so the scripts update them the same way if no metrics file is requested.
+# The file is written into a temporary file which is renamed, so a reader never sees a half-written file. The textfile collector of the node exporter (--collector.textfile.directory) can scrape the folder of the .prom files.
+# The metrics (prefix uhtvs_):
+#   ligands_total, ligands_prepared_total, ligands_docked_total, ligands_dropped_total     ligands of the docking run
+#   gpu_busy_seconds_total{device}     busy time of the GPU devices (AutoDockGPU)
+#   queue_depth{queue}     subjobs or batches waiting for the preparation and prepared ones waiting for a GPU
+#   phase{phase}, iteration, eta_seconds     current phase (1 for the current phase, 0 for the others), Deep-Docking iteration and estimated remaining time
+#   steps_total, steps_completed, step_running{step}     steps of the workflow (*_DeepDocking_script.py)
+# Reading a metrics file (the stand-in scraper):
+#   python WorkFlow_metrics.py -i uhtvs_project_docking.prom -watch 30
+
+import os
+import re
+import time
+import argparse
+import threading
+
+
+PREFIX = "uhtvs_"
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+# Function to format the labels of a sample ({name="value",...})
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for key, value in sorted(labels.items())) + "}"
+
+
+class MetricsFile:
+
+    def __init__(self, filename, labels=None, interval=15.0):
+        self.filename = str(filename)
+        self.labels = {key: str(value) for key, value in (labels or {}).items() if value not in (None, "")}	# Labels of every sample, e.g. the project
+        self.interval = float(interval)
+        self.metrics = {}	# name: [type, help, {labels: value}]
+        self.collectors = []	# Functions called before every write, they update the metrics which are read from other objects (e.g. the GPU busy times)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.set("start_time_seconds", round(time.time(), 3), help="Start time of the run (unix time)")
+
+    def _sample(self, name, kind, help, labels):
+        metric = self.metrics.setdefault(PREFIX + name, [kind, help, {}])
+        if help:
+            metric[1] = help
+        return metric[2], tuple(sorted((labels or {}).items()))
+
+    # Sets the value of a gauge (or of a counter which is read from another object, e.g. the busy time of a GPU)
+
+    def set(self, name, value, labels=None, help="", kind="gauge"):
+        with self.lock:
+            samples, key = self._sample(name, kind, help, labels)
+            samples[key] = value
+
+    # Adds to the value of a counter (or of a gauge, e.g. a queue depth)
+
+    def inc(self, name, value=1, labels=None, help="", kind="counter"):
+        with self.lock:
+            samples, key = self._sample(name, kind, help, labels)
+            samples[key] = samples.get(key, 0) + value
+
+    def get(self, name, labels=None):
+        with self.lock:
+            metric = self.metrics.get(PREFIX + name)
+            return metric[2].get(tuple(sorted((labels or {}).items())), 0) if metric else 0
+
+    # Sets the current phase, its gauge is 1 and the gauges of the earlier phases are 0
+
+    def phase(self, phase):
+        with self.lock:
+            samples, _ = self._sample("phase", "gauge", "Current phase of the run (1 for the current phase)", None)
+            for key in samples:
+                samples[key] = 0
+        self.set("phase", 1, {"phase": phase})
+
+    def collect(self, function):
+        self.collectors.append(function)
+
+    # Returns the metrics in the Prometheus text format
+
+    def render(self):
+        for function in self.collectors:
+            try:
+                function(self)
+            except Exception as e:
+                print("Metrics collector failed: " + str(e))
+        self.set("last_update_seconds", round(time.time(), 3), help="Time of the last update of the metrics file (unix time)")
+        lines = []
+        with self.lock:
+            for name in sorted(self.metrics):
+                kind, help, samples = self.metrics[name]
+                if help:
+                    lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for key, value in samples.items():
+                    labels = dict(self.labels)
+                    labels.update(key)
+                    lines.append("%s%s %s" % (name, format_labels(labels), repr(float(value)) if isinstance(value, float) else value))
+        return "\n".join(lines) + "\n"
+
+    # Writes the metrics into the file (a temporary file is renamed, so the file is always complete)
+
+    def write(self):
+        if not self.filename:
+            return
+        text = self.render()
+        tmp_name = self.filename + ".tmp"
+        with open(tmp_name, "w") as f:
+            f.write(text)
+        os.replace(tmp_name, self.filename)
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print("Metrics file " + self.filename + " could not be written: " + str(e))
+
+    # Starts writing the file on the interval in a background thread
+
+    def start(self):
+        if not self.filename:
+            return self
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.write()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        return self
+
+    # Stops the background thread and writes the final values
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.write()
+
+
+# Function to estimate the remaining time from the progress (done of total) since the start time, None if it is not known yet
+
+def eta_seconds(done, total, start):
+    elapsed = time.time() - start
+    if done <= 0 or elapsed <= 0:
+        return None
+    return max(0.0, (total - done) * elapsed / done)
+
+
+# Function to return the collector of the docking metrics of a smiles2score main script: the GPU busy times (if a DeviceLeaseManager is given) and the ETA of the docking from the docked and dropped ligands
+
+def docking_collector(devices=None):
+    def collect(metrics):
+        if devices is not None:
+            for device, seconds in devices.usage().items():
+                metrics.set("gpu_busy_seconds_total", round(seconds, 3), {"device": device}, help="Busy time of the GPU device in seconds", kind="counter")
+        start = metrics.get("docking_start_seconds")
+        if start:
+            eta = eta_seconds(metrics.get("ligands_docked_total") + metrics.get("ligands_dropped_total"), metrics.get("ligands_total"), start)
+            if eta is not None:
+                metrics.set("eta_seconds", round(eta, 1), help="Estimated remaining time of the docking in seconds")
+    return collect
+
+
+# Function to return the collector of the workflow metrics of a StepRunner (WorkFlow_steps.py): the steps, the running steps, the current iteration and the ETA of the steps
+
+def step_collector(runner):
+    def collect(metrics):
+        progress = runner.progress()
+        metrics.set("steps_total", progress["total"], help="Number of the steps of the workflow")
+        metrics.set("steps_completed", progress["completed"], help="Number of the completed (or skipped) steps of the workflow")
+        with metrics.lock:
+            metrics.metrics.pop(PREFIX + "step_running", None)	# Only the running steps are listed
+        for name in progress["running"]:
+            metrics.set("step_running", 1, {"step": name}, help="Running steps of the workflow")
+        if progress["iteration"] is not None:
+            metrics.set("iteration", progress["iteration"], help="Current Deep-Docking iteration")
+        if progress["running"]:
+            metrics.phase(progress["running"][0].split("/")[-1])
+        elif progress["completed"] == progress["total"]:
+            metrics.phase("completed")
+        if progress["eta"] is not None:
+            metrics.set("eta_seconds", round(progress["eta"], 1), help="Estimated remaining time of the workflow in seconds (from the wall times of the completed steps)")
+    return collect
+
+
+# Function to parse a metrics file in the Prometheus text format, returns (name, labels, value) samples
+
+def parse_metrics(text):
+    samples = []
+    for line in text.splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        match = SAMPLE_LINE.match(line)
+        if match is None:
+            continue
+        labels = {key: value.replace('\\"', '"').replace("\\n", "\n").replace("\\\\", "\\") for key, value in LABEL.findall(match.group(2) or "")}
+        samples.append((match.group(1), labels, float(match.group(3))))
+    return samples
+
+
+def read_metrics(filename):
+    with open(filename, "r") as f:
+        return parse_metrics(f.read())
+
+
+# Function to format the samples of a metrics file for printing (without the labels of every sample)
+
+def format_metrics(samples):
+    common = None	# Labels of every sample
+    for name, labels, value in samples:
+        common = dict(labels) if common is None else {key: label for key, label in common.items() if labels.get(key) == label}
+    common = common or {}
+    text = "Metrics " + format_labels(common) + ":"
+    for name, labels, value in samples:
+        own = {key: label for key, label in labels.items() if key not in common}
+        text += "\n  %-60s %s" % (name + format_labels(own), "%.0f" % value if value == int(value) and abs(value) < 1e15 else "%.3f" % value)
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input',required=True,help='Metrics file (.prom) written by the workflow')
+    parser.add_argument('-watch', '--watch',required=False,default=0,help='Read the file again every watch seconds (default: 0, read it once)')
+    io_args = parser.parse_args()
+    while True:
+        print(format_metrics(read_metrics(io_args.input)))
+        if float(io_args.watch) <= 0:
+            break
+        time.sleep(float(io_args.watch))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Persistent store of docking scores (SQLite), so a molecule is never docked twice against the same grid with the same settings.
+# The scores are keyed by the ligand ID, the hash of the grid file(s) and the docking settings (docking program, protonation, local optimization).
+# The smiles2score main scripts look up the input molecules first, dock only the missing ones and add the new scores to the store at the end.
+
+import os
+import hashlib
+import sqlite3
+from WorkFlow_line_index import split_smiles_line
+
+
+# Function to calculate the hash of the grid, for an AutoDock maps.fld file the map files listed in it are included as well
+
+def grid_hash(grid_file):
+    sha = hashlib.sha1()
+    files = [grid_file]
+    if str(grid_file).endswith(".fld"):
+        folder = os.path.dirname(grid_file)
+        with open(grid_file, "r") as fld:
+            for line in fld:
+                if line.startswith("variable") and "file=" in line:
+                    files.append(os.path.join(folder, line.split("file=")[1].split()[0]))
+    for name in files:
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+class ScoreStore:
+
+    def __init__(self, db_file, grid_file, settings):
+        self.db_file = str(db_file)
+        self.grid = grid_hash(grid_file)
+        self.settings = str(settings)
+        db = self._connect()
+        try:
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS scores (ligand_id TEXT NOT NULL, grid TEXT NOT NULL, settings TEXT NOT NULL, score REAL NOT NULL, PRIMARY KEY (ligand_id, grid, settings))")
+        finally:
+            db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=600)
+
+    # Returns the stored scores of the given IDs as a dictionary (ID: score), IDs that have not been docked yet are missing from it
+
+    def lookup(self, IDs):
+        IDs = list(IDs)
+        found = {}
+        db = self._connect()
+        try:
+            for i in range(0, len(IDs), 500):
+                part = IDs[i:i+500]
+                query = "SELECT ligand_id, score FROM scores WHERE grid = ? AND settings = ? AND ligand_id IN (%s)" % ",".join("?" * len(part))
+                for ID, score in db.execute(query, [self.grid, self.settings] + part):
+                    found[ID] = score
+        finally:
+            db.close()
+        return found
+
+    # Adds (ID, score) pairs to the store, scores that are already stored are kept
+
+    def add(self, pairs):
+        db = self._connect()
+        try:
+            with db:
+                db.executemany("INSERT OR IGNORE INTO scores (ligand_id, grid, settings, score) VALUES (?, ?, ?, ?)", ((str(ID), self.grid, self.settings, float(score)) for ID, score in pairs))
+        finally:
+            db.close()
+
+    # Adds the scores of an output file of the smiles2score main scripts (ZINC_ID r_i_docking_score lines) to the store, returns the number of scores read
+
+    def add_output_file(self, output_name):
+        pairs = []
+        with open(output_name, "r") as f:
+            for line in f:
+                tr = line.split()
+                if len(tr) != 2:
+                    continue
+                try:
+                    pairs.append((tr[0], float(tr[1])))
+                except ValueError:
+                    continue	# Header line or an incomplete docking result
+        self.add(pairs)
+        return len(pairs)
+
+    # Splits an input smi file: the stored scores of the molecules are appended to the output file and the molecules without stored scores are written into todock_name
+    # Returns the number of stored and the number of missing molecules
+
+    def split_input(self, input_name, output_name, todock_name):
+        with open(input_name, "r") as f:
+            lines = [line for line in f if line.strip()]
+        scores = self.lookup(split_smiles_line(line)[-1] for line in lines)
+        missing = 0
+        written = set()
+        with open(output_name, "a") as out, open(todock_name, "w") as todock:
+            for line in lines:
+                ID = split_smiles_line(line)[-1]
+                if ID in scores:
+                    if ID not in written:	# Duplicated IDs are written only once
+                        out.write(str(ID) + " " + str(scores[ID]) + "\n")
+                        written.add(ID)
+                else:
+                    todock.write(line if line.endswith("\n") else line + "\n")
+                    missing += 1
+        return len(lines) - missing, missing
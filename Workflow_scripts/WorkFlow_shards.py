@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Shard files of the workflow.
+# The processes and threads never append to a shared file (batch files, ID files, score files, Dropped_ligands.txt): every worker writes its own shard file, and the shards are merged in one step at the end.
+# The merged file is written into a temporary file first and renamed, so a file is either complete or missing, also on NFS.
+# Files which grow over many runs (the trace file) get their shards appended instead, so the earlier content is not rewritten.
+
+import os
+import shutil
+
+
+# Function to return the name of a shard of a file (e.g. Batch_py3.txt.part0)
+
+def shard_name(filename, part):
+    return str(filename) + ".part" + str(part)
+
+
+# Function to merge the shard files into filename after the header, the missing shards are skipped
+# The shards are deleted after the merge if remove is True
+
+def merge_shards(filename, shards, header="", remove=False):
+    tmp_name = str(filename) + ".tmp" + str(os.getpid())
+    try:
+        with open(tmp_name, "w") as merged:
+            merged.write(header)
+            for name in shards:
+                if not os.path.exists(name):
+                    continue
+                with open(name, "r") as shard:
+                    shutil.copyfileobj(shard, merged)
+            merged.flush()
+            os.fsync(merged.fileno())
+        os.replace(tmp_name, filename)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    if remove:
+        remove_shards(shards)
+
+
+# Function to append the shard files to the end of filename (for files that grow over many runs, e.g. the trace file), the missing shards are skipped
+# Only the shards are copied, the earlier content of the file is not rewritten; a shard is deleted as soon as it has been appended and synced
+# If the file does not end with a new line (an interrupted earlier append), a new line is written first, so the next line starts on its own line
+
+def append_shards(filename, shards):
+    with open(filename, "ab") as merged:
+        if merged.tell() > 0:
+            with open(filename, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    merged.write(b"\n")
+        for name in shards:
+            if not os.path.exists(name):
+                continue
+            with open(name, "rb") as shard:
+                shutil.copyfileobj(shard, merged)
+            merged.flush()
+            os.fsync(merged.fileno())
+            os.remove(name)
+
+
+# Function to delete shard files
+
+def remove_shards(shards):
+    for name in shards:
+        if os.path.exists(name):
+            os.remove(name)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# ID index of the split smiles files of the library (split_smiles/*.txt, lines of smiles ID).
+# For every smiles file the index stores the sorted 64 bit hashes of the IDs and the byte offsets of their lines, so the smiles of a list of IDs are read by seeking to their lines instead of scanning the whole library.
+# The index of a file ({index folder}/{file}.hash.npy, .offset.npy and .key) is rebuilt automatically if the smiles file has changed.
+#
+# The script can also replace the Extracting_smiles.py step of Deep-Docking: the smiles of the IDs of the train, valid and test sets of the iteration ({project}/iteration_{it}/{set}_set.txt) are written into the smile/{set}_smiles_final_updated.smi files
+#   python WorkFlow_smiles_index.py -pt {project} -fp {project folder} -it {iteration} -smd {smiles folder} -t_pos {processes}
+# or the smiles of any list of IDs (one ID per line) are written into a .smi file
+#   python WorkFlow_smiles_index.py -smd {smiles folder} -ids IDs.txt -o IDs.smi
+
+import os
+import glob
+import argparse
+import multiprocessing as mp
+import numpy as np
+from WorkFlow_line_index import split_smiles_line
+from WorkFlow_fingerprints import id_hashes
+
+
+# Function to return the default index folder of a smiles folder
+
+def default_index_folder(smiles_folder):
+    return os.path.join(str(smiles_folder), ".smiles_index")
+
+
+# Function to build (or reuse) the index of one smiles file, returns the number of indexed lines
+
+def index_file(smiles_file, index_folder):
+    base = os.path.join(index_folder, os.path.basename(smiles_file))
+    stat = os.stat(smiles_file)
+    key = str(stat.st_size) + " " + str(stat.st_mtime_ns)
+    if os.path.exists(base + ".key"):
+        with open(base + ".key", "r") as f:
+            if f.read().strip() == key:
+                return len(np.load(base + ".offset.npy", mmap_mode="r"))
+    IDs = []
+    offsets = []
+    pos = 0
+    with open(smiles_file, "rb") as f:
+        for line in f:
+            tr = split_smiles_line(line.decode())
+            if tr:
+                IDs.append(tr[-1])
+                offsets.append(pos)
+            pos += len(line)
+    hashes = id_hashes(IDs)
+    order = np.argsort(hashes, kind="stable")
+    np.save(base + ".hash.tmp.npy", hashes[order])
+    np.save(base + ".offset.tmp.npy", np.array(offsets, dtype=np.int64)[order])
+    os.replace(base + ".hash.tmp.npy", base + ".hash.npy")
+    os.replace(base + ".offset.tmp.npy", base + ".offset.npy")
+    with open(base + ".key", "w") as f:	# The key is written last, an interrupted build is repeated
+        f.write(key + "\n")
+    return len(IDs)
+
+
+# Function to build the index of every smiles file (*.txt) of a folder, the files are indexed by n_proc processes
+
+def build_smiles_index(smiles_folder, index_folder=None, n_proc=1, pattern="*.txt"):
+    index_folder = index_folder or default_index_folder(smiles_folder)
+    os.makedirs(index_folder, exist_ok=True)
+    files = sorted(glob.glob(os.path.join(str(smiles_folder), pattern)))
+    if int(n_proc) > 1 and len(files) > 1:
+        with mp.Pool(processes=min(int(n_proc), len(files))) as pool:
+            counts = pool.starmap(index_file, [(name, index_folder) for name in files])
+    else:
+        counts = [index_file(name, index_folder) for name in files]
+    return sum(counts)
+
+
+class SmilesIndex:
+
+    def __init__(self, smiles_folder, index_folder=None, n_proc=1, pattern="*.txt"):
+        self.folder = str(smiles_folder)
+        self.index_folder = index_folder or default_index_folder(smiles_folder)
+        build_smiles_index(self.folder, self.index_folder, n_proc, pattern)
+        self.files = sorted(glob.glob(os.path.join(self.folder, pattern)))
+
+    def _index(self, smiles_file):
+        base = os.path.join(self.index_folder, os.path.basename(smiles_file))
+        return np.load(base + ".hash.npy", mmap_mode="r"), np.load(base + ".offset.npy", mmap_mode="r")
+
+    # Returns the lines of the IDs as a dictionary (ID: line), IDs that are not in the library are missing from it
+    # The candidate lines are read file by file in the order of their offsets, and the ID of every line is checked (a hash can belong to more than one ID)
+
+    def lookup(self, IDs):
+        IDs = list(dict.fromkeys(str(ID) for ID in IDs))
+        hashes = id_hashes(IDs)
+        found = {}
+        for smiles_file in self.files:
+            file_hashes, file_offsets = self._index(smiles_file)
+            if len(file_hashes) == 0:
+                continue
+            left = np.searchsorted(file_hashes, hashes, side="left")
+            right = np.searchsorted(file_hashes, hashes, side="right")
+            candidates = []
+            for pos in np.nonzero(right > left)[0]:
+                if IDs[pos] in found:
+                    continue
+                for k in range(left[pos], right[pos]):
+                    candidates.append((int(file_offsets[k]), int(pos)))
+            if not candidates:
+                continue
+            candidates.sort()
+            with open(smiles_file, "rb") as f:
+                for offset, pos in candidates:
+                    f.seek(offset)
+                    line = f.readline().decode()
+                    tr = split_smiles_line(line)
+                    if tr and tr[-1] == IDs[pos] and IDs[pos] not in found:
+                        found[IDs[pos]] = line if line.endswith("\n") else line + "\n"
+        return found
+
+    # Writes the smiles lines of the IDs into a .smi file (in the order of the IDs), returns the number of written and missing IDs
+
+    def extract(self, IDs, out_file):
+        IDs = list(dict.fromkeys(str(ID) for ID in IDs))
+        found = self.lookup(IDs)
+        with open(out_file, "w") as out:
+            for ID in IDs:
+                if ID in found:
+                    out.write(found[ID])
+        return len(found), len(IDs) - len(found)
+
+
+# Function to read a list of IDs (one ID per line, only the first column of comma separated lines is used)
+
+def read_IDs(id_file):
+    with open(id_file, "r") as f:
+        return [line.split(",")[0].strip() for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-smd', '--smile_directory',required=True,help='Folder of the split smiles files')
+    parser.add_argument('-idx', '--index_folder',required=False,default='',help='Folder of the index (default: .smiles_index in the smiles folder)')
+    parser.add_argument('-t_pos', '--tot_process',required=False,default=1,help='Number of processes building the index')
+    parser.add_argument('-pt', '--protein_name',required=False,default='',help='Name of the Deep-Docking project')
+    parser.add_argument('-fp', '--file_path',required=False,default='',help='Folder of the Deep-Docking project (without the project name)')
+    parser.add_argument('-it', '--n_iteration',required=False,default='',help='Number of the iteration')
+    parser.add_argument('-ids', '--id_file',required=False,default='',help='File of IDs to extract, one ID per line (instead of the sets of an iteration)')
+    parser.add_argument('-o', '--output_name',required=False,default='',help='Output .smi file of the IDs of -ids')
+    io_args = parser.parse_args()
+
+    index = SmilesIndex(io_args.smile_directory, io_args.index_folder or None, io_args.tot_process)
+    if io_args.id_file:
+        written, missing = index.extract(read_IDs(io_args.id_file), io_args.output_name)
+        print(str(written) + " smiles have been extracted, " + str(missing) + " IDs have not been found")
+    else:
+        iteration_folder = os.path.join(io_args.file_path, io_args.protein_name, "iteration_" + str(io_args.n_iteration))
+        os.makedirs(os.path.join(iteration_folder, "smile"), exist_ok=True)
+        for data_set in ("train", "valid", "test"):
+            written, missing = index.extract(read_IDs(os.path.join(iteration_folder, data_set + "_set.txt")), os.path.join(iteration_folder, "smile", data_set + "_smiles_final_updated.smi"))
+            print(data_set + " set: " + str(written) + " smiles have been extracted, " + str(missing) + " IDs have not been found")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Step engine of the *_DeepDocking_script.py files.
+# Every step of the workflow (a shell command or a python function) is declared with its input and output files, the steps producing the inputs of a step (or listed in after) have to be completed before it starts.
+# The steps whose dependencies are completed run at the same time (at most max_parallel steps, e.g. Extracting_morgan and Extracting_smiles).
+# The completed steps are recorded with their wall time in a state file (one JSON line per step). A step is skipped if it has been completed with the same command and its outputs exist (non-empty files or folders), so a rerun of the driver continues where it was stopped, also in the middle of an iteration.
+# A step is run again if one of the steps it depends on has been run again.
+# The progress of the run (completed and running steps, current iteration, estimated remaining time) is returned by progress(), e.g. for the metrics file (WorkFlow_metrics.py).
+
+import os
+import re
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Step:
+
+    def __init__(self, name, command, inputs=(), outputs=(), after=()):
+        self.name = name
+        self.command = command	# Shell command (str) or a python function without arguments
+        self.inputs = [str(name) for name in inputs]
+        self.outputs = [str(name) for name in outputs]
+        self.after = list(after)	# Names of the steps which have to be completed before this step (if they are not found from the inputs)
+
+    # Returns the key of the command, a step completed with another command is run again
+
+    def key(self):
+        return self.command if isinstance(self.command, str) else self.name
+
+    def execute(self):
+        if isinstance(self.command, str):
+            return subprocess.check_output(self.command, shell=True, universal_newlines=True)
+        return self.command()
+
+
+# Function to check an output of a step: a non-empty file or a folder containing at least one file
+
+def valid_output(name):
+    if os.path.isdir(name):
+        return len(os.listdir(name)) > 0
+    return os.path.isfile(name) and os.path.getsize(name) > 0
+
+
+class StepRunner:
+
+    def __init__(self, state_file, max_parallel=2):
+        self.state_file = str(state_file)
+        self.max_parallel = max(1, int(max_parallel))
+        self.steps = {}
+        self.records = {}
+        self.lock = threading.Lock()
+        self.print_lock = threading.Lock()
+        self.finished = set()	# Steps completed or skipped in this run
+        self.active = {}	# Running steps with their start time
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue	# Incomplete last line of a crashed run
+                    self.records[record["step"]] = record
+
+    def add(self, step):
+        self.steps[step.name] = step
+        return step
+
+    # Returns the names of the steps which have to be completed before the step (only the steps added to the runner)
+
+    def dependencies(self, step):
+        producers = {output: other.name for other in self.steps.values() for output in other.outputs}
+        deps = [producers[name] for name in step.inputs if name in producers and producers[name] != step.name]
+        deps += [name for name in step.after if name in self.steps]
+        return list(dict.fromkeys(deps))
+
+    # Returns True if the step has been completed with the same command and its outputs are still there
+
+    def completed(self, step):
+        record = self.records.get(step.name)
+        return record is not None and record.get("key") == step.key() and all(valid_output(name) for name in step.outputs)
+
+    # Prints a message of the runner, the messages of the steps running at the same time are not mixed
+
+    def log(self, text):
+        with self.print_lock:
+            print(text, flush=True)
+
+    def _record(self, step, seconds):
+        record = {"step": step.name, "key": step.key(), "seconds": round(seconds, 2), "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with self.lock:
+            self.records[step.name] = record
+            with open(self.state_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _execute(self, step):
+        missing = [name for name in step.inputs if not os.path.exists(name)]
+        if missing:
+            raise RuntimeError("Missing input(s) of step " + step.name + ": " + ", ".join(missing))
+        self.log("Step " + step.name + " has been started")
+        start = time.time()
+        with self.lock:
+            self.active[step.name] = start
+        try:
+            step.execute()
+        finally:
+            with self.lock:
+                self.active.pop(step.name, None)
+        seconds = time.time() - start
+        for name in step.outputs:
+            if not valid_output(name):
+                raise RuntimeError("Step " + step.name + " has not written its output: " + name)
+        self._record(step, seconds)
+        self.log("Step %s is completed (%.2f seconds)" % (step.name, seconds))
+        return seconds
+
+    # Runs the steps in the order of their dependencies, the completed steps are skipped
+    # If a step fails, the running steps are finished and the error of the failed step is raised
+
+    def run(self):
+        deps = {name: self.dependencies(step) for name, step in self.steps.items()}
+        for name in self.steps:
+            for dep in deps[name]:
+                if dep not in self.steps:
+                    raise ValueError("Unknown step: " + str(dep))
+        finished = self.finished = set()
+        rerun = set()	# Steps which have been run in this run, the steps depending on them are run again
+        waiting = list(self.steps)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            while waiting or running:
+                if error is None:
+                    for name in [name for name in waiting if all(dep in finished for dep in deps[name])]:
+                        step = self.steps[name]
+                        if not any(dep in rerun for dep in deps[name]) and self.completed(step):
+                            self.log("Step " + name + " has already been completed, skipping it")
+                            waiting.remove(name)
+                            finished.add(name)
+                            continue
+                        if len(running) < self.max_parallel:
+                            waiting.remove(name)
+                            running[executor.submit(self._execute, step)] = name
+                    if waiting and not running and not any(all(dep in finished for dep in deps[name]) for name in waiting):
+                        raise ValueError("Circular dependency between the steps: " + ", ".join(waiting))
+                if not running:
+                    if error is not None or not waiting:
+                        break
+                    continue	# Steps were skipped, new steps may be ready
+                done, pending = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        finished.add(name)
+                        rerun.add(name)
+                    except Exception as e:
+                        self.log("Step " + name + " has failed: " + str(e))
+                        if error is None:
+                            error = e
+        if error is not None:
+            raise error
+        return finished
+
+    # Returns the estimated wall time of a step: its recorded time, or the mean time of the steps of the same kind in the other iterations (e.g. iteration_*/docking), or the mean time of all recorded steps
+
+    def estimate(self, name):
+        with self.lock:
+            records = dict(self.records)
+        if name in records:
+            return records[name]["seconds"]
+        kind = name.split("/")[-1]
+        seconds = [record["seconds"] for step, record in records.items() if step.split("/")[-1] == kind]
+        if not seconds:
+            seconds = [record["seconds"] for record in records.values()]
+        return sum(seconds) / len(seconds) if seconds else None
+
+    # Returns the progress of the run: the number of steps, the completed steps, the running steps, the current iteration and the estimated remaining time (None if no step has been recorded yet)
+    # The remaining time is the sum of the estimated times of the steps which have not been completed, as most of the steps depend on the previous ones
+
+    def progress(self):
+        now = time.time()
+        with self.lock:
+            active = dict(self.active)
+            finished = set(self.finished)
+        eta = 0.0
+        for name in self.steps:
+            if name in finished:
+                continue
+            seconds = self.estimate(name)
+            if seconds is None:
+                eta = None
+                break
+            eta += max(0.0, seconds - (now - active[name])) if name in active else seconds
+        iteration = None
+        for name in list(active) or [name for name in self.steps if name in finished][-1:]:
+            match = re.match(r"iteration_([0-9]+)/", name)
+            if match:
+                iteration = int(match.group(1))
+                break
+        return {"total": len(self.steps), "completed": len(finished), "running": sorted(active), "iteration": iteration, "eta": eta}
+
+    # Returns the recorded wall times of the steps as text
+
+    def report(self):
+        text = "Wall time of the workflow steps:"
+        for name in self.steps:
+            record = self.records.get(name)
+            if record is not None:
+                text += "\n  %-50s %10.2f s  (%s)" % (name, record["seconds"], record["finished"])
+        return text
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Per-ligand stage trace of the smiles2score scripts (one JSON record per line).
+# The records are tagged with the subjob and the iteration, the times are in seconds:
+#   {"stage": "prep", "ID", "subjob", "iteration", "read", "cache", "protonation", "embedding", "localopt", "prefilter", "write", "total"}     preparation of a ligand
+#   {"stage": "dock", "ID", "subjob", "iteration", "dock", "parse"}     docking of a ligand by AutoDockGPU (the time between its result and the result of the previous ligand of the batch) and parsing of its output
+#   {"stage": "dock_batch", "subjob", "iteration", "ligands", "scored", "dock", "parse"}     a Glide docking job and the reading of its scores
+# Every process writes its own shard ({trace}.part{pid}, see WorkFlow_shards.py), and the shards are appended to the trace file at the end of the run.
+#
+# Summary of a trace (percentiles of the stages and the slowest ligands):
+#   python WorkFlow_trace.py -i ligand_trace.jsonl -top 10
+
+import os
+import glob
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from WorkFlow_shards import shard_name, append_shards
+
+
+TAGS = ("stage", "ID", "subjob", "iteration", "ligands", "scored", "time", "error")
+
+
+class TraceWriter:
+
+    def __init__(self, filename, tags=None):
+        self.filename = filename
+        self.tags = {key: value for key, value in (tags or {}).items() if value not in (None, "")}
+        self.file = open(filename, "a")
+        self.lock = threading.Lock()
+
+    # Writes a record, the tags of the writer (e.g. the iteration) and the time are added to it
+
+    def write(self, record):
+        record = dict(record)
+        for key, value in self.tags.items():
+            record.setdefault(key, value)
+        record["time"] = round(time.time(), 3)
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# Function to return the trace writer of the current process, the shard of the process is used ({trace}.part{pid})
+
+def process_writer(trace_file, tags=None):
+    return TraceWriter(shard_name(trace_file, os.getpid()), tags)
+
+
+# Function to append the shards of the processes to the trace file and delete them, the records of the earlier runs (iterations) are not rewritten
+
+def merge_trace(trace_file):
+    shards = sorted(glob.glob(glob.escape(str(trace_file)) + ".part*"))
+    if not shards:
+        return
+    append_shards(trace_file, shards)
+
+
+# Function to read the records of trace files, the records can be filtered by iteration
+
+def read_trace(trace_files, iteration=None):
+    records = []
+    for name in trace_files:
+        with open(name, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue	# Incomplete last line of a crashed run
+                if iteration is None or str(record.get("iteration")) == str(iteration):
+                    records.append(record)
+    return records
+
+
+# Function to return the summary of the records as text: percentiles of every stage and the slowest ligands of the preparation and the docking
+
+def summarize(records, top=10):
+    text = ""
+    for stage in ("prep", "dock", "dock_batch"):
+        stage_records = [record for record in records if record.get("stage") == stage]
+        if not stage_records:
+            continue
+        keys = [key for key in dict.fromkeys(key for record in stage_records for key in record) if key not in TAGS]
+        text += "\n%s records: %d" % (stage, len(stage_records))
+        if stage == "prep":
+            text += " (%d failed)" % sum(1 for record in stage_records if record.get("error"))
+        text += "\n  %-12s %10s %10s %10s %10s %10s %12s" % ("seconds", "mean", "p50", "p90", "p99", "max", "total")
+        for key in keys:
+            values = np.array([record[key] for record in stage_records if isinstance(record.get(key), (int, float))], dtype=float)
+            if len(values) == 0:
+                continue
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            text += "\n  %-12s %10.4f %10.4f %10.4f %10.4f %10.4f %12.2f" % (key, values.mean(), p50, p90, p99, values.max(), values.sum())
+        sort_key = {"prep": "total", "dock": "dock", "dock_batch": "dock"}[stage]
+        slowest = sorted((record for record in stage_records if isinstance(record.get(sort_key), (int, float))), key=lambda record: record[sort_key], reverse=True)[:int(top)]
+        text += "\n  Slowest %s records (by %s):" % (stage, sort_key)
+        for record in slowest:
+            label = str(record.get("ID")) if stage != "dock_batch" else "%s ligands" % record.get("ligands")
+            parts = ", ".join("%s %.3f" % (key, record[key]) for key in keys if isinstance(record.get(key), (int, float)) and key != sort_key)
+            text += "\n    %-24s %10.3f s  subjob %s, iteration %s  (%s)" % (label, record[sort_key], record.get("subjob"), record.get("iteration"), parts)
+        text += "\n"
+    return text if text else "No records have been found"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input',required=True,nargs='+',help='Trace file(s) (ligand_trace.jsonl)')
+    parser.add_argument('-it', '--iteration',required=False,default=None,help='Only the records of this iteration (default: all records)')
+    parser.add_argument('-top', '--top',required=False,default=10,help='Number of the slowest ligands listed (default: 10)')
+    io_args = parser.parse_args()
+    print(summarize(read_trace(io_args.input, io_args.iteration), io_args.top))